@@ -67,6 +67,10 @@ extern "C" {
 } while(0)
 #endif
 
+// used by the generated AOT *Profile functions, see JIT_AOT_TYPE_PROFILE
+extern int aot_type_profile_enabled;
+void aot_type_profile_record(const char* func, int nargs, PyObject** args);
+
 JIT_HELPER1(PRINT_EXPR, value);
 JIT_HELPER_WITH_OPARG(RAISE_VARARGS);
 JIT_HELPER1(GET_AITER, obj);
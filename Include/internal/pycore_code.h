@@ -105,6 +105,10 @@ enum _PyOpcache_LoadAttr_Types {
 
     // Used for polymorphic sites where we store an array of _PyOpcaches
     LA_CACHE_POLYMORPHIC = 8,
+
+    // Used for sites which saw more types than fit into the polymorphic cache.
+    // The entries are stored in a global cache keyed by type version and attribute name.
+    LA_CACHE_MEGAMORPHIC = 9,
 };
 typedef struct {
     union {
@@ -166,7 +170,12 @@ typedef struct {
             struct _PyOpcache* caches; // pointer to array of _PyOpcaches with num_entries
             char num_entries;
             char num_used;
+            unsigned int num_misses; // how often none of the entries matched
         } poly_cache;
+        struct {
+            unsigned long num_hits;
+            unsigned long num_misses;
+        } megamorphic_cache;
     } u;
     short type_tp_dictoffset;  /* tp_dictoffset of type */
     char cache_type;
@@ -576,6 +576,11 @@ PyAPI_DATA(PyObject) _Py_NoneStruct; /* Don't use this directly */
 // Immortalize an object, and use tp_traverse to recursively immortalize
 // objects it references.
 PyAPI_FUNC(void) _Py_Immortalize(PyObject*);
+
+// Same as _Py_Immortalize but works for arbitrary large object graphs and reports the
+// number of newly immortalized objects and their approximate size.
+// Returns -1 on error.
+PyAPI_FUNC(int) _Py_ImmortalizeReachable(PyObject*, Py_ssize_t* num_objects, Py_ssize_t* num_bytes);
 #else
 #define Py_INCREF_IMMORTAL(obj) Py_INCREF(obj)
 #define Py_XINCREF_IMMORTAL(obj) Py_XINCREF(obj)
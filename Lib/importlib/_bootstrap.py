@@ -587,6 +587,10 @@ def _exec(spec, module):
         if sys.modules.get(name) is not module:
             msg = 'module {!r} not in sys.modules'.format(name)
             raise ImportError(msg, name=name)
+        hook = module.__dict__.get('__getattr__')
+        if isinstance(hook, _DeferredExec):
+            # Reloading a lazily imported module which was never executed.
+            hook.detach()
         try:
             if spec.loader is None:
                 if spec.submodule_search_locations is None:
@@ -687,6 +691,101 @@ def _load_unlocked(spec):
 
     return module
 
+
+# Lazy imports ################################################################
+
+# Modules listed here (a package entry also covers its submodules) get
+# imported without executing their body. The body runs on the first access of
+# an attribute which the import system did not set: the module gets a
+# __getattr__() hook (PEP 562) which executes it. Packages also get their
+# __path__ removed until then, so importing a submodule or a 'from' import
+# executes the package first, just like a normal import would.
+_lazy_imports = None
+# Report executions of deferred module bodies in the -X importtime format.
+_lazy_import_time = False
+
+
+def _set_lazy_imports(names):
+    global _lazy_imports
+    _lazy_imports = frozenset(names) if names else None
+
+
+def _is_lazy_import(spec):
+    # Only for modules with Python code, builtin and extension modules don't
+    # have a body which could be deferred.
+    if not isinstance(spec.loader, (_bootstrap_external.SourceFileLoader,
+                                    _bootstrap_external.SourcelessFileLoader)):
+        return False
+    name = spec.name
+    while name:
+        if name in _lazy_imports:
+            return True
+        name = name.rpartition('.')[0]
+    return False
+
+
+class _DeferredExec:
+
+    """The __getattr__() hook of a module which has not been executed yet."""
+
+    def __init__(self, spec, module, path):
+        self.spec = spec
+        self.module = module
+        self.path = path
+
+    def __call__(self, attr):
+        self.exec_module()
+        return getattr(self.module, attr)
+
+    def detach(self):
+        """Remove the hook from the module and restore its __path__."""
+        del self.module.__dict__['__getattr__']
+        if self.path is not None:
+            self.module.__path__ = self.path
+
+    def exec_module(self):
+        spec = self.spec
+        module = self.module
+        name = spec.name
+        with _ModuleLockManager(name):
+            if module.__dict__.get('__getattr__') is not self:
+                # Another thread executed it while we were waiting for the lock.
+                return
+            self.detach()
+            if _lazy_import_time:
+                import time
+                start = time.perf_counter()
+            spec._initializing = True
+            try:
+                try:
+                    spec.loader.exec_module(module)
+                except:
+                    if sys.modules.get(name) is module:
+                        del sys.modules[name]
+                    raise
+                if sys.modules.get(name) is module:
+                    # Move the module to the end of sys.modules.
+                    del sys.modules[name]
+                    sys.modules[name] = module
+                _verbose_message('import {!r} # {!r}', name, spec.loader)
+            finally:
+                spec._initializing = False
+            if _lazy_import_time:
+                # Imports done by the body are not subtracted from 'self'.
+                us = int((time.perf_counter() - start) * 1e6)
+                sys.stderr.write('import time: {:9d} | {:10d} | {} (deferred)\n'
+                                 .format(us, us, name))
+
+
+def _load_lazy_unlocked(spec):
+    module = module_from_spec(spec)
+    path = module.__dict__.pop('__path__', None)
+    module.__getattr__ = _DeferredExec(spec, module, path)
+    sys.modules[spec.name] = module
+    _verbose_message('import {!r} # deferred {!r}', spec.name, spec.loader)
+    return module
+
+
 # A method used during testing of _load_unlocked() and by
 # _load_module_shim().
 def _load(spec):
@@ -971,6 +1070,8 @@ def _find_and_load_unlocked(name, import_):
     spec = _find_spec(name, path)
     if spec is None:
         raise ModuleNotFoundError(_ERR_MSG.format(name), name=name)
+    elif _lazy_imports is not None and _is_lazy_import(spec):
+        module = _load_lazy_unlocked(spec)
     else:
         module = _load_unlocked(spec)
     if parent:
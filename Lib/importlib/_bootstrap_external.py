@@ -1447,6 +1447,105 @@ class PathFinder:
         return MetadataPathFinder.find_distributions(*args, **kwargs)
 
 
+# Import index ################################################################
+
+# Opt-in on-disk cache of the directory listings FileFinder needs, enabled by
+# setting PYSTON_IMPORT_INDEX to the path of the index file. It maps absolute
+# directory paths to their mtime, the time they got listed and their contents
+# so that a new process does not have to call listdir() on the directories
+# which did not change since.
+_IMPORT_INDEX_VERSION = 2
+# A listing is only trusted if the directory mtime is older than the listing
+# by this many seconds. Otherwise a file created right after the listing
+# could have got the same (coarse) mtime and would be missing from it.
+_IMPORT_INDEX_RACY_SECONDS = 2
+_import_index_path = None
+_import_index = {}
+# directories listed by this process
+_import_index_new = set()
+_import_index_time = None
+
+
+def _get_import_index_path():
+    """Return the path of the import index file or None if it is disabled."""
+    if sys.flags.ignore_environment:
+        return None
+    if _MS_WINDOWS:
+        path = _os.environ.get('PYSTON_IMPORT_INDEX')
+    else:
+        path = _os.environ.get(b'PYSTON_IMPORT_INDEX')
+        if path is not None:
+            path = path.decode(sys.getfilesystemencoding(), 'surrogateescape')
+    return path or None
+
+
+def _load_import_index(path):
+    """Load the import index and write it back at exit if it changed."""
+    global _import_index_path, _import_index, _import_index_time
+    _import_index_path = path
+    try:
+        with _io.FileIO(path, 'r') as file:
+            version, index = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        # Missing or unreadable index, start with an empty one.
+        pass
+    else:
+        if version == _IMPORT_INDEX_VERSION and type(index) is dict:
+            _import_index = index
+    time = sys.modules.get('time') or _bootstrap._builtin_from_name('time')
+    _import_index_time = time.time
+    atexit = _bootstrap._builtin_from_name('atexit')
+    atexit.register(_save_import_index)
+
+
+def _is_racy(entry):
+    mtime, listed_at, contents = entry
+    return mtime >= listed_at - _IMPORT_INDEX_RACY_SECONDS
+
+
+def _save_import_index():
+    if not _import_index_new:
+        return
+    index = {}
+    for path, entry in _import_index.items():
+        try:
+            mtime = _path_stat(path).st_mtime
+        except OSError:
+            # The directory is gone.
+            continue
+        if mtime != entry[0]:
+            if path not in _import_index_new:
+                # Changed since another process listed it.
+                continue
+            # Writing the bytecode cache usually modified the directories
+            # after we listed them, store their current state.
+            try:
+                entry = (mtime, _import_index_time(), tuple(_os.listdir(path)))
+            except OSError:
+                continue
+        if not _is_racy(entry):
+            index[path] = entry
+    try:
+        _write_atomic(_import_index_path,
+                      marshal.dumps((_IMPORT_INDEX_VERSION, index)))
+    except OSError:
+        # The next process will try again.
+        pass
+
+
+def _list_directory(path, mtime):
+    """listdir() which uses the import index if the directory is unchanged."""
+    if _import_index_path is not None and mtime != -1:
+        entry = _import_index.get(path)
+        if entry is not None and entry[0] == mtime and not _is_racy(entry):
+            return entry[2]
+    contents = _os.listdir(path)
+    if _import_index_path is not None and mtime != -1:
+        _import_index[path] = (mtime, _import_index_time(), tuple(contents))
+        _import_index_new.add(path)
+    return contents
+
+
 class FileFinder:
 
     """File-based finder.
@@ -1475,6 +1574,9 @@ class FileFinder:
     def invalidate_caches(self):
         """Invalidate the directory mtime."""
         self._path_mtime = -1
+        # The directory may have changed without a new mtime, list it again.
+        _import_index.pop(self.path, None)
+        _import_index_new.discard(self.path)
 
     find_module = _find_module_shim
 
@@ -1507,7 +1609,7 @@ class FileFinder:
         except OSError:
             mtime = -1
         if mtime != self._path_mtime:
-            self._fill_cache()
+            self._fill_cache(mtime)
             self._path_mtime = mtime
         # tail_module keeps the original casing, for __file__ and friends
         if _relax_case():
@@ -1546,11 +1648,14 @@ class FileFinder:
             return spec
         return None
 
-    def _fill_cache(self):
-        """Fill the cache of potential modules and packages for this directory."""
+    def _fill_cache(self, mtime=-1):
+        """Fill the cache of potential modules and packages for this directory.
+
+        If the mtime of the directory is passed in the import index gets used.
+        """
         path = self.path
         try:
-            contents = _os.listdir(path or _os.getcwd())
+            contents = _list_directory(path or _os.getcwd(), mtime)
         except (FileNotFoundError, PermissionError, NotADirectoryError):
             # Directory has either been removed, turned into a file, or made
             # unreadable.
@@ -1700,9 +1805,31 @@ def _setup(_bootstrap_module):
             WindowsRegistryFinder.DEBUG_BUILD = True
 
 
+def _get_lazy_imports():
+    """Return the modules to import lazily from -X lazy_imports or
+    PYSTON_LAZY_IMPORTS, a comma separated list of module names."""
+    names = sys._xoptions.get('lazy_imports')
+    if names is None and not sys.flags.ignore_environment:
+        names = _os.environ.get('PYSTON_LAZY_IMPORTS' if _MS_WINDOWS
+                                else b'PYSTON_LAZY_IMPORTS')
+        if isinstance(names, bytes):
+            names = names.decode('ascii', 'replace')
+    if not isinstance(names, str):
+        return ()
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
 def _install(_bootstrap_module):
     """Install the path-based import components."""
     _setup(_bootstrap_module)
+    index_path = _get_import_index_path()
+    if index_path is not None:
+        _load_import_index(index_path)
+    _bootstrap._set_lazy_imports(_get_lazy_imports())
+    _bootstrap._lazy_import_time = 'importtime' in sys._xoptions or (
+        not sys.flags.ignore_environment and
+        bool(_os.environ.get('PYTHONPROFILEIMPORTTIME' if _MS_WINDOWS
+                             else b'PYTHONPROFILEIMPORTTIME')))
     supported_loaders = _get_supported_file_loaders()
     sys.path_hooks.extend([FileFinder.path_hook(*supported_loaders)])
     sys.meta_path.append(PathFinder)
@@ -4,6 +4,7 @@ from ._bootstrap import module_from_spec
 from ._bootstrap import _resolve_name
 from ._bootstrap import spec_from_loader
 from ._bootstrap import _find_spec
+from ._bootstrap import _set_lazy_imports
 from ._bootstrap_external import MAGIC_NUMBER
 from ._bootstrap_external import _RAW_MAGIC_NUMBER
 from ._bootstrap_external import cache_from_source
@@ -298,3 +299,19 @@ class LazyLoader(abc.Loader):
         loader_state['__class__'] = module.__class__
         module.__spec__.loader_state = loader_state
         module.__class__ = _LazyModule
+
+
+def set_lazy_imports(names):
+    """Import the given modules lazily from now on.
+
+    names is an iterable of module names, listing a package also covers its
+    submodules. The body of a listed module only gets executed on the first
+    access of one of its attributes, including 'from' imports and imports of
+    its submodules. An empty iterable or None disables lazy imports.
+    Modules which already got imported are not affected.
+
+    The list can also be set with -X lazy_imports=a,b or PYSTON_LAZY_IMPORTS.
+    """
+    if isinstance(names, str):
+        raise TypeError('names must be an iterable of module names, not str')
+    _set_lazy_imports(names)
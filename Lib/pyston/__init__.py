@@ -0,0 +1,7 @@
+"""Pyston specific functionality.
+
+profiler -- low overhead sampling profiler
+
+The jit submodule is only available if the interpreter was built with the
+JIT enabled.
+"""
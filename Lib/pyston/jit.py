@@ -0,0 +1,142 @@
+"""Inspect and control the Pyston JIT at runtime.
+
+stats() -- return a dict with the JIT statistic counters
+get_config() -- return a dict with the current JIT settings
+set_config(**settings) -- change JIT settings
+compile(func) -- JIT compile a function or code object now
+blacklist(func) -- never run a function or code object as JIT compiled code
+is_compiled(func) -- check if a function or code object is JIT compiled
+run_count(func) -- return the warm-up counter of a function or code object
+ic_sites(func) -- return the state of the attribute inline caches of a function
+compile_report() -- return compile time, code size and entry counts per function
+dump_compile_report(path) -- write compile_report() as JSON file
+enable_opcode_stats(types) -- start counting executions and cache misses per instruction
+disable_opcode_stats() -- stop counting, the counts are kept
+opcode_stats() -- return the instruction counts per code object
+reset_opcode_stats() -- throw away the instruction counts
+warmup(funcs, min_runs) -- JIT compile many functions at once
+enable_prefork_warmup(funcs, min_runs) -- call warmup() before every fork()
+
+The thresholds (min_runs, opcache_min_runs, osr_min_runs) use the same units
+as the JIT_MIN_RUNS, OPCACHE_MIN_RUNS and JIT_OSR_MIN_RUNS environment
+variables: every function call adds 10 and every loop iteration adds 1.
+min_runs is checked when a function gets called, osr_min_runs (which defaults
+to min_runs) when a loop jumps back to its start. Reaching the latter compiles
+the function and continues the running loop in the machine code (OSR), so
+functions which are only called once but spend a long time in a loop, and
+module bodies, still get JIT compiled. The osr_compiles and osr_entries
+counters in stats() show how often this happened.
+
+Resuming a generator or coroutine also adds 1. Once compiled, a suspended
+frame continues in the machine code at the instruction after the yield or
+await. gen_resumes counts all resumes, gen_resumes_native the ones which ran
+machine code. Resumes via throw() always use the interpreter.
+
+With the background setting (or the JIT_BACKGROUND environment variable)
+functions which cross min_runs get compiled by a separate thread while they
+keep running in the interpreter. That thread holds the GIL while it compiles
+a function, so the other threads still stall for the duration of each
+compilation. Only the call which crossed the threshold no longer waits for it,
+and the compilation of many functions gets spread over time. The thread gets
+stopped at exit.
+
+Once the machine code uses max_mem bytes no more functions get compiled.
+With the evict_cold setting (or the JIT_EVICT_COLD environment variable)
+the compiled code keeps counting the calls instead and when a new function
+needs room the functions which got called the least since the previous
+eviction are reverted to the interpreter until the usage is back at 3/4 of
+max_mem. Functions which are currently executing are never evicted and an
+evicted function gets recompiled once it is hot again. num_funcs_evicted in
+stats() counts the evictions.
+
+The compile report only contains functions compiled while the report setting
+was enabled, either via set_config(report=1) or by setting the
+JIT_REPORT_FILE environment variable which also writes the report to that
+file at exit.
+
+While the opcode stats are enabled all code runs in the interpreter, so
+expect a large slowdown. The LOAD_ATTR, LOAD_METHOD, STORE_ATTR and
+LOAD_GLOBAL entries split the executions into cache hits and the reasons the
+cache could not be used: misses (the cache did not match), unoptimized (the
+cache is empty or got disabled), no_opcache (the function is not warm enough
+to have caches yet) and uncached (e.g. globals is not a dict). disabled
+counts how often a cache gave up after too many misses.
+"""
+
+from _pyston_jit import *
+
+import gc as _gc
+import os as _os
+import types as _types
+import weakref as _weakref
+
+__all__ = ["stats", "get_config", "set_config", "compile", "blacklist",
+           "is_compiled", "run_count", "ic_sites", "compile_report",
+           "dump_compile_report", "enable_opcode_stats", "disable_opcode_stats",
+           "opcode_stats", "reset_opcode_stats", "warmup", "enable_prefork_warmup"]
+
+
+def _warm_funcs(min_runs=None):
+    """Return all functions whose run_count() is at least min_runs."""
+    if min_runs is None:
+        min_runs = get_config()["opcache_min_runs"]
+    return [o for o in _gc.get_objects()
+            if isinstance(o, _types.FunctionType) and run_count(o) >= min_runs]
+
+
+def warmup(funcs=None, min_runs=None):
+    """JIT compile functions ahead of time.
+
+    funcs is an iterable of functions or code objects. If it is None all
+    functions whose run_count() is at least min_runs get compiled.
+    min_runs defaults to the opcache_min_runs setting, which means all
+    functions which are warm but did not cross the JIT threshold yet.
+
+    This is mainly useful in preforking servers: functions compiled in the
+    parent before fork() share their machine code with all child processes
+    instead of every child compiling its own copy after the fork.
+    Enable the share_forked_code setting (or the JIT_SHARE_FORKED_CODE
+    environment variable) too, so that the children never write to the
+    inherited memory and the pages stay shared. Only code compiled before
+    the fork is shared: functions which get compiled after it are compiled
+    privately by every child, there is no cross-process code cache.
+
+    Returns the number of newly compiled functions.
+    """
+    if funcs is None:
+        funcs = _warm_funcs(min_runs)
+
+    num_compiled = 0
+    for f in funcs:
+        if not is_compiled(f) and compile(f):
+            num_compiled += 1
+    return num_compiled
+
+
+def enable_prefork_warmup(funcs=None, min_runs=None):
+    """Call warmup(funcs, min_runs) in the parent process before every fork().
+
+    funcs gets turned into a list once, so any iterable works. With funcs=None
+    every fork() scans the whole heap for functions which got warm since the
+    previous fork, which costs time proportional to the number of objects.
+    Functions which were already handled by an earlier fork, including the
+    ones which failed to compile, are not tried again.
+    """
+    if funcs is not None:
+        funcs = list(funcs)
+        _os.register_at_fork(before=lambda: warmup(funcs, min_runs))
+        return
+
+    handled = _weakref.WeakSet()
+    def before():
+        new_funcs = [f for f in _warm_funcs(min_runs) if f.__code__ not in handled]
+        warmup(new_funcs)
+        handled.update(f.__code__ for f in new_funcs)
+    _os.register_at_fork(before=before)
+
+
+def dump_compile_report(path):
+    """Write compile_report() as JSON list to the file path."""
+    import json
+    with open(path, "w") as f:
+        json.dump(compile_report(), f, indent=2)
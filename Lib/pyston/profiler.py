@@ -0,0 +1,224 @@
+"""Low overhead sampling profiler.
+
+start(interval, all_threads) -- start taking a stack sample every interval seconds of CPU time
+stop() -- stop sampling, the collected samples are kept
+is_running() -- check if the profiler is sampling
+reset() -- throw away the collected samples
+num_samples() -- return the number of collected samples
+collapsed_stacks(by_offset) -- return the samples in the collapsed stack format
+write_collapsed(path, by_offset) -- write collapsed_stacks() to a file
+
+The sampler is driven by SIGPROF, the handler only records the code object
+and bytecode offset of every frame on the stack. Python signal handlers only
+run at the next eval breaker check (a safepoint), in interpreted as well as in
+JIT compiled frames, not when the signal arrives. So a sample lands on the
+instruction at that safepoint: time spent inside a C call or in a long
+sequence of instructions without a check gets charged to the instruction
+where the next check happens, and the per offset numbers are biased towards
+calls, loop back edges and returns. The same can move time near the end of
+a function to its caller. Frames of functions which were JIT compiled at the
+time of the sample get the '_[j]' annotation which flamegraph.pl colors
+differently when run with --color=java.
+
+The output can be turned into a flame graph with:
+    pyston/tools/FlameGraph/flamegraph.pl --color=java out.txt > out.svg
+
+It can also be used from the command line:
+    python -m pyston.profiler [-o out.txt] [-i interval] script.py [args]
+"""
+
+import os as _os
+import signal as _signal
+import sys as _sys
+from _thread import get_ident as _get_ident
+
+try:
+    from pyston.jit import is_compiled as _is_compiled
+except ImportError:
+    # not running on a JIT enabled build
+    _is_compiled = None
+
+__all__ = ["start", "stop", "is_running", "reset", "num_samples",
+           "collapsed_stacks", "write_collapsed"]
+
+# (code, f_lasti, jit compiled) tuple per frame, outermost frame first -> number of samples
+_samples = {}
+_interval = None
+_all_threads = False
+_prev_handler = None
+_fork_hook_registered = False
+# frames from this one outwards are not recorded, used to hide the command line wrapper
+_root_frame = None
+
+
+def _stack(frame):
+    stack = []
+    while frame is not None and frame is not _root_frame:
+        code = frame.f_code
+        stack.append((code, frame.f_lasti, _is_compiled is not None and _is_compiled(code)))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _handler(signum, frame):
+    if _all_threads:
+        frames = _sys._current_frames()
+        # the handler runs in the main thread, don't include its own frame
+        frames[_get_ident()] = frame
+        frames = frames.values()
+    else:
+        frames = (frame,)
+    for frame in frames:
+        if frame is None:
+            continue
+        stack = _stack(frame)
+        _samples[stack] = _samples.get(stack, 0) + 1
+
+
+def _after_fork_in_child():
+    # timers are not inherited by the child, restart it with its own samples
+    if _interval is not None:
+        _samples.clear()
+        _signal.setitimer(_signal.ITIMER_PROF, _interval, _interval)
+
+
+def start(interval=0.01, all_threads=False):
+    """Start sampling.
+
+    interval is the CPU time in seconds between two samples. With the
+    default of 10ms the overhead is usually below 1%.
+    If all_threads is true every sample contains the stacks of all threads
+    instead of only the main thread.
+
+    Has to be called from the main thread. If the process forks the child
+    continues sampling with an empty profile.
+    """
+    global _interval, _all_threads, _prev_handler, _fork_hook_registered
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    if _interval is not None:
+        raise RuntimeError("profiler is already running")
+    _prev_handler = _signal.signal(_signal.SIGPROF, _handler)
+    _interval = interval
+    _all_threads = all_threads
+    if not _fork_hook_registered:
+        _os.register_at_fork(after_in_child=_after_fork_in_child)
+        _fork_hook_registered = True
+    _signal.setitimer(_signal.ITIMER_PROF, interval, interval)
+
+
+def stop():
+    """Stop sampling. The collected samples are kept."""
+    global _interval, _prev_handler
+    if _interval is None:
+        return
+    _signal.setitimer(_signal.ITIMER_PROF, 0, 0)
+    _signal.signal(_signal.SIGPROF, _prev_handler or _signal.SIG_DFL)
+    _interval = None
+    _prev_handler = None
+
+
+def is_running():
+    """Return True if the profiler is currently sampling."""
+    return _interval is not None
+
+
+def reset():
+    """Throw away all collected samples."""
+    _samples.clear()
+
+
+def num_samples():
+    """Return the number of collected samples."""
+    return sum(_samples.values())
+
+
+def _frame_name(code, lasti, jit, by_offset):
+    if by_offset:
+        name = "%s (%s:%d+%d)" % (code.co_name, code.co_filename, code.co_firstlineno, lasti)
+    else:
+        # f_lasti is -1 if the frame did not start executing yet
+        name = "%s (%s:%d)" % (code.co_name, code.co_filename, _line_number(code, max(lasti, 0)))
+    if jit:
+        name += "_[j]"
+    # ';' separates the frames in the collapsed format
+    return name.replace(";", ":")
+
+
+def _line_number(code, lasti):
+    lineno = code.co_firstlineno
+    addr = 0
+    tab = code.co_lnotab
+    for i in range(0, len(tab), 2):
+        addr += tab[i]
+        if addr > lasti:
+            break
+        line_incr = tab[i + 1]
+        if line_incr >= 0x80:
+            line_incr -= 0x100
+        lineno += line_incr
+    return lineno
+
+
+def collapsed_stacks(by_offset=False):
+    """Return the samples in the collapsed stack format of flamegraph.pl.
+
+    One line per distinct stack: the frames from the outermost to the
+    innermost separated by ';' followed by the number of samples.
+    Frames are named 'function (file:line)' or, if by_offset is true,
+    'function (file:firstline+bytecode offset)'.
+    """
+    counts = {}
+    for stack, count in list(_samples.items()):
+        key = ";".join(_frame_name(code, lasti, jit, by_offset) for code, lasti, jit in stack)
+        counts[key] = counts.get(key, 0) + count
+    return ["%s %d" % (key, count) for key, count in sorted(counts.items())]
+
+
+def write_collapsed(path, by_offset=False):
+    """Write collapsed_stacks() to path, one stack per line."""
+    with open(path, "w") as f:
+        for line in collapsed_stacks(by_offset):
+            f.write(line + "\n")
+
+
+def main():
+    global _root_frame
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m pyston.profiler",
+                                     description="Run a script under the sampling profiler")
+    parser.add_argument("-o", "--outfile", default="pyston_profile.txt",
+                        help="file to write the collapsed stacks to (default: %(default)s)")
+    parser.add_argument("-i", "--interval", type=float, default=0.01,
+                        help="CPU time in seconds between two samples (default: %(default)s)")
+    parser.add_argument("--all-threads", action="store_true", help="sample all threads")
+    parser.add_argument("--by-offset", action="store_true",
+                        help="name frames by bytecode offset instead of line number")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    options = parser.parse_args()
+
+    _sys.argv = [options.script] + options.args
+    _sys.path.insert(0, _os.path.dirname(options.script))
+    with open(options.script, "rb") as f:
+        code = compile(f.read(), options.script, "exec")
+    globs = {
+        "__file__": options.script,
+        "__name__": "__main__",
+        "__package__": None,
+        "__cached__": None,
+    }
+    _root_frame = _sys._getframe()
+    start(options.interval, options.all_threads)
+    try:
+        exec(code, globs)
+    finally:
+        stop()
+        write_collapsed(options.outfile, options.by_offset)
+        print("wrote %d samples to %s" % (num_samples(), options.outfile), file=_sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,10 @@ class ZipImportError(ImportError):
 # _read_directory() cache
 _zip_directory_cache = {}
 
+# archive path -> (files, file descriptor) of the archives read by _get_data(),
+# an entry is only used while its files dict is in _zip_directory_cache.
+_zip_fd_cache = {}
+
 _module_type = type(sys)
 
 END_CENTRAL_DIR_SIZE = 22
@@ -91,7 +95,8 @@ class zipimporter:
         try:
             files = _zip_directory_cache[path]
         except KeyError:
-            files = _read_directory(path)
+            _close_archive_fd(path)
+            files = _read_directory_indexed(path, st)
             _zip_directory_cache[path] = files
         self._files = files
         self.archive = path
@@ -467,6 +472,68 @@ def _read_directory(archive):
     _bootstrap._verbose_message('zipimport: found {} names in {!r}', count, archive)
     return files
 
+# Directory index
+#
+# Parsing the central directory of an archive with many files takes a long
+# time. If PYSTON_ZIPIMPORT_INDEX is set the files dict gets stored next to
+# the archive in '<archive>.index', as a sorted tuple of the names and a tuple
+# of their toc entries without the path. Later processes use it instead of
+# parsing the archive as long as the size and mtime of the archive match.
+_INDEX_VERSION = 1
+_INDEX_SUFFIX = '.index'
+
+def _get_index_enabled():
+    if sys.flags.ignore_environment:
+        return False
+    if alt_path_sep:
+        return bool(_bootstrap_external._os.environ.get('PYSTON_ZIPIMPORT_INDEX'))
+    return bool(_bootstrap_external._os.environ.get(b'PYSTON_ZIPIMPORT_INDEX'))
+
+_index_enabled = _get_index_enabled()
+
+def _read_directory_indexed(archive, st):
+    if _index_enabled:
+        files = _read_index(archive, st)
+        if files is not None:
+            return files
+    files = _read_directory(archive)
+    if _index_enabled:
+        _write_index(archive, st, files)
+    return files
+
+def _read_index(archive, st):
+    try:
+        with _io.FileIO(archive + _INDEX_SUFFIX, 'r') as fp:
+            version, size, mtime, names, entries = marshal.loads(fp.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (version != _INDEX_VERSION or size != st.st_size or
+            mtime != st.st_mtime_ns or len(names) != len(entries)):
+        return None
+    files = {}
+    # Same as _path_join(archive, name) for names which don't end with a
+    # path separator, which are all but the directories.
+    prefix = _bootstrap_external._path_join(archive, '') + path_sep
+    for name, entry in zip(names, entries):
+        if name[-1:] in _bootstrap_external.path_separators:
+            path = _bootstrap_external._path_join(archive, name)
+        else:
+            path = prefix + name
+        files[name] = (path,) + entry
+    _bootstrap._verbose_message('zipimport: found {} names in {!r}',
+                                len(files), archive + _INDEX_SUFFIX)
+    return files
+
+def _write_index(archive, st, files):
+    names = tuple(sorted(files))
+    entries = tuple([files[name][1:] for name in names])
+    data = marshal.dumps((_INDEX_VERSION, st.st_size, st.st_mtime_ns, names, entries))
+    try:
+        _bootstrap_external._write_atomic(archive + _INDEX_SUFFIX, data)
+    except OSError:
+        # e.g. a read-only directory, parse the archive the next time again
+        pass
+
 # During bootstrap, we may need to load the encodings
 # package from a ZIP file. But the cp437 encoding is implemented
 # in Python in the encodings package.
@@ -527,37 +594,82 @@ def _get_decompress_func():
     _bootstrap._verbose_message('zipimport: zlib available')
     return decompress
 
+# Return a file descriptor for positional reads of the archive, or None if
+# the platform has no pread() or the archive directory is not cached. The file
+# stays open instead of getting opened again for every file read from it.
+def _get_archive_fd(archive):
+    files = _zip_directory_cache.get(archive)
+    if files is None or not hasattr(_bootstrap_external._os, 'pread'):
+        return None
+    try:
+        cached_files, fd = _zip_fd_cache[archive]
+    except KeyError:
+        pass
+    else:
+        if cached_files is files:
+            return fd
+        _close_archive_fd(archive)
+    with _io.open_code(archive) as fp:
+        fd = _bootstrap_external._os.dup(fp.fileno())
+    entry = _zip_fd_cache.get(archive)
+    if entry is not None and entry[0] is files:
+        # Another thread opened it while we released the GIL.
+        _bootstrap_external._os.close(fd)
+        return entry[1]
+    _zip_fd_cache[archive] = (files, fd)
+    return fd
+
+def _close_archive_fd(archive):
+    try:
+        files, fd = _zip_fd_cache.pop(archive)
+    except KeyError:
+        return
+    _bootstrap_external._os.close(fd)
+
+# Given a read(offset, size) function for the archive and the offset of the
+# local file header, return the raw file data.
+def _read_file_data(archive, read, file_offset, data_size):
+    # Check to make sure the local file header is correct
+    buffer = read(file_offset, 30)
+    if len(buffer) != 30:
+        raise EOFError('EOF read where not expected')
+
+    if buffer[:4] != b'PK\x03\x04':
+        # Bad: Local File Header
+        raise ZipImportError(f'bad local file header: {archive!r}', path=archive)
+
+    name_size = _unpack_uint16(buffer[26:28])
+    extra_size = _unpack_uint16(buffer[28:30])
+    header_size = 30 + name_size + extra_size
+    file_offset += header_size  # Start of file data
+    raw_data = read(file_offset, data_size)
+    if len(raw_data) != data_size:
+        raise OSError("zipimport: can't read data")
+    return raw_data
+
 # Given a path to a Zip file and a toc_entry, return the (uncompressed) data.
 def _get_data(archive, toc_entry):
     datapath, compress, data_size, file_size, file_offset, time, date, crc = toc_entry
     if data_size < 0:
         raise ZipImportError('negative data size')
 
-    with _io.open_code(archive) as fp:
-        # Check to make sure the local file header is correct
-        try:
-            fp.seek(file_offset)
-        except OSError:
-            raise ZipImportError(f"can't read Zip file: {archive!r}", path=archive)
-        buffer = fp.read(30)
-        if len(buffer) != 30:
-            raise EOFError('EOF read where not expected')
-
-        if buffer[:4] != b'PK\x03\x04':
-            # Bad: Local File Header
-            raise ZipImportError(f'bad local file header: {archive!r}', path=archive)
-
-        name_size = _unpack_uint16(buffer[26:28])
-        extra_size = _unpack_uint16(buffer[28:30])
-        header_size = 30 + name_size + extra_size
-        file_offset += header_size  # Start of file data
-        try:
-            fp.seek(file_offset)
-        except OSError:
-            raise ZipImportError(f"can't read Zip file: {archive!r}", path=archive)
-        raw_data = fp.read(data_size)
-        if len(raw_data) != data_size:
-            raise OSError("zipimport: can't read data")
+    fd = _get_archive_fd(archive)
+    if fd is not None:
+        def read(offset, size):
+            try:
+                return _bootstrap_external._os.pread(fd, size, offset)
+            except OSError:
+                raise ZipImportError(f"can't read Zip file: {archive!r}", path=archive)
+        raw_data = _read_file_data(archive, read, file_offset, data_size)
+    else:
+        with _io.open_code(archive) as fp:
+            def read(offset, size):
+                try:
+                    fp.seek(offset)
+                except OSError:
+                    raise ZipImportError(f"can't read Zip file: {archive!r}", path=archive)
+                return fp.read(size)
+            raw_data = _read_file_data(archive, read, file_offset, data_size)
 
     if compress == 0:
         # data is not compressed
@@ -535,9 +535,19 @@ code_new(PyTypeObject *type, PyObject *args, PyObject *kw)
     return co;
 }
 
+#ifdef ENABLE_AOT
+void jit_free_code(void* code);
+#endif
+
 static void
 code_dealloc(PyCodeObject *co)
 {
+#ifdef ENABLE_AOT
+    // release the machine code the JIT emitted for this code object
+    jit_free_code(co->co_jit_code);
+    co->co_jit_code = NULL;
+#endif
+
     if (co->co_opcache != NULL) {
         PyMem_FREE(co->co_opcache);
     }
@@ -8,6 +8,7 @@
 #include "pycore_context.h"
 #include "frameobject.h"
 #include "interpreteridobject.h"
+#include "../Modules/hashtable.h"
 
 #ifdef __cplusplus
 extern "C" {
@@ -2328,6 +2329,103 @@ _Py_Immortalize(PyObject *op) {
         traverse(op, (visitproc)_Py_Immortalize, NULL);
     }
 }
+
+typedef struct {
+    // we also have to look at the objects which are already immortal
+    // because mutable ones may reference new mortal objects
+    _Py_hashtable_t *visited;
+    PyObject **stack;
+    Py_ssize_t stack_size, stack_capacity;
+    Py_ssize_t num_objects, num_bytes;
+} immortalize_state;
+
+static int
+immortalize_visit(PyObject *op, immortalize_state *state)
+{
+    if (_Py_HASHTABLE_GET_ENTRY(state->visited, op))
+        return 0;
+    if (_Py_HASHTABLE_SET_NODATA(state->visited, op) < 0)
+        return -1;
+
+    if (state->stack_size == state->stack_capacity) {
+        Py_ssize_t new_capacity = state->stack_capacity ? state->stack_capacity * 2 : 1024;
+        PyObject **new_stack = PyMem_RawRealloc(state->stack, new_capacity * sizeof(PyObject*));
+        if (new_stack == NULL)
+            return -1;
+        state->stack = new_stack;
+        state->stack_capacity = new_capacity;
+    }
+    state->stack[state->stack_size++] = op;
+
+    if (IS_IMMORTAL(op))
+        return 0;
+    MAKE_IMMORTAL(op);
+
+    // approximation: does not include out of line buffers like the item array of lists
+    PyTypeObject *type = Py_TYPE(op);
+    Py_ssize_t size = type->tp_basicsize;
+    if (type->tp_itemsize)
+        size += Py_ABS(Py_SIZE(op)) * type->tp_itemsize;
+    if (PyType_IS_GC(type))
+        size += sizeof(PyGC_Head);
+    ++state->num_objects;
+    state->num_bytes += size;
+    return 0;
+}
+
+// Code objects don't have a tp_traverse
+static int
+immortalize_code_traverse(PyCodeObject *co, visitproc visit, void *arg)
+{
+    Py_VISIT(co->co_code);
+    Py_VISIT(co->co_consts);
+    Py_VISIT(co->co_names);
+    Py_VISIT(co->co_varnames);
+    Py_VISIT(co->co_freevars);
+    Py_VISIT(co->co_cellvars);
+    Py_VISIT(co->co_filename);
+    Py_VISIT(co->co_name);
+    Py_VISIT(co->co_lnotab);
+    return 0;
+}
+
+// Like _Py_Immortalize() but uses an explicit stack instead of recursion
+// so it can handle the whole heap, also looks at the objects referenced by
+// already immortal objects, and counts the newly immortalized objects
+// and (approximately) their size in bytes.
+// Returns -1 and sets a MemoryError if it ran out of memory.
+int
+_Py_ImmortalizeReachable(PyObject *root, Py_ssize_t *num_objects, Py_ssize_t *num_bytes)
+{
+    immortalize_state state = { NULL, NULL, 0, 0, 0, 0 };
+    state.visited = _Py_hashtable_new(sizeof(PyObject*), 0, _Py_hashtable_hash_ptr,
+                                      _Py_hashtable_compare_direct);
+    if (state.visited == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    int ret = immortalize_visit(root, &state);
+    while (ret == 0 && state.stack_size > 0) {
+        PyObject *op = state.stack[--state.stack_size];
+        traverseproc traverse = Py_TYPE(op)->tp_traverse;
+        if (traverse == (traverseproc)type_traverse)
+            traverse = (traverseproc)_alltype_traverse;
+        else if (PyCode_Check(op))
+            traverse = (traverseproc)immortalize_code_traverse;
+        if (traverse)
+            ret = traverse(op, (visitproc)immortalize_visit, &state);
+    }
+    PyMem_RawFree(state.stack);
+    _Py_hashtable_destroy(state.visited);
+
+    *num_objects = state.num_objects;
+    *num_bytes = state.num_bytes;
+    if (ret) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+}
 #endif
 
 #ifdef __cplusplus
@@ -176,6 +176,8 @@ static long dxp[256];
 #define OPCACHE_MIN_RUNS (100*OPCACHE_INC_FUNC_ENTRY)  /* create opcache when code executed this time */
 #define JIT_MIN_RUNS (OPCACHE_MIN_RUNS*2)
 //#endif
+// functions which the JIT profile file (JIT_PROFILE_FILE) lists as hot get compiled after this many calls
+#define JIT_PROFILE_WARMUP_RUNS (5*OPCACHE_INC_FUNC_ENTRY)
 #define OPCACHE_STATS 0  /* Enable stats */
 
 #define USE_LOAD_METHOD_CACHE 1
@@ -1840,6 +1842,25 @@ int64_t _PyDict_GetItemOffsetSplit(PyDictObject *mp, PyObject *key, Py_ssize_t *
 PyObject* _PyDict_GetItemByOffset(PyDictObject *mp, PyObject *key, Py_ssize_t dk_size, int64_t offset);
 PyObject* _PyDict_GetItemByOffsetSplit(PyDictObject *mp, PyObject *key, Py_ssize_t dk_size, int64_t ix);
 
+// Global cache shared by all LOAD_ATTR and LOAD_METHOD sites which saw more types than fit into their
+// polymorphic cache (LA_CACHE_MEGAMORPHIC). It's direct mapped: on a collision the entry gets overwritten.
+#define MEGAMORPHIC_CACHE_SIZE 4096
+// misses a megamorphic site may have while the global cache warms up before they count as failures
+#define MEGAMORPHIC_WARMUP_MISSES 64
+typedef struct {
+    PyObject* name; /* owned reference, makes sure the address can't get reused by a different string */
+    uint64_t type_ver;
+    int is_load_method;
+    _PyOpcache cache;
+} MegamorphicCacheEntry;
+static MegamorphicCacheEntry megamorphic_cache[MEGAMORPHIC_CACHE_SIZE];
+static unsigned long megamorphic_cache_hits, megamorphic_cache_misses;
+
+static inline MegamorphicCacheEntry* getMegamorphicCacheEntry(PyTypeObject* tp, PyObject* name) {
+    uint64_t hash = ((uint64_t)tp->tp_version_tag ^ ((uintptr_t)name >> 4)) * 0x9E3779B97F4A7C15ULL;
+    return &megamorphic_cache[hash >> (64 - 12 /* log2(MEGAMORPHIC_CACHE_SIZE) */)];
+}
+
 int __attribute__((visibility("hidden")))
 loadAttrCache(PyObject* owner, PyObject* name, _PyOpcache *co_opcache, PyObject** res, int *meth_found) {
     _PyOpcache_LoadAttr *la = &co_opcache->u.la;
@@ -1860,6 +1881,23 @@ loadAttrCache(PyObject* owner, PyObject* name, _PyOpcache *co_opcache, PyObject*
                 return 0;
             }
         }
+        ++la->u.poly_cache.num_misses;
+        return -1;
+    }
+
+    if (la->cache_type == LA_CACHE_MEGAMORPHIC) {
+        PyTypeObject* tp = Py_TYPE(owner);
+        MegamorphicCacheEntry* entry = getMegamorphicCacheEntry(tp, name);
+        if (entry->name == name && entry->is_load_method == (meth_found != NULL) &&
+            TYPE_VERSION_CHECK(tp, entry->type_ver) &&
+            loadAttrCache(owner, name, &entry->cache, res, meth_found) == 0) {
+            co_opcache->num_failed = 0;
+            ++la->u.megamorphic_cache.num_hits;
+            ++megamorphic_cache_hits;
+            return 0;
+        }
+        ++la->u.megamorphic_cache.num_misses;
+        ++megamorphic_cache_misses;
         return -1;
     }
 
@@ -2006,11 +2044,22 @@ static int createPolymorphicCache(_PyOpcache* co_opcache, _PyOpcache_LoadAttr *l
     la->u.poly_cache.caches = caches;
     la->u.poly_cache.num_entries = num_entries;
     la->u.poly_cache.num_used = 1;
+    la->u.poly_cache.num_misses = 0;
     return 0;
 }
 
+// Switches a full polymorphic site over to the global megamorphic cache.
+// Compiled code keeps the inline checks it emitted for the polymorphic entries because they contain
+// just copies of the values. But the slow path now looks up the megamorphic cache.
+static void convertToMegamorphicCache(_PyOpcache_LoadAttr *la) {
+    PyMem_Free(la->u.poly_cache.caches);
+    la->cache_type = LA_CACHE_MEGAMORPHIC;
+    la->u.megamorphic_cache.num_hits = 0;
+    la->u.megamorphic_cache.num_misses = 0;
+}
+
 int __attribute__((visibility("hidden")))
-setupLoadAttrCache(PyObject* obj, PyObject* name, _PyOpcache *co_opcache, PyObject* res, int is_load_method, int inside_interpreter) {
+setupLoadAttrCache(PyObject* obj, PyObject* name, _PyOpcache *co_opcache, PyObject* res, int is_load_method) {
     _PyOpcache_LoadAttr *la = &co_opcache->u.la;
     int meth_found = 0;
     PyObject* descr = NULL;
@@ -2057,7 +2106,7 @@ setupLoadAttrCache(PyObject* obj, PyObject* name, _PyOpcache *co_opcache, PyObje
     uint8_t tp_hash = (uint8_t)((uint64_t)(tp)>>4);
 
     // support for polymorphic caches
-    if (co_opcache->optimized &&
+    if (co_opcache->optimized && la->cache_type != LA_CACHE_MEGAMORPHIC &&
         /* enter if we are already polymorphic */
         (la->cache_type == LA_CACHE_POLYMORPHIC ||
         /* or if the hash of the type is different we create a polymorphic IC */
@@ -2072,24 +2121,48 @@ setupLoadAttrCache(PyObject* obj, PyObject* name, _PyOpcache *co_opcache, PyObje
             _PyOpcache *co_opcache_prev_entry = &la->u.poly_cache.caches[la->u.poly_cache.num_used-1];
             if (!co_opcache_prev_entry->optimized || co_opcache_prev_entry->u.la.type_hash == tp_hash) {
                 entry_idx = la->u.poly_cache.num_used - 1;
+            } else if (la->u.poly_cache.num_used >= la->u.poly_cache.num_entries) {
+                // we used all slots
+                convertToMegamorphicCache(la);
+                entry_idx = -1;
             } else {
                 // add a new entry
-                if (la->u.poly_cache.num_used >= la->u.poly_cache.num_entries) {
-                    co_opcache->num_failed = 10; // don't use the cache anymore we used all slots
-                    return -1;
-                }
                 entry_idx = la->u.poly_cache.num_used++;
             }
         } else {
-            // don't create new poly caches from the JIT helper funcs
-            if (!inside_interpreter) {
-                return -1;
-            }
+            // this also happens from the JIT helper funcs when a site which was monomorphic when
+            // we compiled it starts to miss: the slow path is then able to use the polymorphic cache.
             if (createPolymorphicCache(co_opcache, la) == -1)
                 return -1;
             entry_idx = la->u.poly_cache.num_used++;
         }
-        co_opcache = &la->u.poly_cache.caches[entry_idx];
+        if (entry_idx != -1) {
+            co_opcache = &la->u.poly_cache.caches[entry_idx];
+            la = &co_opcache->u.la;
+        }
+    }
+
+    int is_megamorphic_entry = 0;
+    if (co_opcache->optimized && la->cache_type == LA_CACHE_MEGAMORPHIC) {
+        // misses are expected while the global cache warms up, don't let them disable the site.
+        // But a site which keeps missing after that has to settle down like any other cache.
+        if (la->u.megamorphic_cache.num_misses < MEGAMORPHIC_WARMUP_MISSES ||
+            la->u.megamorphic_cache.num_misses < la->u.megamorphic_cache.num_hits)
+            co_opcache->num_failed = 0;
+
+        // (re)fill the global entry for this type and name
+        MegamorphicCacheEntry* entry = getMegamorphicCacheEntry(tp, name);
+        Py_INCREF(name);
+        Py_XSETREF(entry->name, name);
+        entry->type_ver = tp->tp_version_tag;
+        entry->is_load_method = is_load_method;
+        memset(&entry->cache, 0, sizeof(entry->cache));
+        // the entry gets used for all instances of the type: same as for the polymorphic entries
+        // pretend it failed already so that we prefer the caches which don't guard on the exact
+        // dict version, e.g. LA_CACHE_OFFSET_CACHE for instances with a non split dict.
+        entry->cache.num_failed = 2;
+        is_megamorphic_entry = 1;
+        co_opcache = &entry->cache;
         la = &co_opcache->u.la;
     }
 
@@ -2247,6 +2320,10 @@ setupLoadAttrCache(PyObject* obj, PyObject* name, _PyOpcache *co_opcache, PyObje
 #endif
             la->cache_type = LA_CACHE_VALUE_CACHE_SPLIT_DICT;
         } else {
+            // guarding on the exact version of a non split instance dict would only ever match
+            // this instance, which just thrashes the global entry
+            if (is_megamorphic_entry && dict)
+                return -1;
             la->u.value_cache.dict_ver = getDictVersionFromDictPtr(dictptr);
             la->u.value_cache.obj = res;
             la->cache_type = LA_CACHE_VALUE_CACHE_DICT;
@@ -2267,55 +2344,268 @@ common_cached:
     return 0;
 }
 
-//#define PROFILE_OPCODES 1
-#if PROFILE_OPCODES
-PyObject* opcode_profile_dict;
-int opcode_profile_enabled;
-static PyObject* update_opcode_profile_func_enter(PyFrameObject* f) {
-    if (!opcode_profile_enabled)
-        return 0;
-    char func_path[512];
-    sprintf(func_path, "%s:%d:%s() has %ld opcodes", PyUnicode_AsUTF8(f->f_code->co_filename), f->f_code->co_firstlineno, PyUnicode_AsUTF8(f->f_code->co_name), PyBytes_Size(f->f_code->co_code)/2);
-
-    if (!opcode_profile_dict)
-        opcode_profile_dict = PyDict_New();
-
-    PyObject* entry = PyDict_GetItemString(opcode_profile_dict, func_path);
-    if (!entry) {
-        entry = PyDict_New();
-        PyDict_SetItemString(opcode_profile_dict, func_path, entry);
-    }
-    static PyObject* one = NULL;
-    if (!one)
-        one = PyLong_FromLong(1);
-    const char* func_counter_name = "num_func_called";
-    PyObject* func_counter = PyDict_GetItemString(entry, func_counter_name);
-    if (!func_counter)
-        PyDict_SetItemString(entry, func_counter_name, one);
-    else {
-        PyObject* value = PyNumber_Add(func_counter, one);
-        PyDict_SetItemString(entry, func_counter_name, value);
-        Py_DECREF(value);
+// Per instruction execution counts, opcache events and operand types which can be
+// enabled at runtime via pyston.jit.enable_opcode_stats().
+// While enabled we increment tracing_possible like sys.settrace() does: this makes the interpreter
+// take the slow dispatch path where the counting happens, and the JIT code bail out to the
+// interpreter. The cache event counting only happens on the slow paths of the caches,
+// so the number of hits gets calculated from the execution count.
+enum {
+    OPCODE_STATS_CACHE_MISS,        // the cache got checked but did not match
+    OPCODE_STATS_CACHE_UNOPTIMIZED, // there is a cache entry but it's not filled in or got disabled
+    OPCODE_STATS_CACHE_NO_OPCACHE,  // the function did not get called often enough to have an opcache
+    OPCODE_STATS_CACHE_UNCACHED,    // the operation can't be cached (e.g. the globals are not a dict)
+    OPCODE_STATS_CACHE_DISABLED,    // the cache gave up after too many misses (also counted as miss)
+    OPCODE_STATS_NUM_CACHE_EVENTS
+};
+static const char* const opcode_stats_cache_event_names[OPCODE_STATS_NUM_CACHE_EVENTS] = {
+    "misses", "unoptimized", "no_opcache", "uncached", "disabled"
+};
+
+typedef struct {
+    PyCodeObject* code; // owned reference
+    int num_instrs;
+    unsigned long long* counts; // number of executions per instruction
+    unsigned long long (*cache_events)[OPCODE_STATS_NUM_CACHE_EVENTS]; // per instruction, allocated lazily
+    PyObject* types; // dict: instruction offset -> {tuple of operand types: count}, NULL if not recorded
+} OpcodeStats;
+
+int opcode_stats_enabled = 0;
+static int opcode_stats_record_types = 0;
+// open addressing hash table keyed by the code object address
+static OpcodeStats** opcode_stats_table = NULL;
+static long opcode_stats_table_size = 0, opcode_stats_num_entries = 0;
+static OpcodeStats* opcode_stats_last = NULL; // most recently used entry
+
+static OpcodeStats** opcode_stats_lookup(OpcodeStats** table, long size, PyCodeObject* co) {
+    long i = _Py_HashPointer(co) & (size - 1);
+    while (table[i] && table[i]->code != co)
+        i = (i + 1) & (size - 1);
+    return &table[i];
+}
+
+static OpcodeStats* opcode_stats_get(PyCodeObject* co) {
+    if (opcode_stats_last && opcode_stats_last->code == co)
+        return opcode_stats_last;
+
+    if (opcode_stats_table) {
+        OpcodeStats* stats = *opcode_stats_lookup(opcode_stats_table, opcode_stats_table_size, co);
+        if (stats)
+            return opcode_stats_last = stats;
+    }
+
+    // new code object, make sure the table stays at most half full
+    if ((opcode_stats_num_entries + 1) * 2 > opcode_stats_table_size) {
+        long new_size = opcode_stats_table_size ? opcode_stats_table_size * 2 : 1024;
+        OpcodeStats** new_table = PyMem_Calloc(new_size, sizeof(OpcodeStats*));
+        if (!new_table)
+            return NULL;
+        for (long i=0; i<opcode_stats_table_size; ++i) {
+            if (opcode_stats_table[i])
+                *opcode_stats_lookup(new_table, new_size, opcode_stats_table[i]->code) = opcode_stats_table[i];
+        }
+        PyMem_Free(opcode_stats_table);
+        opcode_stats_table = new_table;
+        opcode_stats_table_size = new_size;
     }
-    return entry;
+
+    OpcodeStats* stats = PyMem_Calloc(1, sizeof(OpcodeStats));
+    if (!stats)
+        return NULL;
+    stats->num_instrs = PyBytes_GET_SIZE(co->co_code) / sizeof(_Py_CODEUNIT);
+    stats->counts = PyMem_Calloc(stats->num_instrs, sizeof(unsigned long long));
+    if (!stats->counts) {
+        PyMem_Free(stats);
+        return NULL;
+    }
+    // keep the code object alive so that its address can't get reused
+    Py_INCREF(co);
+    stats->code = co;
+    *opcode_stats_lookup(opcode_stats_table, opcode_stats_table_size, co) = stats;
+    ++opcode_stats_num_entries;
+    return opcode_stats_last = stats;
+}
+
+static void opcode_stats_clear(void) {
+    // Detach the table first: the DECREFs can run Python code (e.g. weakref callbacks)
+    // which records new stats while the stats are enabled.
+    OpcodeStats** table = opcode_stats_table;
+    long table_size = opcode_stats_table_size;
+    opcode_stats_table = NULL;
+    opcode_stats_table_size = opcode_stats_num_entries = 0;
+    opcode_stats_last = NULL;
+
+    for (long i=0; i<table_size; ++i) {
+        OpcodeStats* stats = table[i];
+        if (!stats)
+            continue;
+        PyObject* types = stats->types;
+        PyCodeObject* code = stats->code;
+        PyMem_Free(stats->counts);
+        PyMem_Free(stats->cache_events);
+        PyMem_Free(stats);
+        Py_XDECREF(types);
+        Py_DECREF(code);
+    }
+    PyMem_Free(table);
+}
+
+// returns how many values on top of the stack are inputs of the opcode whose types we record
+static int opcode_stats_num_operands(int opcode) {
+    switch (opcode) {
+    case UNARY_POSITIVE:
+    case UNARY_NEGATIVE:
+    case UNARY_NOT:
+    case UNARY_INVERT:
+    case LOAD_ATTR:
+    case LOAD_METHOD:
+    case GET_ITER:
+    case FOR_ITER:
+        return 1;
+
+    case BINARY_POWER:
+    case BINARY_MULTIPLY:
+    case BINARY_MATRIX_MULTIPLY:
+    case BINARY_FLOOR_DIVIDE:
+    case BINARY_TRUE_DIVIDE:
+    case BINARY_MODULO:
+    case BINARY_ADD:
+    case BINARY_SUBTRACT:
+    case BINARY_SUBSCR:
+    case BINARY_LSHIFT:
+    case BINARY_RSHIFT:
+    case BINARY_AND:
+    case BINARY_XOR:
+    case BINARY_OR:
+    case INPLACE_POWER:
+    case INPLACE_MULTIPLY:
+    case INPLACE_MATRIX_MULTIPLY:
+    case INPLACE_FLOOR_DIVIDE:
+    case INPLACE_TRUE_DIVIDE:
+    case INPLACE_MODULO:
+    case INPLACE_ADD:
+    case INPLACE_SUBTRACT:
+    case INPLACE_LSHIFT:
+    case INPLACE_RSHIFT:
+    case INPLACE_AND:
+    case INPLACE_XOR:
+    case INPLACE_OR:
+    case COMPARE_OP:
+    case STORE_ATTR:
+        return 2;
+
+    case STORE_SUBSCR:
+        return 3;
+    }
+    return 0;
+}
+
+static void opcode_stats_record_operand_types(OpcodeStats* stats, int inst_idx, int num_operands, PyObject** stack_pointer) {
+    PyObject* key = PyTuple_New(num_operands);
+    if (!key)
+        goto error;
+    for (int i=0; i<num_operands; ++i) {
+        PyObject* operand = stack_pointer[i - num_operands];
+        PyObject* type = operand ? (PyObject*)Py_TYPE(operand) : Py_None;
+        Py_INCREF(type);
+        PyTuple_SET_ITEM(key, i, type);
+    }
+
+    if (!stats->types && !(stats->types = PyDict_New()))
+        goto error;
+    PyObject* offset = PyLong_FromLong(inst_idx * sizeof(_Py_CODEUNIT));
+    if (!offset)
+        goto error;
+    PyObject* hist = PyDict_GetItem(stats->types, offset);
+    if (!hist) {
+        hist = PyDict_New();
+        if (!hist || PyDict_SetItem(stats->types, offset, hist) < 0) {
+            Py_XDECREF(hist);
+            Py_DECREF(offset);
+            goto error;
+        }
+        Py_DECREF(hist);
+    }
+    Py_DECREF(offset);
+
+    PyObject* count = PyDict_GetItem(hist, key);
+    PyObject* new_count = PyLong_FromUnsignedLongLong(count ? PyLong_AsUnsignedLongLong(count) + 1 : 1);
+    if (!new_count || PyDict_SetItem(hist, key, new_count) < 0) {
+        Py_XDECREF(new_count);
+        goto error;
+    }
+    Py_DECREF(new_count);
+    Py_DECREF(key);
+    return;
+
+error:
+    // there is never a pending exception when we start dispatching an opcode
+    PyErr_Clear();
+    Py_XDECREF(key);
 }
 
-static void update_opcode_profile(PyObject* func_entry, const char* opcode) {
-    if (!opcode_profile_enabled)
+// gets called for every executed instruction while the opcode stats are enabled
+static void __attribute__((noinline)) opcode_stats_record(PyFrameObject* f, int inst_idx, int opcode, PyObject** stack_pointer) {
+    OpcodeStats* stats = opcode_stats_get(f->f_code);
+    if (!stats)
         return;
-    static PyObject* one = NULL;
-    if (!one)
-        one = PyLong_FromLong(1);
-    PyObject* opcode_counter = PyDict_GetItemString(func_entry, opcode);
-    if (!opcode_counter)
-        PyDict_SetItemString(func_entry, opcode, one);
-    else {
-        PyObject* value = PyNumber_Add(opcode_counter, one);
-        PyDict_SetItemString(func_entry, opcode, value);
-        Py_DECREF(value);
+    stats->counts[inst_idx]++;
+
+    if (opcode_stats_record_types) {
+        int num_operands = opcode_stats_num_operands(opcode);
+        if (num_operands)
+            opcode_stats_record_operand_types(stats, inst_idx, num_operands, stack_pointer);
     }
 }
+
+static void __attribute__((noinline)) opcode_stats_cache_event(PyCodeObject* co, int inst_idx, int event) {
+    OpcodeStats* stats = opcode_stats_get(co);
+    if (!stats)
+        return;
+    if (!stats->cache_events) {
+        stats->cache_events = PyMem_Calloc(stats->num_instrs, sizeof(*stats->cache_events));
+        if (!stats->cache_events)
+            return;
+    }
+    stats->cache_events[inst_idx][event]++;
+}
+
+// records a cache event for the instruction currently executing in the interpreter
+#define OPCODE_STATS_CACHE_EVENT(event) \
+    do { \
+        if (unlikely(opcode_stats_enabled)) \
+            opcode_stats_cache_event(co, (int)(next_instr - first_instr) - 1, event); \
+    } while (0)
+
+#if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 8
+#define OPCODE_STATS_TRACING_POSSIBLE() (_PyRuntime.ceval.tracing_possible)
+#elif PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION == 9
+#define OPCODE_STATS_TRACING_POSSIBLE() (PyThreadState_Get()->interp->ceval.tracing_possible)
+#endif
+
+static int opcode_stats_enable(int record_types) {
+#ifndef OPCODE_STATS_TRACING_POSSIBLE
+    // 3.10 moved to a per thread use_tracing flag which we would have to set on every thread
+    PyErr_SetString(PyExc_NotImplementedError, "opcode stats are only supported on Python 3.9 and older");
+    return -1;
+#else
+    opcode_stats_record_types = record_types;
+    if (!opcode_stats_enabled) {
+        opcode_stats_enabled = 1;
+        OPCODE_STATS_TRACING_POSSIBLE() += 1;
+    }
+    return 0;
 #endif
+}
+
+static void opcode_stats_disable(void) {
+#ifdef OPCODE_STATS_TRACING_POSSIBLE
+    if (opcode_stats_enabled) {
+        opcode_stats_enabled = 0;
+        OPCODE_STATS_TRACING_POSSIBLE() -= 1;
+    }
+#endif
+}
 
 typedef struct {
     unsigned long ret_val;
@@ -2337,15 +2627,31 @@ void jit_start_lite();
 #define jit_start jit_start_lite
 void jit_finish_lite();
 #define jit_finish jit_finish_lite
+void jit_free_code_lite(void* code);
+#define jit_free_code jit_free_code_lite
 #else
 JitFunc jit_func(PyCodeObject* co, PyThreadState* tstate);
 void jit_start();
 void jit_finish();
+void jit_free_code(void* code);
 #endif
+int jit_profile_is_hot(PyCodeObject* co);
+void jit_retire_code(PyCodeObject* co, void* code, PyThreadState* tstate);
+extern unsigned long jit_stat_osr_compiles, jit_stat_osr_entries;
+extern unsigned long jit_stat_gen_resumes, jit_stat_gen_resumes_native;
 static long opcache_min_runs = OPCACHE_MIN_RUNS;
 static long jit_min_runs = JIT_MIN_RUNS;
+// number of loop iterations (plus 10 per call) after which a function gets compiled and entered mid-loop.
+// -1 means use jit_min_runs.
+static long jit_osr_min_runs = -1;
+#define JIT_OSR_MIN_RUNS() (jit_osr_min_runs >= 0 ? jit_osr_min_runs : jit_min_runs)
 
 #define JIT_FUNC_FAILED ((JitFunc)0x1)
+// marks code objects which are waiting in the background compilation queue
+#define JIT_FUNC_QUEUED ((JitFunc)0x2)
+
+static int jit_background = 0;
+static int jit_background_enqueue(PyCodeObject* co);
 
 #ifdef PYSTON_LITE
 typedef struct {
@@ -2379,6 +2685,33 @@ _PyCode_SetExtraFast(PyObject *code, Py_ssize_t index, void *extra)
     co_extra->ce_extras[index] = extra;
 }
 
+// Makes sure the co_extra space for the opcache and the jit code is allocated.
+static inline int allocateCodeExtra(PyCodeObject* code) {
+    // This is a modified version of the allocation in _PyCode_SetExtra
+    int needed_indices = code_opcache_index + (sizeof(OpCache) + sizeof(void*) - 1) / sizeof(void*);
+    _PyCodeObjectExtra *co_extra = (_PyCodeObjectExtra *) code->co_extra;
+    if (likely(co_extra != NULL && co_extra->ce_size >= needed_indices))
+        return 0;
+
+    Py_ssize_t i = (co_extra == NULL ? 0 : co_extra->ce_size);
+
+    // In CPython they set this to interp->co_extra_user_count:
+    int to_allocate = needed_indices;
+
+    co_extra = PyMem_Realloc(
+            co_extra,
+            sizeof(_PyCodeObjectExtra) +
+            (to_allocate - 1) * sizeof(void*));
+    if (co_extra == NULL)
+        return -1;
+    for (; i < to_allocate; i++) {
+        co_extra->ce_extras[i] = NULL;
+    }
+    co_extra->ce_size = to_allocate;
+    code->co_extra = co_extra;
+    return 0;
+}
+
 static inline void* getJitCode(PyCodeObject* code) {
     return *_PyCode_GetExtraPointerFast((PyObject*)code, code_jitfunc_index);
 }
@@ -2397,6 +2730,15 @@ static inline void setJitCode(PyCodeObject* code, void* jit_code) {
 }
 #endif
 
+// Reverts the function to the interpreter and frees its machine code.
+// Used by the JIT to make room for hotter functions, so the function has to get hot again before it gets recompiled.
+void __attribute__((visibility("hidden"))) jit_evict_code(PyCodeObject* co) {
+    void* code = getJitCode(co);
+    setJitCode(co, NULL);
+    _PyCode_GetOpcache(co)->oc_opcache_flag = opcache_min_runs;
+    jit_free_code(code);
+}
+
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 9
 static PyObject* _Py_HOT_FUNCTION
 _PyEval_EvalFrame_AOT_JIT(PyFrameObject *f, PyThreadState * const tstate, PyObject** stack_pointer, JitFunc jit_code);
@@ -2916,36 +3258,50 @@ _PyEval_EvalFrame_AOT_Interpreter(PyFrameObject *f, int throwflag, PyThreadState
         ++opcache->oc_opcache_flag;  \
         OPCACHE_INIT_IF_HIT_THRESHOLD();  \
         /* check if we should switch over to the JIT (OSR) */  \
-        if (opcache->oc_opcache_flag > jit_min_runs && can_use_jit \
+        if (opcache->oc_opcache_flag > JIT_OSR_MIN_RUNS() && can_use_jit \
             && !_Py_TracingPossible(ceval)) { /* don't OSR if tracing is enabled because we seem to skip a line */ \
             void* code = getJitCode(co); \
+            if (code == NULL && jit_background && jit_background_enqueue(co) == 0) \
+                code = JIT_FUNC_QUEUED; \
             if (code == NULL) { \
                 code = jit_func(co, tstate);  \
                 if (code) {  \
                     setJitCode(co, code); \
-                    /* JUMPTO() did not update f->f_lasti  \
-                    (it still points to the JUMP_ABSOLUTE - not the destination of the jump)  \
-                     update f->f_lasti manually like DISPATCH() would do because  \
-                     we can only enter the machine code at jump targets. */ \
-                    f->f_lasti = INSTR_OFFSET() - INST_IDX_TO_LASTI_FACTOR; /* -INST_IDX_TO_LASTI_FACTOR because our JIT entry is always adding a instruction */ \
-                    return EXECUTE_COMPILED_FUNC(); \
+                    ++jit_stat_osr_compiles; \
                 } else { \
                     /* never try again to JIT compile this python function */ \
                     setJitCode(co, JIT_FUNC_FAILED); \
                     can_use_jit = 0; \
                 } \
             } \
+            /* the machine code may also have been published by the background compiler */ \
+            if (code && code != JIT_FUNC_FAILED && code != JIT_FUNC_QUEUED) { \
+                /* JUMPTO() did not update f->f_lasti  \
+                (it still points to the JUMP_ABSOLUTE - not the destination of the jump)  \
+                 update f->f_lasti manually like DISPATCH() would do because  \
+                 we can only enter the machine code at jump targets. */ \
+                f->f_lasti = INSTR_OFFSET() - INST_IDX_TO_LASTI_FACTOR; /* -INST_IDX_TO_LASTI_FACTOR because our JIT entry is always adding a instruction */ \
+                ++jit_stat_osr_entries; \
+                return EXECUTE_COMPILED_FUNC(); \
+            } \
         } \
     } while (0)
 
 /* Start of code */
-#if PROFILE_OPCODES
-    PyObject* profile_func_entry = update_opcode_profile_func_enter(f);
-#endif
 
     co = f->f_code;
     OpCache *opcache = _PyCode_GetOpcache(co);
 
+    // first execution of this code object: if a previous process found it to be hot skip most of the warm-up.
+    // We still run it a few times in the interpreter so that the opcache gets filled in before we JIT it.
+    if (opcache->oc_opcache_flag == 0 && can_use_jit && jit_profile_is_hot(co)) {
+        opcache->oc_opcache_flag = jit_min_runs - JIT_PROFILE_WARMUP_RUNS;
+        if (opcache->oc_opcache_flag < opcache_min_runs)
+            opcache->oc_opcache_flag = opcache_min_runs;
+        if (opcache->oc_opcache_map == NULL && INIT_OPCACHE(co, opcache) < 0)
+            return NULL;
+    }
+
     if (can_use_jit && opcache->oc_opcache_flag >= jit_min_runs /* jit after that many calls or gen yields */) {
         void* code = getJitCode(co);
 
@@ -2954,26 +3310,30 @@ _PyEval_EvalFrame_AOT_Interpreter(PyFrameObject *f, int throwflag, PyThreadState
             if (opcache->oc_opcache_map == NULL) {
                 INIT_OPCACHE(co, opcache);
             }
+            if (jit_background && jit_background_enqueue(co) == 0) {
+                // keep interpreting, the next call will use the machine code once it got published
+            } else {
 #if 0
-            struct timespec start, end;
-            clock_gettime(CLOCK_REALTIME, &start);
-            co->co_jit_code = jit_func_lite(co, tstate);
-            clock_gettime(CLOCK_REALTIME, &end);
-            long time = 1000*1000 * (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1000;
-            static long totaltime = 0;
-            totaltime += time;
-            printf("Took %ldus to jit %s (totaltime: %ld us)\n",
-                    time, PyUnicode_AsUTF8(co->co_name), totaltime);
+                struct timespec start, end;
+                clock_gettime(CLOCK_REALTIME, &start);
+                co->co_jit_code = jit_func_lite(co, tstate);
+                clock_gettime(CLOCK_REALTIME, &end);
+                long time = 1000*1000 * (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1000;
+                static long totaltime = 0;
+                totaltime += time;
+                printf("Took %ldus to jit %s (totaltime: %ld us)\n",
+                        time, PyUnicode_AsUTF8(co->co_name), totaltime);
 #else
-            code = jit_func(co, tstate);
+                code = jit_func(co, tstate);
 #endif
-            if (code) {
-                setJitCode(co, code);
-                return EXECUTE_COMPILED_FUNC();
-            } else {
-                // never try again to JIT compile this python function
-                setJitCode(co, JIT_FUNC_FAILED);
-                can_use_jit = 0;
+                if (code) {
+                    setJitCode(co, code);
+                    return EXECUTE_COMPILED_FUNC();
+                } else {
+                    // never try again to JIT compile this python function
+                    setJitCode(co, JIT_FUNC_FAILED);
+                    can_use_jit = 0;
+                }
             }
         }
     }
@@ -3012,6 +3372,10 @@ _PyEval_EvalFrame_AOT_Interpreter(PyFrameObject *f, int throwflag, PyThreadState
 #else
         next_instr += f->f_lasti + 1;
 #endif
+        // count resumes like loop iterations so that coroutines which await a lot get compiled
+        // even if they only get created a few times.
+        ++opcache->oc_opcache_flag;
+        OPCACHE_INIT_IF_HIT_THRESHOLD();
     } else { // function entry
         opcache->oc_opcache_flag += OPCACHE_INC_FUNC_ENTRY;
         OPCACHE_INIT_IF_HIT_THRESHOLD();
@@ -3148,6 +3512,8 @@ main_loop:
 #endif
         dxp[opcode]++;
 #endif
+        if (unlikely(opcode_stats_enabled))
+            opcode_stats_record(f, (int)(next_instr - first_instr) - 1, opcode, stack_pointer);
 
 #else
     tracing_dispatch:
@@ -4525,11 +4891,15 @@ main_loop:
                     STACK_SHRINK(2);
                     goto sa_common;
                 }
+                OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_MISS);
                 if (++co_opcache->num_failed > 15) {
                     // stop even trying to use the cache
                     // the cache setup code will also not fill it anymore because it checks num_failed
                     co_opcache->optimized = 0;
+                    OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_DISABLED);
                 }
+            } else {
+                OPCODE_STATS_CACHE_EVENT(co_opcache ? OPCODE_STATS_CACHE_UNOPTIMIZED : OPCODE_STATS_CACHE_NO_OPCACHE);
             }
             STACK_SHRINK(2);
             err = PyObject_SetAttr(owner, name, v);
@@ -4698,12 +5068,15 @@ sa_common:
 #if OPCACHE_STATS
                     loadglobal_misses++;
 #endif
+                    OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_MISS);
                     co_opcache->num_failed++;
                 }
+                else {
 #if OPCACHE_STATS
-                else
                     loadglobal_noopcache++;
 #endif
+                    OPCODE_STATS_CACHE_EVENT(co_opcache ? OPCODE_STATS_CACHE_UNOPTIMIZED : OPCODE_STATS_CACHE_NO_OPCACHE);
+                }
 
                 int wasglobal;
                 v = _PyDict_LoadGlobalEx((PyDictObject *)f->f_globals,
@@ -4767,6 +5140,7 @@ sa_common:
 #if OPCACHE_STATS
                 loadglobal_uncached++;
 #endif
+                OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_UNCACHED);
 
                 /* namespace 1: globals */
                 name = GETITEM(names, oparg);
@@ -5288,11 +5662,15 @@ sa_common:
             if (USE_LOAD_ATTR_CACHE && co_opcache && co_opcache->optimized) {
                 if (likely(loadAttrCache(owner, name, co_opcache, &res, NULL) == 0))
                     goto la_common;
+                OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_MISS);
                 if (++co_opcache->num_failed > 15) {
                     // stop even trying to use the cache
                     // the cache setup code will also not fill it anymore because it checks num_failed
                     co_opcache->optimized = 0;
+                    OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_DISABLED);
                 }
+            } else {
+                OPCODE_STATS_CACHE_EVENT(co_opcache ? OPCODE_STATS_CACHE_UNOPTIMIZED : OPCODE_STATS_CACHE_NO_OPCACHE);
             }
 
 
@@ -5306,7 +5684,7 @@ sa_common:
 #endif
 
             if (USE_LOAD_ATTR_CACHE && co_opcache && res) {
-                setupLoadAttrCache(owner, name, co_opcache, res, 0 /*= not LOAD_METHOD*/, 1 /*inside interpreter*/);
+                setupLoadAttrCache(owner, name, co_opcache, res, 0 /*= not LOAD_METHOD*/);
             }
 la_common:
             Py_DECREF(owner);
@@ -6153,11 +6531,15 @@ la_common:
                     }
                     goto lm_before_dispatch;
                 }
+                OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_MISS);
                 if (++co_opcache->num_failed > 15) {
                     // stop even trying to use the cache
                     // the cache setup code will also not fill it anymore because it checks num_failed
                     co_opcache->optimized = 0;
+                    OPCODE_STATS_CACHE_EVENT(OPCODE_STATS_CACHE_DISABLED);
                 }
+            } else {
+                OPCODE_STATS_CACHE_EVENT(co_opcache ? OPCODE_STATS_CACHE_UNOPTIMIZED : OPCODE_STATS_CACHE_NO_OPCACHE);
             }
             meth = NULL;
 
@@ -6176,7 +6558,7 @@ la_common:
             }
 
             if (USE_LOAD_METHOD_CACHE && co_opcache) {
-                setupLoadAttrCache(obj, name, co_opcache, meth, 1 /*= LOAD_METHOD*/, 1 /*inside interpreter*/);
+                setupLoadAttrCache(obj, name, co_opcache, meth, 1 /*= LOAD_METHOD*/);
             }
 
             if (meth_found) {
@@ -7374,31 +7756,11 @@ _PyEval_EvalFrameDefault
     // We need the opcache struct on the first execution of the function so that we can start
     // counting the number of calls, so as an optimization we allocate all of the necessary
     // co_extra space at the beginning and skip the null- and size-checks during execution.
-
-    // This is a modified version of the allocation in _PyCode_SetExtra
-    int needed_indices = code_opcache_index + (sizeof(OpCache) + sizeof(void*) - 1) / sizeof(void*);
-    _PyCodeObjectExtra *co_extra = (_PyCodeObjectExtra *) f->f_code->co_extra;
-    if (co_extra == NULL || co_extra->ce_size < needed_indices) {
-        Py_ssize_t i = (co_extra == NULL ? 0 : co_extra->ce_size);
-
-        // In CPython they set this to interp->co_extra_user_count:
-        int to_allocate = needed_indices;
-
-        co_extra = PyMem_Realloc(
-                co_extra,
-                sizeof(_PyCodeObjectExtra) +
-                (to_allocate - 1) * sizeof(void*));
-        if (co_extra == NULL) {
-            // have to reset tstate frame handling or we will crash.
-            // CPython 3.10 test_reply.py is checking this by simulating running out of memory
-            retval = NULL;
-            goto exit_eval_frame;
-        }
-        for (; i < to_allocate; i++) {
-            co_extra->ce_extras[i] = NULL;
-        }
-        co_extra->ce_size = to_allocate;
-        f->f_code->co_extra = co_extra;
+    if (allocateCodeExtra(f->f_code) < 0) {
+        // have to reset tstate frame handling or we will crash.
+        // CPython 3.10 test_reply.py is checking this by simulating running out of memory
+        retval = NULL;
+        goto exit_eval_frame;
     }
 #endif
 
@@ -7408,16 +7770,26 @@ _PyEval_EvalFrameDefault
     // It looks like they are not changeable for a given frame, so we only have to check once
     // at the beginning, but they're not fixed for a code object so we can't just check at jit time.
     // Also don't enter the jit if the throwflag is set which skips the main code path and goes to error path.
-    int can_use_jit = jit_code != JIT_FUNC_FAILED && PyDict_CheckExact(f->f_globals) && PyDict_CheckExact(f->f_builtins) && !throwflag;
+    // While the opcode stats are enabled every instruction has to go through the interpreter.
+    int can_use_jit = jit_code != JIT_FUNC_FAILED && PyDict_CheckExact(f->f_globals) && PyDict_CheckExact(f->f_builtins) && !throwflag
+                      && !opcode_stats_enabled;
+
+    // only suspended generator and coroutine frames get entered with f_lasti already set.
+    // The machine code continues them at the instruction after the yield.
+    if (f->f_lasti >= 0) {
+        ++jit_stat_gen_resumes;
+        if (jit_code != NULL && jit_code != JIT_FUNC_QUEUED && can_use_jit)
+            ++jit_stat_gen_resumes_native;
+    }
 
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 9
-    if (jit_code != NULL && can_use_jit) {
+    if (jit_code != NULL && jit_code != JIT_FUNC_QUEUED && can_use_jit) {
         return _PyEval_EvalFrame_AOT_JIT(f, tstate, stack_pointer, jit_code);
     } else {
         return _PyEval_EvalFrame_AOT_Interpreter(f, throwflag, tstate, stack_pointer, can_use_jit, 0);
     }
 #else
-    if (jit_code != NULL && can_use_jit) {
+    if (jit_code != NULL && jit_code != JIT_FUNC_QUEUED && can_use_jit) {
         return _PyEval_EvalFrame_AOT_JIT(f, tstate, stack_pointer, jit_code, &trace_info);
     } else {
         return _PyEval_EvalFrame_AOT_Interpreter(f, throwflag, tstate, stack_pointer, can_use_jit, 0, &trace_info);
@@ -9688,6 +10060,649 @@ aot_ceval_test(PyObject *self, PyObject *args)
 {
     Py_RETURN_NONE;
 }
+
+// Background compilation (JIT_BACKGROUND=1 or pyston.jit.set_config(background=1)):
+// Instead of compiling a function which crossed the JIT threshold inside the call which triggered it
+// the interpreter appends it to a queue and keeps interpreting it.
+// A compiler thread takes the functions out of the queue and publishes the machine code which
+// gets used by the next call (or loop iteration via OSR).
+// Limitation: the compiler thread holds the GIL for the whole compilation of a function because
+// the JIT uses the C API and reads the opcache which the interpreter modifies while it emits the code.
+// So the other threads still stall while a function gets compiled. Background compilation only moves
+// the stall out of the call which crossed the threshold and spreads the compilation of many functions
+// over time, because the compiler thread gives up the GIL after every function.
+// The thread gets stopped and joined by an atexit handler, before the interpreter gets finalized.
+#define JIT_BACKGROUND_QUEUE_SIZE 256
+static struct {
+    PyCodeObject* co; // owned
+    _PyTime_t enqueue_time;
+} jit_background_queue[JIT_BACKGROUND_QUEUE_SIZE];
+static int jit_background_queue_begin = 0, jit_background_queue_len = 0;
+// locked while the compiler thread waits for new entries
+static PyThread_type_lock jit_background_lock = NULL;
+// locked while the compiler thread is running
+static PyThread_type_lock jit_background_done_lock = NULL;
+static int jit_background_thread_waiting = 0, jit_background_stopping = 0;
+static pid_t jit_background_pid = 0; // process which started the compiler thread
+static long jit_background_queue_len_max = 0, jit_background_num_compiled = 0;
+static _PyTime_t jit_background_latency_total = 0, jit_background_latency_max = 0;
+
+static void jit_background_thread(void* arg) {
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    PyThreadState* tstate = PyThreadState_GET();
+    while (!jit_background_stopping) {
+        if (jit_background_queue_len == 0) {
+            jit_background_thread_waiting = 1;
+            Py_BEGIN_ALLOW_THREADS
+            PyThread_acquire_lock(jit_background_lock, WAIT_LOCK);
+            Py_END_ALLOW_THREADS
+            continue;
+        }
+
+        PyCodeObject* co = jit_background_queue[jit_background_queue_begin].co;
+        _PyTime_t enqueue_time = jit_background_queue[jit_background_queue_begin].enqueue_time;
+        jit_background_queue_begin = (jit_background_queue_begin + 1) % JIT_BACKGROUND_QUEUE_SIZE;
+        --jit_background_queue_len;
+
+        // skip it if it got compiled or blacklisted in the meantime
+        if (getJitCode(co) == JIT_FUNC_QUEUED) {
+            void* code = jit_func(co, tstate);
+            setJitCode(co, code ? code : JIT_FUNC_FAILED);
+
+            _PyTime_t latency = _PyTime_GetMonotonicClock() - enqueue_time;
+            jit_background_latency_total += latency;
+            if (latency > jit_background_latency_max)
+                jit_background_latency_max = latency;
+            ++jit_background_num_compiled;
+        }
+        Py_DECREF(co);
+
+        // give the other threads a chance to run before compiling the next function
+        Py_BEGIN_ALLOW_THREADS
+        Py_END_ALLOW_THREADS
+    }
+    PyGILState_Release(gstate);
+    PyThread_release_lock(jit_background_done_lock);
+}
+
+// Starts the compiler thread in this process. Returns 0 on success.
+static int jit_background_start_thread(void) {
+    // a forked child inherits the locks in an undefined state, so always allocate new ones
+    jit_background_lock = PyThread_allocate_lock();
+    jit_background_done_lock = PyThread_allocate_lock();
+    if (!jit_background_lock || !jit_background_done_lock)
+        goto error;
+    PyThread_acquire_lock(jit_background_lock, WAIT_LOCK);
+    PyThread_acquire_lock(jit_background_done_lock, WAIT_LOCK);
+    jit_background_thread_waiting = 0;
+    if (PyThread_start_new_thread(jit_background_thread, NULL) == PYTHREAD_INVALID_THREAD_ID)
+        goto error;
+    jit_background_pid = getpid();
+    return 0;
+
+error:
+    if (jit_background_lock)
+        PyThread_free_lock(jit_background_lock);
+    if (jit_background_done_lock)
+        PyThread_free_lock(jit_background_done_lock);
+    jit_background_lock = jit_background_done_lock = NULL;
+    jit_background = 0;
+    return -1;
+}
+
+// atexit handler: stops the compiler thread of this process and waits until it exited.
+// This has to happen before finalization starts because afterwards a thread which tries to
+// take the GIL just exits.
+static PyObject* jit_background_stop(PyObject* self, PyObject* Py_UNUSED(ignored)) {
+    if (jit_background_pid != getpid() || jit_background_stopping)
+        Py_RETURN_NONE;
+
+    // code which runs after this compiles synchronously again
+    jit_background = 0;
+    jit_background_stopping = 1;
+    if (jit_background_thread_waiting) {
+        jit_background_thread_waiting = 0;
+        PyThread_release_lock(jit_background_lock);
+    }
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(jit_background_done_lock, WAIT_LOCK);
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef jit_background_stop_def = {
+    "_jit_background_stop", jit_background_stop, METH_NOARGS, NULL
+};
+
+// The compiler thread does not survive a fork but the queue and the JIT_FUNC_QUEUED markers do.
+// Nothing would compile the queued functions because the interpreter only enqueues code objects
+// without machine code, so restart the thread right away in the child.
+static PyObject* jit_background_after_fork_child(PyObject* self, PyObject* Py_UNUSED(ignored)) {
+    if (jit_background_queue_len > 0 && jit_background_pid != getpid())
+        jit_background_start_thread();
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef jit_background_after_fork_def = {
+    "_jit_background_after_fork", jit_background_after_fork_child, METH_NOARGS, NULL
+};
+
+static void jit_background_register_at_fork(void) {
+    PyObject* func = PyCFunction_New(&jit_background_after_fork_def, NULL);
+    PyObject* posix = PyImport_ImportModule("posix");
+    PyObject* register_at_fork = posix ? PyObject_GetAttrString(posix, "register_at_fork") : NULL;
+    PyObject* kwargs = func ? Py_BuildValue("{s:O}", "after_in_child", func) : NULL;
+    PyObject* args = PyTuple_New(0);
+    PyObject* res = NULL;
+    if (register_at_fork && kwargs && args)
+        res = PyObject_Call(register_at_fork, args, kwargs);
+    if (!res) // e.g. no fork() support, queued functions get compiled on the next enqueue in the child
+        PyErr_Clear();
+    Py_XDECREF(res);
+    Py_XDECREF(args);
+    Py_XDECREF(kwargs);
+    Py_XDECREF(register_at_fork);
+    Py_XDECREF(posix);
+    Py_XDECREF(func);
+}
+
+// forked children inherit the atexit handler, it only stops the thread of the process it runs in
+static void jit_background_register_atexit(void) {
+    PyObject* func = PyCFunction_New(&jit_background_stop_def, NULL);
+    PyObject* atexit = PyImport_ImportModule("atexit");
+    PyObject* res = NULL;
+    if (func && atexit)
+        res = PyObject_CallMethod(atexit, "register", "O", func);
+    if (!res) // the thread then just dies with the process like a daemon thread
+        PyErr_Clear();
+    Py_XDECREF(res);
+    Py_XDECREF(atexit);
+    Py_XDECREF(func);
+}
+
+// Adds the code object to the background compilation queue.
+// Returns 0 on success and -1 if the caller should compile it synchronously instead.
+static int jit_background_enqueue(PyCodeObject* co) {
+    if (jit_background_queue_len == JIT_BACKGROUND_QUEUE_SIZE || jit_background_stopping)
+        return -1;
+
+    // start the compiler thread on first use and in forked child processes
+    if (jit_background_pid != getpid()) {
+        int first_start = jit_background_pid == 0;
+        if (jit_background_start_thread() < 0)
+            return -1;
+        if (first_start) {
+            jit_background_register_at_fork();
+            jit_background_register_atexit();
+        }
+    }
+
+    int idx = (jit_background_queue_begin + jit_background_queue_len) % JIT_BACKGROUND_QUEUE_SIZE;
+    Py_INCREF(co);
+    jit_background_queue[idx].co = co;
+    jit_background_queue[idx].enqueue_time = _PyTime_GetMonotonicClock();
+    ++jit_background_queue_len;
+    if (jit_background_queue_len > jit_background_queue_len_max)
+        jit_background_queue_len_max = jit_background_queue_len;
+    setJitCode(co, JIT_FUNC_QUEUED);
+
+    if (jit_background_thread_waiting) {
+        jit_background_thread_waiting = 0;
+        PyThread_release_lock(jit_background_lock);
+    }
+    return 0;
+}
+
+// pyston.jit module: runtime inspection and control of the JIT
+PyObject* jit_get_stats(void);
+PyObject* jit_get_compile_report(void);
+int jit_get_config(PyObject* d);
+int jit_set_config(const char* name, PyObject* value);
+
+// returns the (borrowed) code object of a function, method or code object
+static PyCodeObject* jit_module_get_code(PyObject* obj) {
+    if (PyMethod_Check(obj))
+        obj = PyMethod_GET_FUNCTION(obj);
+    if (PyFunction_Check(obj))
+        obj = PyFunction_GET_CODE(obj);
+    if (!PyCode_Check(obj)) {
+        PyErr_Format(PyExc_TypeError, "expected a function or code object, got '%.200s'",
+                     Py_TYPE(obj)->tp_name);
+        return NULL;
+    }
+#ifdef PYSTON_LITE
+    if (allocateCodeExtra((PyCodeObject*)obj) < 0) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+#endif
+    return (PyCodeObject*)obj;
+}
+
+static PyObject *
+jit_module_compile_report(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return jit_get_compile_report();
+}
+
+static PyObject *
+jit_module_stats(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject* d = jit_get_stats();
+    if (!d)
+        return NULL;
+    PyObject* v = PyLong_FromUnsignedLong(megamorphic_cache_hits);
+    if (!v || PyDict_SetItemString(d, "megamorphic_cache_hit", v) < 0)
+        goto error;
+    Py_DECREF(v);
+    v = PyLong_FromUnsignedLong(megamorphic_cache_misses);
+    if (!v || PyDict_SetItemString(d, "megamorphic_cache_miss", v) < 0)
+        goto error;
+    Py_DECREF(v);
+    v = Py_BuildValue("{s:i,s:l,s:l,s:L,s:L}",
+                      "queue_len", jit_background_queue_len,
+                      "queue_len_max", jit_background_queue_len_max,
+                      "num_compiled", jit_background_num_compiled,
+                      "latency_us_total", (long long)_PyTime_AsMicroseconds(jit_background_latency_total, _PyTime_ROUND_CEILING),
+                      "latency_us_max", (long long)_PyTime_AsMicroseconds(jit_background_latency_max, _PyTime_ROUND_CEILING));
+    if (!v || PyDict_SetItemString(d, "background", v) < 0)
+        goto error;
+    Py_DECREF(v);
+    return d;
+error:
+    Py_XDECREF(v);
+    Py_DECREF(d);
+    return NULL;
+}
+
+static PyObject *
+jit_module_get_config(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject* d = Py_BuildValue("{s:l,s:l,s:l,s:i}", "min_runs", jit_min_runs, "opcache_min_runs", opcache_min_runs,
+                                "osr_min_runs", JIT_OSR_MIN_RUNS(), "background", jit_background);
+    if (!d)
+        return NULL;
+    if (jit_get_config(d) < 0) {
+        Py_DECREF(d);
+        return NULL;
+    }
+    return d;
+}
+
+static PyObject *
+jit_module_set_config(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    if (PyTuple_GET_SIZE(args) != 0) {
+        PyErr_SetString(PyExc_TypeError, "set_config() takes only keyword arguments");
+        return NULL;
+    }
+    if (kwds == NULL)
+        Py_RETURN_NONE;
+
+    long new_jit_min_runs = -1, new_opcache_min_runs = -1, new_osr_min_runs = -1;
+    PyObject *key, *value;
+    Py_ssize_t pos = 0;
+    while (PyDict_Next(kwds, &pos, &key, &value)) {
+        const char* name = PyUnicode_AsUTF8(key);
+        if (!name)
+            return NULL;
+
+        if (strcmp(name, "background") == 0) {
+            int v = PyObject_IsTrue(value);
+            if (v < 0)
+                return NULL;
+            jit_background = v;
+            continue;
+        }
+
+        long* threshold = NULL;
+        if (strcmp(name, "min_runs") == 0)
+            threshold = &new_jit_min_runs;
+        else if (strcmp(name, "opcache_min_runs") == 0)
+            threshold = &new_opcache_min_runs;
+        else if (strcmp(name, "osr_min_runs") == 0)
+            threshold = &new_osr_min_runs;
+
+        if (threshold) {
+            *threshold = PyLong_AsLong(value);
+            if (*threshold == -1 && PyErr_Occurred())
+                return NULL;
+            if (*threshold < 0) {
+                PyErr_Format(PyExc_ValueError, "%s must not be negative", name);
+                return NULL;
+            }
+            continue;
+        }
+
+        int res = jit_set_config(name, value);
+        if (res < 0)
+            return NULL;
+        if (res == 0) {
+            PyErr_Format(PyExc_TypeError, "'%s' is an invalid JIT setting", name);
+            return NULL;
+        }
+    }
+
+    // same logic as for the JIT_MIN_RUNS and OPCACHE_MIN_RUNS env vars
+    if (new_jit_min_runs != -1) {
+        jit_min_runs = new_jit_min_runs;
+        if (jit_min_runs / 2 < opcache_min_runs)
+            opcache_min_runs = jit_min_runs / 2;
+    }
+    if (new_osr_min_runs != -1) {
+        jit_osr_min_runs = new_osr_min_runs;
+        if (jit_osr_min_runs / 2 < opcache_min_runs)
+            opcache_min_runs = jit_osr_min_runs / 2;
+    }
+    if (new_opcache_min_runs != -1)
+        opcache_min_runs = new_opcache_min_runs;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+jit_module_compile(PyObject *self, PyObject *obj)
+{
+    PyCodeObject* co = jit_module_get_code(obj);
+    if (!co)
+        return NULL;
+
+    void* code = getJitCode(co);
+    if (code == NULL || code == JIT_FUNC_QUEUED) {
+        // JIT assumes opcache is always on
+        OpCache *opcache = _PyCode_GetOpcache(co);
+        if (opcache->oc_opcache_map == NULL && INIT_OPCACHE(co, opcache) < 0)
+            return NULL;
+
+        code = jit_func(co, PyThreadState_GET());
+        setJitCode(co, code ? code : JIT_FUNC_FAILED);
+    }
+    return PyBool_FromLong(code != NULL && code != JIT_FUNC_FAILED);
+}
+
+static PyObject *
+jit_module_blacklist(PyObject *self, PyObject *obj)
+{
+    PyCodeObject* co = jit_module_get_code(obj);
+    if (!co)
+        return NULL;
+
+    void* code = getJitCode(co);
+    setJitCode(co, JIT_FUNC_FAILED);
+    // Frames of this code object could currently be executing the machine code,
+    // the JIT frees it once they returned.
+    if (code != NULL && code != JIT_FUNC_FAILED && code != JIT_FUNC_QUEUED)
+        jit_retire_code(co, code, PyThreadState_GET());
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+jit_module_is_compiled(PyObject *self, PyObject *obj)
+{
+    PyCodeObject* co = jit_module_get_code(obj);
+    if (!co)
+        return NULL;
+
+    void* code = getJitCode(co);
+    return PyBool_FromLong(code != NULL && code != JIT_FUNC_FAILED && code != JIT_FUNC_QUEUED);
+}
+
+static PyObject *
+jit_module_run_count(PyObject *self, PyObject *obj)
+{
+    PyCodeObject* co = jit_module_get_code(obj);
+    if (!co)
+        return NULL;
+
+    return PyLong_FromLong(_PyCode_GetOpcache(co)->oc_opcache_flag);
+}
+
+static PyObject *
+jit_module_ic_sites(PyObject *self, PyObject *obj)
+{
+    PyCodeObject* co = jit_module_get_code(obj);
+    if (!co)
+        return NULL;
+
+    PyObject* list = PyList_New(0);
+    if (!list)
+        return NULL;
+
+    OpCache* opcache = _PyCode_GetOpcache(co);
+    if (opcache->oc_opcache == NULL)
+        return list;
+
+    _Py_CODEUNIT* instrs = (_Py_CODEUNIT*)PyBytes_AS_STRING(co->co_code);
+    int num_instrs = PyBytes_GET_SIZE(co->co_code) / sizeof(_Py_CODEUNIT);
+    // the last instruction can't have an opcache entry (same as in the JIT)
+    for (int inst_idx = 0; inst_idx + 1 < num_instrs; ++inst_idx) {
+        int opcode = _Py_OPCODE(instrs[inst_idx]);
+        if (opcode != LOAD_ATTR && opcode != LOAD_METHOD)
+            continue;
+        unsigned char co_opt_offset = opcache->oc_opcache_map[inst_idx + 1];
+        if (co_opt_offset == 0)
+            continue;
+        _PyOpcache* co_opcache = &opcache->oc_opcache[co_opt_offset - 1];
+        _PyOpcache_LoadAttr *la = &co_opcache->u.la;
+
+        const char* kind = "monomorphic";
+        long entries = 1;
+        unsigned long misses = co_opcache->num_failed; // misses since the last hit
+        if (!co_opcache->optimized) {
+            kind = "unused";
+            entries = 0;
+        } else if (la->cache_type == LA_CACHE_POLYMORPHIC) {
+            kind = "polymorphic";
+            entries = la->u.poly_cache.num_used;
+            misses = la->u.poly_cache.num_misses;
+        } else if (la->cache_type == LA_CACHE_MEGAMORPHIC) {
+            kind = "megamorphic";
+            entries = -1;
+            misses = la->u.megamorphic_cache.num_misses;
+        }
+
+        PyObject* site = Py_BuildValue("{s:i,s:s,s:s,s:l,s:k}",
+                                       "offset", inst_idx * (int)sizeof(_Py_CODEUNIT),
+                                       "opname", opcode == LOAD_ATTR ? "LOAD_ATTR" : "LOAD_METHOD",
+                                       "kind", kind, "entries", entries, "misses", misses);
+        if (!site || PyList_Append(list, site) < 0) {
+            Py_XDECREF(site);
+            Py_DECREF(list);
+            return NULL;
+        }
+        Py_DECREF(site);
+    }
+    return list;
+}
+
+static PyObject *
+jit_module_enable_opcode_stats(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"types", NULL};
+    int types = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|p:enable_opcode_stats", kwlist, &types))
+        return NULL;
+    if (opcode_stats_enable(types) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+jit_module_disable_opcode_stats(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    opcode_stats_disable();
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+jit_module_reset_opcode_stats(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    opcode_stats_clear();
+    Py_RETURN_NONE;
+}
+
+static int opcode_stats_is_cache_site(int opcode) {
+    return opcode == LOAD_ATTR || opcode == LOAD_METHOD || opcode == STORE_ATTR || opcode == LOAD_GLOBAL;
+}
+
+static int opcode_stats_set_ull(PyObject* d, const char* name, unsigned long long value) {
+    PyObject* v = PyLong_FromUnsignedLongLong(value);
+    if (!v)
+        return -1;
+    int ret = PyDict_SetItemString(d, name, v);
+    Py_DECREF(v);
+    return ret;
+}
+
+// returns the dict describing a single instruction, see jit_module_opcode_stats
+static PyObject* opcode_stats_instr_dict(OpcodeStats* stats, int inst_idx, PyObject* opnames) {
+    _Py_CODEUNIT* instrs = (_Py_CODEUNIT*)PyBytes_AS_STRING(stats->code->co_code);
+    int opcode = _Py_OPCODE(instrs[inst_idx]);
+    unsigned long long count = stats->counts[inst_idx];
+
+    PyObject* d = Py_BuildValue("{s:O,s:K}", "opname", PyList_GET_ITEM(opnames, opcode), "count", count);
+    if (!d)
+        return NULL;
+
+    if (opcode_stats_is_cache_site(opcode)) {
+        unsigned long long events[OPCODE_STATS_NUM_CACHE_EVENTS] = { 0 };
+        if (stats->cache_events)
+            memcpy(events, stats->cache_events[inst_idx], sizeof(events));
+        // every execution which didn't take the slow path was a hit
+        unsigned long long not_hit = events[OPCODE_STATS_CACHE_MISS] + events[OPCODE_STATS_CACHE_UNOPTIMIZED]
+                                     + events[OPCODE_STATS_CACHE_NO_OPCACHE] + events[OPCODE_STATS_CACHE_UNCACHED];
+        if (opcode_stats_set_ull(d, "hits", count > not_hit ? count - not_hit : 0) < 0) {
+            Py_DECREF(d);
+            return NULL;
+        }
+        for (int i=0; i<OPCODE_STATS_NUM_CACHE_EVENTS; ++i) {
+            if (opcode_stats_set_ull(d, opcode_stats_cache_event_names[i], events[i]) < 0) {
+                Py_DECREF(d);
+                return NULL;
+            }
+        }
+    }
+
+    if (stats->types) {
+        PyObject* offset = PyLong_FromLong(inst_idx * sizeof(_Py_CODEUNIT));
+        if (!offset) {
+            Py_DECREF(d);
+            return NULL;
+        }
+        PyObject* hist = PyDict_GetItem(stats->types, offset);
+        Py_DECREF(offset);
+        if (hist) {
+            PyObject* copy = PyDict_Copy(hist);
+            if (!copy || PyDict_SetItemString(d, "types", copy) < 0) {
+                Py_XDECREF(copy);
+                Py_DECREF(d);
+                return NULL;
+            }
+            Py_DECREF(copy);
+        }
+    }
+    return d;
+}
+
+static PyObject *
+jit_module_opcode_stats(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject* opcode_module = PyImport_ImportModule("opcode");
+    if (!opcode_module)
+        return NULL;
+    PyObject* opnames = PyObject_GetAttrString(opcode_module, "opname");
+    Py_DECREF(opcode_module);
+    if (!opnames)
+        return NULL;
+    if (!PyList_Check(opnames) || PyList_GET_SIZE(opnames) != 256) {
+        PyErr_SetString(PyExc_RuntimeError, "unexpected opcode.opname");
+        Py_DECREF(opnames);
+        return NULL;
+    }
+
+    PyObject* result = PyDict_New();
+    if (!result)
+        goto error;
+
+    // the snapshot may allocate and run arbitrary code (e.g. a gc) which we don't want to count
+    int was_enabled = opcode_stats_enabled;
+    opcode_stats_enabled = 0;
+    for (long i=0; i<opcode_stats_table_size; ++i) {
+        OpcodeStats* stats = opcode_stats_table[i];
+        if (!stats)
+            continue;
+        PyObject* instrs = PyDict_New();
+        if (!instrs || PyDict_SetItem(result, (PyObject*)stats->code, instrs) < 0) {
+            Py_XDECREF(instrs);
+            goto error_reenable;
+        }
+        Py_DECREF(instrs);
+
+        for (int inst_idx=0; inst_idx<stats->num_instrs; ++inst_idx) {
+            if (stats->counts[inst_idx] == 0)
+                continue;
+            PyObject* d = opcode_stats_instr_dict(stats, inst_idx, opnames);
+            if (!d)
+                goto error_reenable;
+            PyObject* offset = PyLong_FromLong(inst_idx * sizeof(_Py_CODEUNIT));
+            if (!offset || PyDict_SetItem(instrs, offset, d) < 0) {
+                Py_XDECREF(offset);
+                Py_DECREF(d);
+                goto error_reenable;
+            }
+            Py_DECREF(offset);
+            Py_DECREF(d);
+        }
+    }
+    opcode_stats_enabled = was_enabled;
+    Py_DECREF(opnames);
+    return result;
+
+error_reenable:
+    opcode_stats_enabled = was_enabled;
+error:
+    Py_XDECREF(result);
+    Py_DECREF(opnames);
+    return NULL;
+}
+
+static PyMethodDef JitModuleMethods[] = {
+    {"stats", jit_module_stats, METH_NOARGS,
+     "Return a dict with the JIT statistic counters."},
+    {"get_config", jit_module_get_config, METH_NOARGS,
+     "Return a dict with the current JIT settings."},
+    {"set_config", (PyCFunction)(void(*)(void))jit_module_set_config, METH_VARARGS | METH_KEYWORDS,
+     "Change JIT settings (min_runs, opcache_min_runs, osr_min_runs, background, max_mem, use_aot, use_ics, show_stats, report, share_forked_code, evict_cold).\n"
+     "Settings only affect functions which get compiled afterwards."},
+    {"compile", jit_module_compile, METH_O,
+     "JIT compile the function or code object now. Returns True if it is compiled."},
+    {"blacklist", jit_module_blacklist, METH_O,
+     "Never JIT compile the function or code object, and stop entering already compiled code."},
+    {"is_compiled", jit_module_is_compiled, METH_O,
+     "Return True if the function or code object is JIT compiled."},
+    {"run_count", jit_module_run_count, METH_O,
+     "Return the warm-up counter of the function or code object which gets compared against min_runs."},
+    {"compile_report", (PyCFunction)(void(*)(void))jit_module_compile_report, METH_NOARGS,
+     "Return a list with a dict per function the JIT tried to compile (requires the report setting)."},
+    {"ic_sites", jit_module_ic_sites, METH_O,
+     "Return a list with the state of the LOAD_ATTR and LOAD_METHOD inline caches of the function or code object."},
+    {"enable_opcode_stats", (PyCFunction)(void(*)(void))jit_module_enable_opcode_stats, METH_VARARGS | METH_KEYWORDS,
+     "Start counting the executions of every instruction and the inline cache misses.\n"
+     "If types is true also record the types of the operands of arithmetic, compare, attribute and subscript operations.\n"
+     "While enabled all code runs in the interpreter."},
+    {"disable_opcode_stats", jit_module_disable_opcode_stats, METH_NOARGS,
+     "Stop counting instruction executions, the collected counts are kept."},
+    {"reset_opcode_stats", jit_module_reset_opcode_stats, METH_NOARGS,
+     "Throw away the collected instruction counts."},
+    {"opcode_stats", jit_module_opcode_stats, METH_NOARGS,
+     "Return a dict: code object -> {instruction offset -> dict with the opname, the execution count,\n"
+     "the cache hits and the reasons of the cache misses, and the operand types}."},
+    {NULL, NULL, 0, NULL}        /* Sentinel */
+};
+
+PyDoc_STRVAR(jit_module_doc,
+"Inspect and control the Pyston JIT at runtime.");
+
 #if OPCACHE_STATS
 static void showStats(const char* name, long hits, long misses, long uncached, long warmup) {
     long total = hits + misses + uncached + warmup;
@@ -9697,6 +10712,153 @@ static void showStats(const char* name, long hits, long misses, long uncached, l
 }
 #endif
 
+#ifndef PYSTON_LITE
+// used if JIT_AOT_TYPE_PROFILE is set:
+// the generated *Profile functions of the AOT code (see pyston/aot/aot_gen.py) record the
+// argument types of every call instead of patching the call site, and at exit we write
+// how often every type combination got used to the file.
+// aot_gen.py --type-profile=<file> generates specializations for the hot combinations.
+// Only the generic call sites executed by JIT compiled code get counted: the interpreter doesn't
+// call the *Profile functions and the JIT's inline fast paths (e.g. int + int) skip them.
+#define AOT_TYPE_PROFILE_MAX_ARGS 3
+typedef struct {
+    const char* func; // name of the unspecialized function, NULL marks an empty slot
+    PyTypeObject* types[AOT_TYPE_PROFILE_MAX_ARGS]; // owned reference
+    char* type_names;
+    unsigned long count;
+} AotTypeProfileEntry;
+int aot_type_profile_enabled = 0;
+static char* aot_type_profile_path = NULL;
+static AotTypeProfileEntry* aot_type_profile_entries = NULL;
+static long aot_type_profile_size = 0, aot_type_profile_num_entries = 0;
+
+static unsigned long aot_type_profile_hash(const char* func, PyTypeObject** types) {
+    unsigned long hash = (unsigned long)func;
+    for (int i=0; i<AOT_TYPE_PROFILE_MAX_ARGS; ++i)
+        hash = hash * 1000003 ^ ((unsigned long)types[i] >> 4);
+    return hash;
+}
+
+static AotTypeProfileEntry* aot_type_profile_lookup(AotTypeProfileEntry* entries, long size,
+                                                    const char* func, PyTypeObject** types) {
+    long mask = size - 1;
+    for (long i = aot_type_profile_hash(func, types) & mask;; i = (i + 1) & mask) {
+        AotTypeProfileEntry* entry = &entries[i];
+        if (entry->func == NULL)
+            return entry;
+        if (entry->func == func && memcmp(entry->types, types, sizeof(entry->types)) == 0)
+            return entry;
+    }
+}
+
+// returns a space separated list of the fully qualified type names
+static char* aot_type_profile_type_names(int nargs, PyTypeObject** types) {
+    PyObject *type, *value, *traceback;
+    PyErr_Fetch(&type, &value, &traceback);
+    PyObject* names = PyList_New(0);
+    PyObject* sep = PyUnicode_FromString(" ");
+    PyObject* joined = NULL;
+    char* ret = NULL;
+    if (!names || !sep)
+        goto done;
+    for (int i=0; i<nargs; ++i) {
+        PyObject* name;
+        if (!types[i]) {
+            name = PyUnicode_FromString("?");
+        } else if (types[i]->tp_flags & Py_TPFLAGS_HEAPTYPE) {
+            PyObject* module = PyDict_GetItemString(types[i]->tp_dict, "__module__");
+            PyObject* qualname = ((PyHeapTypeObject*)types[i])->ht_qualname;
+            if (module && PyUnicode_Check(module) && !_PyUnicode_EqualToASCIIString(module, "builtins"))
+                name = PyUnicode_FromFormat("%U.%U", module, qualname);
+            else
+                name = PyUnicode_FromFormat("%U", qualname);
+        } else {
+            // static types have the module in tp_name e.g. 'decimal.Decimal'
+            name = PyUnicode_FromString(types[i]->tp_name);
+        }
+        if (!name || PyList_Append(names, name) < 0) {
+            Py_XDECREF(name);
+            goto done;
+        }
+        Py_DECREF(name);
+    }
+    joined = PyUnicode_Join(sep, names);
+    if (joined) {
+        const char* joined_str = PyUnicode_AsUTF8(joined);
+        if (joined_str)
+            ret = strdup(joined_str);
+    }
+done:
+    Py_XDECREF(joined);
+    Py_XDECREF(sep);
+    Py_XDECREF(names);
+    PyErr_Clear();
+    PyErr_Restore(type, value, traceback);
+    return ret;
+}
+
+void aot_type_profile_record(const char* func, int nargs, PyObject** args) {
+    PyTypeObject* types[AOT_TYPE_PROFILE_MAX_ARGS] = { NULL };
+    if (nargs > AOT_TYPE_PROFILE_MAX_ARGS)
+        nargs = AOT_TYPE_PROFILE_MAX_ARGS;
+    for (int i=0; i<nargs; ++i)
+        types[i] = args[i] ? Py_TYPE(args[i]) : NULL;
+
+    if (aot_type_profile_entries) {
+        AotTypeProfileEntry* entry = aot_type_profile_lookup(aot_type_profile_entries, aot_type_profile_size, func, types);
+        if (entry->func) {
+            ++entry->count;
+            return;
+        }
+    }
+
+    // new type combination, make sure the table stays at most half full
+    if ((aot_type_profile_num_entries + 1) * 2 > aot_type_profile_size) {
+        long new_size = aot_type_profile_size ? aot_type_profile_size * 2 : 1024;
+        AotTypeProfileEntry* new_entries = calloc(new_size, sizeof(AotTypeProfileEntry));
+        if (!new_entries)
+            return;
+        for (long i=0; i<aot_type_profile_size; ++i) {
+            AotTypeProfileEntry* old_entry = &aot_type_profile_entries[i];
+            if (old_entry->func)
+                *aot_type_profile_lookup(new_entries, new_size, old_entry->func, old_entry->types) = *old_entry;
+        }
+        free(aot_type_profile_entries);
+        aot_type_profile_entries = new_entries;
+        aot_type_profile_size = new_size;
+    }
+
+    char* type_names = aot_type_profile_type_names(nargs, types);
+    if (!type_names)
+        return;
+    AotTypeProfileEntry* entry = aot_type_profile_lookup(aot_type_profile_entries, aot_type_profile_size, func, types);
+    entry->func = func;
+    for (int i=0; i<nargs; ++i) {
+        // keep the types alive so their address can't get reused by a different type
+        Py_XINCREF(types[i]);
+        entry->types[i] = types[i];
+    }
+    entry->type_names = type_names;
+    entry->count = 1;
+    ++aot_type_profile_num_entries;
+}
+
+// writes one line per type combination: <count> <unspecialized function> <type names...>
+static void aot_type_profile_write(const char* path) {
+    FILE* f = fopen(path, "w");
+    if (!f) {
+        fprintf(stderr, "aot: could not write type profile %s\n", path);
+        return;
+    }
+    for (long i=0; i<aot_type_profile_size; ++i) {
+        AotTypeProfileEntry* entry = &aot_type_profile_entries[i];
+        if (entry->func)
+            fprintf(f, "%lu %s %s\n", entry->count, entry->func, entry->type_names);
+    }
+    fclose(f);
+}
+#endif
+
 void aot_exit()
 {
 #if OPCACHE_STATS
@@ -9714,38 +10876,10 @@ void aot_exit()
     }
 #endif
 
-#if PROFILE_OPCODES
-    if (opcode_profile_enabled) {
-        // make sure we are not measuring this script
-        opcode_profile_enabled = 0;
-
-        const char* pycode =                                                        \
-            "DISPLAY_TOP_N_FUNCS = 5\n"                                             \
-            "DISPLAY_TOP_N_OPS = 10\n"                                              \
-            "profile = list(opcode_profile.items())\n"                              \
-            "profile.sort(key=lambda x: x[1]['num_func_called'], reverse=True)\n"   \
-            "num_displayed = 0\n"                                                   \
-            "for (name, d) in profile:\n"                                           \
-            "    if name.startswith('<frozen importlib._bootstrap'):\n"             \
-            "       continue\n"                                                     \
-            "    times_called = d['num_func_called']\n"                             \
-            "    del d['num_func_called']\n"                                        \
-            "    print(f'func {name} got {times_called} times called')\n"           \
-            "    op_profile = list(d.items())\n"                                    \
-            "    op_profile.sort(key=lambda x: x[1], reverse=True)\n"               \
-            "    for (op, num) in op_profile[:DISPLAY_TOP_N_OPS]:\n"                \
-            "        print(f'  {op:50} {num:>10}')\n"                               \
-            "    num_displayed += 1\n"                                              \
-            "    if num_displayed >= DISPLAY_TOP_N_FUNCS:\n"                        \
-            "        break";
-
-        PyObject* d = PyDict_New();
-        PyDict_SetItemString(d, "opcode_profile", opcode_profile_dict);
-        PyObject* ret = PyRun_String(pycode, Py_file_input, d, d);
-        Py_DECREF(d);
-        Py_DECREF(ret);
-        Py_DECREF(opcode_profile_dict);
-        opcode_profile_dict = NULL;
+#ifndef PYSTON_LITE
+    if (aot_type_profile_path) {
+        aot_type_profile_enabled = 0;
+        aot_type_profile_write(aot_type_profile_path);
     }
 #endif
 
@@ -9838,8 +10972,8 @@ PyObject* enable_pyston_lite(PyObject* _m) {
 
     jit_start();
 
-    // Unfortunately we currently don't release the jitted memory:
-    code_jitfunc_index = _PyEval_RequestCodeExtraIndex(NULL);
+    // the machine code gets released when the code object dies:
+    code_jitfunc_index = _PyEval_RequestCodeExtraIndex(jit_free_code);
 
     // Speed hack: rather than storing a pointer to an OpCache object in co_extra,
     // we store the entire struct. This mostly looks like storing the individual fields,
@@ -9864,9 +10998,6 @@ PyObject* enable_pyston_lite(PyObject* _m) {
 
     PyThreadState_Get()->interp->eval_frame = _PyEval_EvalFrame_AOT;
 
-#if PROFILE_OPCODES
-    opcode_profile_enabled = getenv("PRINT_OP_PROF") != NULL;
-#endif
     char* val = getenv("JIT_MIN_RUNS");
     if (val) {
         jit_min_runs = atoll(val);
@@ -9875,10 +11006,20 @@ PyObject* enable_pyston_lite(PyObject* _m) {
         if (jit_min_runs / 2 < opcache_min_runs)
             opcache_min_runs = jit_min_runs / 2;
     }
+    val = getenv("JIT_OSR_MIN_RUNS");
+    if (val) {
+        jit_osr_min_runs = atoll(val);
+        if (jit_osr_min_runs / 2 < opcache_min_runs)
+            opcache_min_runs = jit_osr_min_runs / 2;
+    }
     val = getenv("OPCACHE_MIN_RUNS");
     if (val) {
         opcache_min_runs = atoll(val);
     }
+    val = getenv("JIT_BACKGROUND");
+    if (val) {
+        jit_background = atoi(val);
+    }
 
     Py_RETURN_NONE;
 }
@@ -9889,6 +11030,34 @@ static PyMethodDef PystonLiteMethods[] = {
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
+static struct PyModuleDef pystonlitejitmodule = {
+    PyModuleDef_HEAD_INIT,
+    "pyston_lite.jit",
+    jit_module_doc,
+    -1,
+    JitModuleMethods
+};
+
+static struct PyModuleDef pystonjitmodule = {
+    PyModuleDef_HEAD_INIT,
+    "pyston.jit",
+    jit_module_doc,
+    -1,
+    JitModuleMethods
+};
+
+// makes the JIT module available as 'm.jit' and importable as '<module name>.jit'
+static int add_jit_submodule(PyObject* m, struct PyModuleDef* def) {
+    PyObject* jit_module = PyModule_Create(def);
+    if (!jit_module)
+        return -1;
+    if (PyDict_SetItemString(PyImport_GetModuleDict(), def->m_name, jit_module) < 0) {
+        Py_DECREF(jit_module);
+        return -1;
+    }
+    return PyModule_AddObject(m, "jit", jit_module);
+}
+
 static void common_setup() {
     // We want to get access to the static function slot_tp_getattr_hook
     // We can find it on any Python class that has a __getattr__ function, so I
@@ -9912,6 +11081,11 @@ PyMODINIT_FUNC PyInit_pyston_lite(void) {
     if (!m) return NULL;
     module_getattro_value = m->ob_type->tp_getattro;
 
+    if (add_jit_submodule(m, &pystonlitejitmodule) < 0) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
     common_setup();
 
     return m;
@@ -9931,6 +11105,11 @@ PyMODINIT_FUNC PyInit_pyston(void) {
     if (!m) return NULL;
     module_getattro_value = m->ob_type->tp_getattro;
 
+    if (add_jit_submodule(m, &pystonjitmodule) < 0) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
     common_setup();
 
     return m;
@@ -9951,6 +11130,21 @@ static struct PyModuleDef aot_cevalmodule = {
     aot_cevalMethods
 };
 
+static struct PyModuleDef pystonjitmodule = {
+    PyModuleDef_HEAD_INIT,
+    "_pyston_jit",
+    jit_module_doc,
+    -1,
+    JitModuleMethods
+};
+
+// exposed to python as pyston.jit
+PyMODINIT_FUNC
+PyInit__pyston_jit(void)
+{
+    return PyModule_Create(&pystonjitmodule);
+}
+
 PyMODINIT_FUNC
 PyInit_aot_ceval(void)
 {
@@ -9962,10 +11156,12 @@ PyInit_aot_ceval(void)
 
     jit_start();
 
+    char* profile_path = getenv("JIT_AOT_TYPE_PROFILE");
+    if (profile_path && *profile_path) {
+        aot_type_profile_path = profile_path;
+        aot_type_profile_enabled = 1;
+    }
 
-#if PROFILE_OPCODES
-    opcode_profile_enabled = getenv("PRINT_OP_PROF") != NULL;
-#endif
     char* val = getenv("JIT_MIN_RUNS");
     if (val) {
         jit_min_runs = atoll(val);
@@ -9974,10 +11170,20 @@ PyInit_aot_ceval(void)
         if (jit_min_runs / 2 < opcache_min_runs)
             opcache_min_runs = jit_min_runs / 2;
     }
+    val = getenv("JIT_OSR_MIN_RUNS");
+    if (val) {
+        jit_osr_min_runs = atoll(val);
+        if (jit_osr_min_runs / 2 < opcache_min_runs)
+            opcache_min_runs = jit_osr_min_runs / 2;
+    }
     val = getenv("OPCACHE_MIN_RUNS");
     if (val) {
         opcache_min_runs = atoll(val);
     }
+    val = getenv("JIT_BACKGROUND");
+    if (val) {
+        jit_background = atoi(val);
+    }
 
     return m;
 }
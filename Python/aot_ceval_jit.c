@@ -52,6 +52,7 @@
 //    - we support deoptimizations at the start of every bytecode which we could use
 //      to generate faster more specialiced code which makes some assumptions
 //    - get ride of frame->f_lasti updates
+//      (currently only skipped for opcodes which can't observe it, see emit_instr_start)
 //    - update/overwrite inline cache entries when they start to fail
 //
 
@@ -271,8 +272,58 @@ struct PerfMapEntry {
     long func_size;
 } *perf_map_funcs;
 
+// used if JIT_PERF_JITDUMP is enabled:
+// we stream a record for every compiled function into a file in the jitdump format of Linux perf.
+// 'perf record -k mono' + 'perf inject --jit' will use it to create an ELF object per function.
+// Specification: tools/perf/Documentation/jitdump-specification.txt in the Linux source tree.
+static FILE* jitdump_file = NULL;
+static void* jitdump_marker = NULL; // perf only finds the file if it got mmapped with PROT_EXEC
+static char* jitdump_dir = NULL;
+static int jitdump_pid = 0;
+static unsigned long jitdump_code_index = 0;
+
+// used if JIT_PROFILE_FILE is enabled
+static FILE* profile_file = NULL;
+// open addressing hash set of the code object hashes listed in the profile file, 0 marks an empty slot
+static unsigned long long* profile_hashes = NULL;
+static long profile_hashes_size = 0, profile_num_hashes = 0;
+static long profile_num_loaded = 0, jit_num_profile_hot = 0;
+// updated by the interpreter when a loop gets hot and execution switches over to the machine code (OSR)
+unsigned long __attribute__((visibility("hidden"))) jit_stat_osr_compiles, jit_stat_osr_entries;
+// updated by the interpreter when a suspended generator or coroutine frame continues executing
+unsigned long __attribute__((visibility("hidden"))) jit_stat_gen_resumes, jit_stat_gen_resumes_native;
+
+// used if JIT_REPORT_FILE or pyston.jit.set_config(report=1) is enabled:
+// one entry for every function we tried to compile.
+// The entries never get freed because the machine code increments the counters directly.
+// Recompiling a function (e.g. after it got evicted or a code object with the same hash
+// got created again) reuses its entry, so the counters and compile time add up.
+typedef struct JitReportEntry {
+    unsigned long long hash; // jit_profile_hash_code() of the code object, 0 if it has none
+    char* name;
+    char* filename;
+    int firstlineno;
+    int compiled;
+    long bytecode_size, code_size;
+    long compile_time_us;
+    unsigned long num_entries; // calls which started executing the machine code from the beginning
+    unsigned long num_osr_entries; // entries in the middle of the function (OSR and generator resumes)
+    unsigned long num_deopts;
+} JitReportEntry;
+static int jit_report_enabled = 0;
+static char* report_file_path = NULL;
+static JitReportEntry** report_entries = NULL;
+static long report_num_entries = 0;
+// open addressing hash table of the entries with a hash, size is a power of two
+static JitReportEntry** report_table = NULL;
+static long report_table_size = 0, report_table_num_entries = 0;
+
 static int jit_use_aot = 1, jit_use_ics = 1;
 
+// the builtin len() function, looked up on the first compilation.
+// Used to inline len(list) and len(tuple) calls.
+static PyObject* builtin_len = NULL;
+
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 8
 static PyObject* cmp_outcomePyCmp_BAD(PyObject *v, PyObject *w) {
   return cmp_outcome(NULL, PyCmp_BAD, v, w);
@@ -817,11 +868,65 @@ static int check_func_args_never_deleted(Jit* Dst) {
 }
 #endif
 
+// Every block of emitted machine code is prefixed with this header.
+// It lets us find the size of the allocation when the code object dies and
+// we want to give the memory back.
+typedef struct JitCodeHeader {
+    size_t size; // size of the whole allocation including this header
+    PyCodeObject* co; // borrowed, the code object this machine code belongs to
+    // list of all live machine code blocks, used to find the functions to evict when we run out of memory
+    struct JitCodeHeader *prev, *next;
+    long last_run_count; // run count of 'co' when it got compiled or survived the last eviction
+    long padding;
+} JitCodeHeader;
+_Static_assert(sizeof(JitCodeHeader) % 16 == 0, "code must stay 16 byte aligned");
+
+// Freed blocks of JIT memory, stored inside the freed memory itself.
+// The list is sorted by address so that we can merge adjacent blocks.
+typedef struct JitFreeBlock {
+    size_t size;
+    struct JitFreeBlock* next;
+} JitFreeBlock;
+
 static int8_t* mem_chunk = NULL;
 static size_t mem_chunk_bytes_remaining = 0;
 static long mem_bytes_allocated = 0, mem_bytes_used = 0;
 static long mem_bytes_used_max = 100*1000*1000; // will stop emitting code after that many bytes
-static int jit_num_funcs = 0, jit_num_failed = 0;
+static JitFreeBlock* mem_free_list = NULL;
+static long mem_bytes_freed = 0, mem_bytes_reused = 0;
+// With share_forked_code enabled a forked child never writes to the JIT memory it inherited,
+// so the pages with the machine code compiled before the fork stay shared between all processes.
+// Otherwise the child would emit new code into the rest of the inherited chunk and into freed blocks
+// and the kernel has to copy every page it touches.
+// Only the code compiled before the fork gets shared: functions compiled after it get compiled
+// privately by every process. There is no cross-process code cache because the emitted code
+// embeds absolute addresses of objects which live at different addresses in every worker.
+static int mem_share_forked_code = 0;
+static pid_t mem_owner_pid = 0; // process which allocated the chunks in mem_own_chunks
+typedef struct {
+    int8_t* start;
+    size_t size;
+} JitMemChunk;
+static JitMemChunk* mem_own_chunks = NULL;
+static int mem_num_own_chunks = 0;
+static long mem_bytes_inherited = 0;
+
+// With evict_cold enabled the machine code keeps counting the entries of the function and once
+// max_mem is reached the least used functions get evicted to make room instead of not compiling anymore.
+static int mem_evict_cold = 0;
+static JitCodeHeader* mem_code_list = NULL;
+static int jit_num_funcs_evicted = 0;
+void jit_evict_code(PyCodeObject* co);
+
+// Machine code of blacklisted functions which could not be freed right away because
+// a frame of the function was executing it. Gets freed once no such frame is left.
+typedef struct {
+    PyCodeObject* co; // not a reference, only compared against the code objects on the stack
+    void* code;
+} JitRetiredCode;
+static JitRetiredCode* jit_retired_code = NULL;
+static int jit_num_retired_code = 0, jit_max_retired_code = 0;
+static int jit_num_funcs = 0, jit_num_failed = 0, jit_num_funcs_freed = 0;
 static long total_compilation_time_in_us = 0;
 
 static int jit_stats_enabled = 0;
@@ -833,8 +938,11 @@ static unsigned long jit_stat_call_method_hit, jit_stat_call_method_miss, jit_st
 static unsigned long jit_stat_getitemlong, jit_stat_getitemlong_inlined, jit_stat_setitemlong_inlined;
 static unsigned long jit_stat_load_attr_poly, jit_stat_load_attr_poly_entries;
 static unsigned long jit_stat_load_method_poly, jit_stat_load_method_poly_entries;
+static unsigned long jit_stat_load_attr_megamorphic, jit_stat_load_method_megamorphic;
 static unsigned long jit_stat_binary_op_inplace, jit_stat_binary_op_inplace_miss, jit_stat_binary_op_inplace_hit;
 static unsigned long jit_stat_concat_inplace, jit_stat_concat_inplace_miss, jit_stat_concat_inplace_hit;
+static unsigned long jit_stat_binary_op_unboxed, jit_stat_binary_op_unboxed_miss, jit_stat_binary_op_unboxed_hit;
+static unsigned long jit_stat_getitem_index_inlined, jit_stat_len_inlined;
 
 #define ENABLE_DEFERRED_RES_PUSH 1
 #define ENABLE_AVOID_SIG_TRACE_CHECK 1
@@ -1006,6 +1114,16 @@ static void switch_section(Jit* Dst, Section new_section) {
 @X86| jbe dst
 |.endmacro
 
+|.macro branch_gt_unsigned, dst
+@ARM| bhi dst
+@X86| ja dst
+|.endmacro
+
+|.macro branch_ge_unsigned, dst
+@ARM| bhs dst
+@X86| jae dst
+|.endmacro
+
 // compares r_object_idx->ob_type with type
 // branches to false_branch on inequality else continues
 |.macro type_check, r_object_idx, type, false_branch
@@ -2442,6 +2560,25 @@ static _PyOpcache* get_opcache_entry(Jit* Dst, int inst_idx) {
     return co_opcache;
 }
 
+#ifndef PYSTON_LITE
+// emits: $r_dst = value of the int object in $r_obj
+// branches to label 1 if the int has more than a single digit.
+// The object type must already have been checked.
+// Only supported in the full build because Pyston makes sure that every int has at least one digit allocated
+// (ob_digit[0] is read even for 0 which gets multiplied by ob_size == 0).
+static void emit_load_single_digit_long(Jit* Dst, int r_dst, int r_obj, int r_scratch) {
+    _Static_assert(sizeof(digit) == 4, "adjust load");
+    emit_load64_mem(Dst, r_dst, r_obj, offsetof(PyVarObject, ob_size));
+    // ob_size must be -1, 0 or 1
+    emit_add_or_sub_imm(Dst, r_scratch, r_dst, 1);
+    emit_cmp64_imm(Dst, r_scratch, 2);
+    | branch_gt_unsigned >1
+    emit_load32_mem(Dst, r_scratch, r_obj, offsetof(PyLongObject, ob_digit));
+@ARM| mul Rx(r_dst), Rx(r_dst), Rx(r_scratch)
+@X86| imul Rq(r_dst), Rq(r_scratch)
+}
+#endif
+
 // returns 0 if generation succeeded
 static int emit_special_binary_subscr(Jit* Dst, int inst_idx, PyObject* const_val, RefStatus ref_status[2]) {
     if (!const_val || !PyLong_CheckExact(const_val)) {
@@ -2501,6 +2638,57 @@ static int emit_special_binary_subscr(Jit* Dst, int inst_idx, PyObject* const_va
     return 0;
 }
 
+// special path for indexing a list or tuple with a non constant int, e.g. 'l[i]' inside a loop.
+// returns 0 if generation succeeded
+static int emit_special_binary_subscr_index(Jit* Dst, int inst_idx, int oparg, RefStatus ref_status[2]) {
+#ifdef PYSTON_LITE
+    // emit_load_single_digit_long is not available
+    return -1;
+#else
+    if (ref_status[0] == OWNED /* this is the index object */) {
+        return -1;
+    }
+
+    _PyOpcache* co_opcache = get_opcache_entry(Dst, inst_idx);
+    PyTypeObject* cached_type = co_opcache ? co_opcache->u.t.type : NULL;
+    if (cached_type != &PyList_Type && cached_type != &PyTuple_Type) {
+        return -1;
+    }
+
+    | type_check arg1_idx, cached_type, >1
+    | type_check arg2_idx, &PyLong_Type, >1
+    emit_load_single_digit_long(Dst, arg4_idx, arg2_idx, arg5_idx);
+    // negative indices and indices out of range take the slow path
+    emit_load64_mem(Dst, arg5_idx, arg1_idx, offsetof(PyVarObject, ob_size));
+@ARM| cmp Rx(arg4_idx), Rx(arg5_idx)
+@X86| cmp Rq(arg4_idx), Rq(arg5_idx)
+    | branch_ge_unsigned >1
+    if (cached_type == &PyList_Type) {
+        emit_load64_mem(Dst, arg5_idx, arg1_idx, offsetof(PyListObject, ob_item));
+    } else {
+        emit_add_or_sub_imm(Dst, arg5_idx, arg1_idx, offsetof(PyTupleObject, ob_item));
+    }
+@ARM| ldr Rx(res_idx), [Rx(arg5_idx), Rx(arg4_idx), lsl #3]
+@X86| mov res, [Rq(arg5_idx)+Rq(arg4_idx)*8]
+    emit_incref(Dst, res_idx);
+    if (ref_status[1] == OWNED /* check if the container is owned */) {
+        emit_decref(Dst, arg1_idx, 1 /* preserve res */);
+    }
+    ++jit_stat_getitem_index_inlined;
+
+    switch_section(Dst, SECTION_COLD);
+    |1:
+    void* func = get_aot_func_addr(Dst, BINARY_SUBSCR, oparg, 0 /*= no op cache */);
+    emit_call_decref_args2(Dst, func, arg2_idx, arg1_idx, ref_status);
+    emit_if_res_0_error(Dst);
+    | branch >2
+    switch_section(Dst, SECTION_CODE);
+    |2:
+    deferred_vs_push(Dst, REGISTER, res_idx);
+    return 0;
+#endif
+}
+
 // returns 0 if generation succeeded
 static int emit_special_store_subscr(Jit* Dst, int inst_idx, int opcode, int oparg, PyObject* const_val, RefStatus ref_status[3]) {
     if (!const_val || !PyLong_CheckExact(const_val)) {
@@ -2580,6 +2768,23 @@ static int emit_special_compare_op(Jit* Dst, int oparg, RefStatus ref_status[2])
     return 0;
 }
 
+// heuristic which returns 1 if the CALL_FUNCTION at inst_idx looks like it's calling the global 'len'.
+// The emitted code still has to check that the callable is actually builtin_len.
+static int is_len_call(Jit* Dst, int inst_idx) {
+    // 'len(x)' compiles to LOAD_GLOBAL len, <expression to compute x>, CALL_FUNCTION 1
+    // we only look at a few instructions because the argument is usually a single load.
+    for (int i = inst_idx - 2; i >= 0 && i >= inst_idx - 4; --i) {
+        _Py_CODEUNIT word = Dst->first_instr[i];
+        if (_Py_OPCODE(word) != LOAD_GLOBAL)
+            continue;
+        int oparg = _Py_OPARG(word);
+        if (oparg >= PyTuple_GET_SIZE(Dst->co_names))
+            return 0;
+        return _PyUnicode_EqualToASCIIString(PyTuple_GET_ITEM(Dst->co_names, oparg), "len");
+    }
+    return 0;
+}
+
 static int emit_inline_cache_loadattr_is_version_zero(_PyOpcache_LoadAttr *la) {
     int version_zero = (la->cache_type == LA_CACHE_VALUE_CACHE_DICT && la->u.value_cache.dict_ver == 0);
 
@@ -2603,6 +2808,10 @@ static int emit_inline_cache_loadattr_supported(_PyOpcache *co_opcache, _PyOpcac
     if (!co_opcache->optimized)
         return 0;
 
+    // the entries live in a global cache which can change at any time, the helper function handles it
+    if (la->cache_type == LA_CACHE_MEGAMORPHIC)
+        return 0;
+
     int version_zero = emit_inline_cache_loadattr_is_version_zero(la);
     if (la->cache_type != LA_CACHE_BUILTIN && la->cache_type != LA_CACHE_DATA_DESCR && la->cache_type != LA_CACHE_SLOT_CACHE) {
         // fail the cache if dictoffset<0 rather than do the lengthier dict_ptr computation
@@ -2958,6 +3167,130 @@ static int emit_special_binary_op_inplace(Jit* Dst, int inst_idx, int opcode, in
     return 0;
 }
 
+// special code for float and int math functions which does the computation unboxed
+// and only allocates the result object.
+// Uses the operand types the interpreter recorded in the opcache, guards that they still match
+// and falls back to the generic implementation if they don't.
+// returns 0 if generation succeeded
+static int emit_special_binary_op_unboxed(Jit* Dst, int inst_idx, int opcode, int oparg, RefStatus ref_status_left, RefStatus ref_status_right, PyObject* const_right_val) {
+    switch (opcode) {
+        case BINARY_ADD:
+        case BINARY_SUBTRACT:
+        case BINARY_MULTIPLY:
+
+        case INPLACE_ADD:
+        case INPLACE_SUBTRACT:
+        case INPLACE_MULTIPLY:
+            break;
+
+        default:
+            return -1;
+    }
+    _PyOpcache* opcache = get_opcache_entry(Dst, inst_idx);
+    if (!opcache || !opcache->optimized) {
+        return -1;
+    }
+    PyTypeObject* type = opcache->u.t_refcnt.type;
+#ifdef PYSTON_LITE
+    if (type != &PyFloat_Type) {
+        return -1;
+    }
+#else
+    if (type != &PyFloat_Type && type != &PyLong_Type) {
+        return -1;
+    }
+    // the int path computes the value in arg1 which means we have only a single
+    // free preserved register for an owned operand
+    if (type == &PyLong_Type && ref_status_left == OWNED && ref_status_right == OWNED) {
+        return -1;
+    }
+#endif
+
+    ++jit_stat_binary_op_unboxed;
+
+    | type_check arg1_idx, type, >1
+    if (!const_right_val || Py_TYPE(const_right_val) != type) {
+        | type_check arg2_idx, type, >1
+    }
+
+    RefStatus ref_status[] = { ref_status_right, ref_status_left };
+    if (type == &PyFloat_Type) {
+        const int offset_fval = offsetof(PyFloatObject, ob_fval);
+@ARM    | ldr d0, [arg1, #offset_fval]
+@ARM    | ldr d1, [arg2, #offset_fval]
+@X86    | movsd xmm0, qword [arg1+offset_fval]
+        if (opcode == BINARY_ADD || opcode == INPLACE_ADD) {
+@ARM        | fadd d0, d0, d1
+@X86        | addsd xmm0, qword [arg2+offset_fval]
+        } else if (opcode == BINARY_SUBTRACT || opcode == INPLACE_SUBTRACT) {
+@ARM        | fsub d0, d0, d1
+@X86        | subsd xmm0, qword [arg2+offset_fval]
+        } else if (opcode == BINARY_MULTIPLY || opcode == INPLACE_MULTIPLY) {
+@ARM        | fmul d0, d0, d1
+@X86        | mulsd xmm0, qword [arg2+offset_fval]
+        } else {
+            JIT_ASSERT(0, "");
+        }
+        // the double argument is passed in d0/xmm0 which the call setup does not touch
+        emit_call_decref_args2(Dst, PyFloat_FromDouble, arg2_idx, arg1_idx, ref_status);
+    }
+#ifndef PYSTON_LITE
+    else if (type == &PyLong_Type) {
+        // single digit ints can't overflow a 64bit register when added, subtracted or multiplied
+        emit_load_single_digit_long(Dst, arg3_idx, arg1_idx, arg5_idx);
+        emit_load_single_digit_long(Dst, arg4_idx, arg2_idx, arg5_idx);
+        if (opcode == BINARY_ADD || opcode == INPLACE_ADD) {
+@ARM        | add Rx(arg3_idx), Rx(arg3_idx), Rx(arg4_idx)
+@X86        | add Rq(arg3_idx), Rq(arg4_idx)
+        } else if (opcode == BINARY_SUBTRACT || opcode == INPLACE_SUBTRACT) {
+@ARM        | sub Rx(arg3_idx), Rx(arg3_idx), Rx(arg4_idx)
+@X86        | sub Rq(arg3_idx), Rq(arg4_idx)
+        } else if (opcode == BINARY_MULTIPLY || opcode == INPLACE_MULTIPLY) {
+@ARM        | mul Rx(arg3_idx), Rx(arg3_idx), Rx(arg4_idx)
+@X86        | imul Rq(arg3_idx), Rq(arg4_idx)
+        } else {
+            JIT_ASSERT(0, "");
+        }
+        int owned = 0;
+        if (ref_status_left == OWNED) {
+            | mov tmp_preserved_reg, arg1
+            owned = 1;
+        } else if (ref_status_right == OWNED) {
+            | mov tmp_preserved_reg, arg2
+            owned = 1;
+        }
+        | mov arg1, arg3
+        emit_call_ext_func(Dst, PyLong_FromLong);
+        if (owned) {
+            | mov arg1, tmp_preserved_reg
+            emit_decref(Dst, arg1_idx, 1 /* preserve res */);
+        }
+    }
+#endif
+    emit_if_res_0_error(Dst);
+    if (jit_stats_enabled) {
+        emit_inc_qword_ptr(Dst, &jit_stat_binary_op_unboxed_hit, 0 /*=can't use tmp_reg*/);
+    }
+
+    // slowpath
+    {
+        switch_section(Dst, SECTION_COLD);
+        |1:
+        void* func = get_aot_func_addr(Dst, opcode, oparg, 0 /*= no op cache */);
+        emit_call_decref_args2(Dst, func, arg2_idx, arg1_idx, ref_status);
+        emit_if_res_0_error(Dst);
+        if (jit_stats_enabled) {
+            emit_inc_qword_ptr(Dst, &jit_stat_binary_op_unboxed_miss, 0 /*=can't use tmp_reg*/);
+        }
+        | branch >2
+        switch_section(Dst, SECTION_CODE);
+    }
+    |2:
+
+    deferred_vs_push(Dst, REGISTER, res_idx);
+    return 0;
+}
+
 // Same signature as PyUnicode_Append
 // except that it only handles the case where pleft refcnt = 1
 static void list_append(PyObject **pleft, PyObject *right) {
@@ -3202,6 +3535,12 @@ static int emit_inline_cache(Jit* Dst, int opcode, int oparg, _PyOpcache* co_opc
             ++jit_stat_load_method_total;
 
         _PyOpcache_LoadAttr *la = &co_opcache->u.la;
+        if (co_opcache->optimized && la->cache_type == LA_CACHE_MEGAMORPHIC) {
+            if (opcode == LOAD_ATTR)
+                ++jit_stat_load_attr_megamorphic;
+            else
+                ++jit_stat_load_method_megamorphic;
+        }
         if (co_opcache->num_failed == 0 && emit_inline_cache_loadattr_supported(co_opcache, la)) {
             if (opcode == LOAD_ATTR)
                 ++jit_stat_load_attr_inline;
@@ -3517,6 +3856,18 @@ static void emit_instr_start(Jit* Dst, int inst_idx, int opcode, int oparg) {
             if (Dst->known_defined[oparg])
                 return; // don't do a sig check if we know the load can't throw
 #endif
+            // The only way this opcode can observe f_lasti is the unbound local error
+            // which updates f_lasti itself. So we don't need the check and f_lasti update
+            // if we already generated a check for the current line.
+            // Jump targets always get a check because of the line tracing logic.
+            if (Dst->emitted_trace_check_for_line && !Dst->is_jmp_target[inst_idx])
+                return;
+            break;
+
+        case JUMP_FORWARD:
+            // can't throw and does not call anything
+            if (Dst->emitted_trace_check_for_line && !Dst->is_jmp_target[inst_idx])
+                return;
             break;
 
         case STORE_FAST:
@@ -3666,62 +4017,877 @@ static void emit_instr_start(Jit* Dst, int inst_idx, int opcode, int oparg) {
     Dst->emitted_trace_check_for_line = 1;
 }
 
-|.globals lbl_
-|.actionlist bf_actions
+// adds the memory block to the sorted free list and merges it with its neighbours
+static void jit_mem_add_free_block(void* addr, size_t size) {
+    JitFreeBlock* block = (JitFreeBlock*)addr;
+    JitFreeBlock** prev_next = &mem_free_list;
+    JitFreeBlock* prev = NULL;
+    while (*prev_next && *prev_next < block) {
+        prev = *prev_next;
+        prev_next = &prev->next;
+    }
 
-#if JIT_DEBUG
-__attribute__((optimize("-O0"))) // enable to make "source tools/dis_jit_gdb.py" work
-#endif
-#ifdef PYSTON_LITE
-void* jit_func_lite(PyCodeObject* co, PyThreadState* tstate) {
-#else
-void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
-#endif
-    if (mem_bytes_used_max <= mem_bytes_used) // stop emitting code we used up all memory
-        return NULL;
+    JIT_MEM_RW();
+    block->size = size;
+    block->next = *prev_next;
+    *prev_next = block;
 
-    int success = 0;
+    // merge with the following block
+    if (block->next && (char*)block + block->size == (char*)block->next) {
+        block->size += block->next->size;
+        block->next = block->next->next;
+    }
+    // merge with the preceding block
+    if (prev && (char*)prev + prev->size == (char*)block) {
+        prev->size += block->size;
+        prev->next = block->next;
+    }
+    JIT_MEM_RX();
+}
 
-    struct timespec compilation_start;
-    if (jit_stats_enabled)
-        clock_gettime(CLOCK_MONOTONIC, &compilation_start);
+// tries to satisfy the allocation from previously freed JIT code (first fit)
+// returns the size of the block handed out (which may be larger than requested) via 'size'
+static void* jit_mem_alloc_from_free_list(size_t* size) {
+    for (JitFreeBlock** prev_next = &mem_free_list; *prev_next; prev_next = &(*prev_next)->next) {
+        JitFreeBlock* block = *prev_next;
+        if (block->size < *size)
+            continue;
 
-    // setup jit context, will get accessed from all dynasm functions via the name 'Dst'
-    Jit jit;
-    memset(&jit, 0, sizeof(jit));
-    jit.co = co;
-    jit.co_consts = co->co_consts;
-    jit.co_names = co->co_names;
-    jit.current_section = -1;
+        JIT_MEM_RW();
+        // only split the block if the remaining part is large enough to be useful
+        if (block->size - *size >= 256) {
+            JitFreeBlock* rest = (JitFreeBlock*)((char*)block + *size);
+            rest->size = block->size - *size;
+            rest->next = block->next;
+            *prev_next = rest;
+        } else {
+            *size = block->size;
+            *prev_next = block->next;
+        }
+        JIT_MEM_RX();
+        return block;
+    }
+    return NULL;
+}
 
-    jit.opcache = _PyCode_GetOpcache(co);
+// returns the size of the block handed out (which may be larger than requested) via 'size'
+static void* jit_mem_alloc_from_chunk(size_t* size) {
+    // Allocate jitted code regions in 256KB chunks:
+    if (*size > mem_chunk_bytes_remaining) {
+        // don't waste the end of the current chunk
+        if (mem_chunk_bytes_remaining >= 256)
+            jit_mem_add_free_block(mem_chunk, mem_chunk_bytes_remaining);
 
-    jit.num_opcodes = PyBytes_Size(co->co_code)/sizeof(_Py_CODEUNIT);
-    jit.first_instr = (_Py_CODEUNIT *)PyBytes_AS_STRING(co->co_code);
+        mem_chunk_bytes_remaining = *size > (1<<18) ? *size : (1<<18);
 
-    Jit* Dst = &jit;
-    dasm_init(Dst, DASM_MAXSECTION);
-    void* labels[lbl__MAX];
-    dasm_setupglobal(Dst, labels, lbl__MAX);
+#ifdef __amd64__
+        int map_flags = 0;
+#if __linux__
+        // allocate memory which address fits inside a 32bit pointer (makes sure we can use 32bit rip relative addressing which results in smaller instructions)
+        map_flags |= MAP_32BIT;
+#elif __APPLE__
+        map_flags |= MAP_JIT;
+#endif
+        void* new_chunk = mmap(0, mem_chunk_bytes_remaining,
+                               PROT_READ | PROT_WRITE | PROT_EXEC,
+                               MAP_PRIVATE | MAP_ANONYMOUS | map_flags, -1, 0);
+        int failed = new_chunk == MAP_FAILED;
+#elif __aarch64__
+        int map_flags = 0;
+#if __linux__
+        // MAP_FIXED_NOREPLACE is available from linux 4.17, but older glibc don't define it.
+        // Older kernel will ignore this flag and will try to allocate the address supplied as hint
+        // but if not possible will just return a different address.
+#ifndef MAP_FIXED_NOREPLACE
+#define MAP_FIXED_NOREPLACE 0x100000
+#endif
+        map_flags |= MAP_FIXED_NOREPLACE;
+#elif __APPLE__
+        map_flags |= MAP_JIT;
+#endif
+        // we try to allocate a memory block close to our AOT functions, because on ARM64 the relative call insruction 'bl'
+        // can only address +-128MB from current IP. And this allows us to use bl for most calls.
+        void* new_chunk = MAP_FAILED;
+        // try allocate memory 25MB after this AOT func.
+        char* start_addr = (char*)(((uint64_t)LAYOUT_TARGET + 25*1024*1024 + 4095) / 4096 * 4096);
+        for (int i=0; i<8 && new_chunk == MAP_FAILED; ++i, start_addr += 5*1024*1024) {
+            // If the returned adddress does not fix in 32bit we abort the JIT compilation.
+            new_chunk = mmap(start_addr + mem_bytes_allocated, mem_chunk_bytes_remaining,
+                             PROT_READ | PROT_WRITE | PROT_EXEC,
+                             MAP_PRIVATE | MAP_ANONYMOUS | map_flags, -1, 0);
+        }
+        int failed = new_chunk == MAP_FAILED || !can_use_relative_call(new_chunk);
+#else
+#error "unknown arch"
+#endif
+        if (failed) {
+#if JIT_DEBUG
+            JIT_ASSERT(0, "mmap() returned error %d", errno);
+#endif
+            if (new_chunk != MAP_FAILED)
+                munmap(new_chunk, mem_chunk_bytes_remaining);
+            mem_chunk_bytes_remaining = 0;
+            return NULL;
+        }
+        JitMemChunk* new_own_chunks = realloc(mem_own_chunks, (mem_num_own_chunks + 1) * sizeof(JitMemChunk));
+        if (!new_own_chunks) {
+            munmap(new_chunk, mem_chunk_bytes_remaining);
+            mem_chunk_bytes_remaining = 0;
+            return NULL;
+        }
+        mem_own_chunks = new_own_chunks;
+        mem_own_chunks[mem_num_own_chunks].start = new_chunk;
+        mem_own_chunks[mem_num_own_chunks].size = mem_chunk_bytes_remaining;
+        ++mem_num_own_chunks;
+        mem_owner_pid = getpid();
 
-    dasm_setup(Dst, bf_actions);
+        mem_chunk = new_chunk;
+        mem_bytes_allocated += (mem_chunk_bytes_remaining + 4095) / 4096 * 4096;
+    }
 
-    // allocate enough space for emitting a dynamic label for the start of every bytecode
-    dasm_growpc(Dst, Dst->num_opcodes + 1);
+    // hand out the tail of the chunk too if it would be too small to be useful
+    if (mem_chunk_bytes_remaining - *size < 256)
+        *size = mem_chunk_bytes_remaining;
 
-    // we emit the opcode implementations first and afterwards the entry point of the function because
-    // we don't know how much stack it will use etc..
-    switch_section(Dst, SECTION_CODE);
+    void* mem = mem_chunk;
+    mem_chunk += *size;
+    mem_chunk_bytes_remaining -= *size;
+    return mem;
+}
 
-    jit.is_jmp_target = calculate_jmp_targets(Dst);
+// If we got forked and share_forked_code is enabled forget about all memory of the parent,
+// new code will only get emitted into fresh chunks.
+static void jit_mem_check_forked(void) {
+    if (!mem_share_forked_code || mem_owner_pid == 0 || mem_owner_pid == getpid())
+        return;
 
-#if ENABLE_DEFINED_TRACKING
-    jit.known_defined = (char*)malloc(co->co_nlocals);
-    const int funcs_args_are_always_defined = check_func_args_never_deleted(Dst);
-#endif
+    mem_bytes_inherited = mem_bytes_used; // all live code belongs to the parent now
+    mem_chunk = NULL;
+    mem_chunk_bytes_remaining = 0;
+    mem_free_list = NULL;
+    mem_num_own_chunks = 0;
+    mem_code_list = NULL; // inherited code can't be evicted because freeing it would not give us memory
+    mem_owner_pid = getpid();
+}
 
-    // did we emit the * label already?
-#if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION == 8
+static int jit_mem_is_own(void* p) {
+    for (int i=0; i<mem_num_own_chunks; ++i) {
+        if ((int8_t*)p >= mem_own_chunks[i].start && (int8_t*)p < mem_own_chunks[i].start + mem_own_chunks[i].size)
+            return 1;
+    }
+    return 0;
+}
+
+// Allocates executable memory for 'code_size' bytes of machine code belonging to 'co'.
+// Returns a 16 byte aligned pointer to the code area or NULL on failure.
+static void* jit_mem_alloc(PyCodeObject* co, size_t code_size) {
+    size_t size = sizeof(JitCodeHeader) + code_size;
+
+    jit_mem_check_forked();
+    JitCodeHeader* header = jit_mem_alloc_from_free_list(&size);
+    if (header) {
+        mem_bytes_reused += size;
+    } else {
+        header = jit_mem_alloc_from_chunk(&size);
+        if (!header)
+            return NULL;
+    }
+    mem_bytes_used += size;
+
+    JIT_MEM_RW();
+    header->size = size;
+    header->co = co;
+    header->prev = NULL;
+    header->next = mem_code_list;
+    if (mem_code_list)
+        mem_code_list->prev = header;
+    header->last_run_count = _PyCode_GetOpcache(co)->oc_opcache_flag;
+    JIT_MEM_RX();
+    mem_code_list = header;
+    return header + 1;
+}
+
+// Removes the machine code from mem_code_list so that it won't get evicted.
+// Code inherited from the parent process with share_forked_code enabled is not in the list.
+static void jit_mem_unlink(JitCodeHeader* header) {
+    if (header->co == NULL) // already unlinked
+        return;
+
+    JIT_MEM_RW();
+    if (header->prev)
+        header->prev->next = header->next;
+    else
+        mem_code_list = header->next;
+    if (header->next)
+        header->next->prev = header->prev;
+    header->prev = header->next = NULL;
+    header->co = NULL;
+    JIT_MEM_RX();
+}
+
+static void jit_mem_free(void* code) {
+    JitCodeHeader* header = ((JitCodeHeader*)code) - 1;
+    size_t size = header->size;
+
+    // has to happen first: it takes over mem_bytes_used as the inherited bytes
+    jit_mem_check_forked();
+    mem_bytes_used -= size;
+    if (mem_share_forked_code && !jit_mem_is_own(header)) {
+        // code of the parent process: writing the free list entry would unshare the page
+        mem_bytes_inherited -= size;
+        return;
+    }
+
+    jit_mem_unlink(header);
+    mem_bytes_freed += size;
+    jit_mem_add_free_block(header, size);
+}
+
+// Gets called when a code object which has machine code attached gets deallocated.
+// Handles the 'not compiled' and 'failed to compile' marker values too.
+#ifdef PYSTON_LITE
+void jit_free_code_lite(void* code) {
+#else
+void jit_free_code(void* code) {
+#endif
+    if (code == NULL || code == (void*)1 /* JIT_FUNC_FAILED */ || code == (void*)2 /* JIT_FUNC_QUEUED */)
+        return;
+
+    // in this mode we dump the emitted code at exit so we can't reuse the memory
+    if (perf_map_file)
+        return;
+
+    jit_mem_free(code);
+    ++jit_num_funcs_freed;
+}
+
+typedef struct {
+    JitCodeHeader* header;
+    long num_runs; // entries since the last eviction
+} JitEvictCandidate;
+
+static int jit_evict_candidate_cmp(const void* a, const void* b) {
+    long runs_a = ((const JitEvictCandidate*)a)->num_runs, runs_b = ((const JitEvictCandidate*)b)->num_runs;
+    return runs_a < runs_b ? -1 : runs_a > runs_b;
+}
+
+static int jit_ptr_cmp(const void* a, const void* b) {
+    uintptr_t ptr_a = *(const uintptr_t*)a, ptr_b = *(const uintptr_t*)b;
+    return ptr_a < ptr_b ? -1 : ptr_a > ptr_b;
+}
+
+// Returns a sorted array of the code objects which have a frame on the stack of any thread
+// (the same code object can be in it multiple times) or NULL if we ran out of memory.
+static PyCodeObject** jit_get_active_code(PyThreadState* tstate, int* num_active_out) {
+    int num_active = 0, max_active = 64;
+    PyCodeObject** active = malloc(max_active * sizeof(PyCodeObject*));
+    if (!active)
+        return NULL;
+    for (PyThreadState* ts = PyInterpreterState_ThreadHead(tstate->interp); ts; ts = PyThreadState_Next(ts)) {
+        for (PyFrameObject* f = ts->frame; f; f = f->f_back) {
+            if (num_active == max_active) {
+                max_active *= 2;
+                PyCodeObject** new_active = realloc(active, max_active * sizeof(PyCodeObject*));
+                if (!new_active) {
+                    free(active);
+                    return NULL;
+                }
+                active = new_active;
+            }
+            active[num_active++] = f->f_code;
+        }
+    }
+    qsort(active, num_active, sizeof(PyCodeObject*), jit_ptr_cmp);
+    *num_active_out = num_active;
+    return active;
+}
+
+// Frees the retired machine code which is not executing anymore.
+static void jit_free_retired_code(PyThreadState* tstate) {
+    int num_active = 0;
+    PyCodeObject** active = jit_get_active_code(tstate, &num_active);
+    if (!active)
+        return;
+
+    int num_left = 0;
+    for (int i=0; i<jit_num_retired_code; ++i) {
+        // if the code object died in the meantime its address can only match a new code object
+        // which just delays the freeing
+        if (bsearch(&jit_retired_code[i].co, active, num_active, sizeof(PyCodeObject*), jit_ptr_cmp))
+            jit_retired_code[num_left++] = jit_retired_code[i];
+        else
+            jit_free_code(jit_retired_code[i].code);
+    }
+    jit_num_retired_code = num_left;
+    free(active);
+}
+
+// Gets called when the machine code of 'co' got replaced by JIT_FUNC_FAILED (e.g. pyston.jit.blacklist()).
+// Frees the code right away if no frame of 'co' is executing it, otherwise as soon as possible.
+void __attribute__((visibility("hidden"))) jit_retire_code(PyCodeObject* co, void* code, PyThreadState* tstate) {
+    JitCodeHeader* header = ((JitCodeHeader*)code) - 1;
+    // it must not get evicted anymore because the header does not belong to 'co' anymore
+    jit_mem_check_forked();
+    if (!mem_share_forked_code || jit_mem_is_own(header))
+        jit_mem_unlink(header);
+
+    if (jit_num_retired_code == jit_max_retired_code) {
+        int new_max = jit_max_retired_code ? jit_max_retired_code * 2 : 16;
+        JitRetiredCode* new_retired = realloc(jit_retired_code, new_max * sizeof(JitRetiredCode));
+        if (!new_retired)
+            return; // leak the code, it's still safe
+        jit_retired_code = new_retired;
+        jit_max_retired_code = new_max;
+    }
+    jit_retired_code[jit_num_retired_code].co = co;
+    jit_retired_code[jit_num_retired_code].code = code;
+    ++jit_num_retired_code;
+    jit_free_retired_code(tstate);
+}
+
+// Frees the machine code of the functions which got entered the least since the last eviction
+// until we are back at 3/4 of max_mem. Functions executing on the stack of any thread are kept.
+// Returns the number of evicted functions.
+static int jit_mem_evict_cold(PyThreadState* tstate) {
+    // in this mode we can't reuse the memory
+    if (perf_map_file)
+        return 0;
+
+    // in a forked child the inherited code must not get evicted, it's shared with the parent
+    jit_mem_check_forked();
+
+    int num_candidates = 0;
+    for (JitCodeHeader* h = mem_code_list; h; h = h->next)
+        ++num_candidates;
+    if (num_candidates == 0)
+        return 0;
+    JitEvictCandidate* candidates = malloc(num_candidates * sizeof(JitEvictCandidate));
+    if (!candidates)
+        return 0;
+
+    // collect all code objects with a frame on the stack
+    int num_active = 0;
+    PyCodeObject** active = jit_get_active_code(tstate, &num_active);
+    if (!active) {
+        free(candidates);
+        return 0;
+    }
+
+    num_candidates = 0;
+    for (JitCodeHeader* h = mem_code_list; h; h = h->next) {
+        if (bsearch(&h->co, active, num_active, sizeof(PyCodeObject*), jit_ptr_cmp))
+            continue;
+        candidates[num_candidates].header = h;
+        candidates[num_candidates].num_runs = _PyCode_GetOpcache(h->co)->oc_opcache_flag - h->last_run_count;
+        ++num_candidates;
+    }
+    free(active);
+    qsort(candidates, num_candidates, sizeof(JitEvictCandidate), jit_evict_candidate_cmp);
+
+    int num_evicted = 0;
+    for (int i=0; i<num_candidates && mem_bytes_used > mem_bytes_used_max / 4 * 3; ++i) {
+        // reverts the function to the interpreter and frees the header
+        jit_evict_code(candidates[i].header->co);
+        ++num_evicted;
+    }
+    free(candidates);
+    jit_num_funcs_evicted += num_evicted;
+
+    // the survivors have to be hot again until the next eviction
+    JIT_MEM_RW();
+    for (JitCodeHeader* h = mem_code_list; h; h = h->next)
+        h->last_run_count = _PyCode_GetOpcache(h->co)->oc_opcache_flag;
+    JIT_MEM_RX();
+
+    return num_evicted;
+}
+
+// The JIT profile file stores which functions got JIT compiled so that the next process
+// (e.g. a restarted worker) can compile them right away instead of waiting for them to become hot.
+// Every line looks like '<hash> <filename>:<firstlineno> <name>' where only the hash is read back,
+// the rest is to make the file human readable.
+// Code objects are identified by a FNV-1a hash of the filename, name, first line number and bytecode
+// which in contrast to the object address is stable between runs.
+static unsigned long long jit_profile_hash_bytes(unsigned long long hash, const void* data, Py_ssize_t len) {
+    const unsigned char* p = data;
+    for (Py_ssize_t i=0; i<len; ++i) {
+        hash ^= p[i];
+        hash *= 0x100000001b3ULL;
+    }
+    return hash;
+}
+
+// returns 0 if the code object can't be hashed
+static unsigned long long jit_profile_hash_code(PyCodeObject* co) {
+    Py_ssize_t filename_len, name_len;
+    PyObject *type, *value, *traceback;
+    PyErr_Fetch(&type, &value, &traceback);
+    const char* filename = PyUnicode_AsUTF8AndSize(co->co_filename, &filename_len);
+    const char* name = PyUnicode_AsUTF8AndSize(co->co_name, &name_len);
+    if (!filename || !name) {
+        PyErr_Clear();
+        PyErr_Restore(type, value, traceback);
+        return 0;
+    }
+    PyErr_Restore(type, value, traceback);
+
+    unsigned long long hash = 0xcbf29ce484222325ULL;
+    hash = jit_profile_hash_bytes(hash, filename, filename_len + 1);
+    hash = jit_profile_hash_bytes(hash, name, name_len + 1);
+    hash = jit_profile_hash_bytes(hash, &co->co_firstlineno, sizeof(co->co_firstlineno));
+    hash = jit_profile_hash_bytes(hash, PyBytes_AS_STRING(co->co_code), PyBytes_GET_SIZE(co->co_code));
+    return hash ? hash : 1;
+}
+
+static int jit_profile_contains(unsigned long long hash) {
+    if (profile_hashes_size == 0)
+        return 0;
+    long mask = profile_hashes_size - 1;
+    for (long i = hash & mask; profile_hashes[i]; i = (i + 1) & mask) {
+        if (profile_hashes[i] == hash)
+            return 1;
+    }
+    return 0;
+}
+
+// returns 1 if the hash got added, 0 if it was already in the set and -1 on out of memory
+static int jit_profile_add(unsigned long long hash) {
+    if (jit_profile_contains(hash))
+        return 0;
+
+    if ((profile_num_hashes + 1) * 2 > profile_hashes_size) {
+        long new_size = profile_hashes_size ? profile_hashes_size * 2 : 1024;
+        unsigned long long* new_hashes = calloc(new_size, sizeof(unsigned long long));
+        if (!new_hashes)
+            return -1;
+        for (long i=0; i<profile_hashes_size; ++i) {
+            unsigned long long h = profile_hashes[i];
+            if (!h)
+                continue;
+            long j = h & (new_size - 1);
+            while (new_hashes[j])
+                j = (j + 1) & (new_size - 1);
+            new_hashes[j] = h;
+        }
+        free(profile_hashes);
+        profile_hashes = new_hashes;
+        profile_hashes_size = new_size;
+    }
+
+    long mask = profile_hashes_size - 1;
+    long i = hash & mask;
+    while (profile_hashes[i])
+        i = (i + 1) & mask;
+    profile_hashes[i] = hash;
+    ++profile_num_hashes;
+    return 1;
+}
+
+static void jit_profile_open(const char* path) {
+    FILE* f = fopen(path, "r");
+    if (f) {
+        unsigned long long hash;
+        // stops at the first malformed line
+        while (fscanf(f, "%llx%*[^\n]", &hash) == 1) {
+            if (hash && jit_profile_add(hash) < 0)
+                break;
+        }
+        fclose(f);
+    }
+    profile_num_loaded = profile_num_hashes;
+
+    // new entries get appended so that concurrently running processes all contribute to the profile
+    profile_file = fopen(path, "a");
+    if (!profile_file && jit_stats_enabled)
+        fprintf(stderr, "jit: could not open profile file %s for writing\n", path);
+}
+
+// returns true if the code object was JIT compiled by a previous run which used the same profile file
+int __attribute__((visibility("hidden"))) jit_profile_is_hot(PyCodeObject* co) {
+    if (profile_num_loaded == 0)
+        return 0;
+
+    if (!jit_profile_contains(jit_profile_hash_code(co)))
+        return 0;
+
+    ++jit_num_profile_hot;
+    return 1;
+}
+
+static void jit_profile_record(PyCodeObject* co) {
+    if (!profile_file)
+        return;
+
+    unsigned long long hash = jit_profile_hash_code(co);
+    if (!hash || jit_profile_add(hash) != 1)
+        return;
+
+    // hashing succeeded so the UTF8 representations are already cached and can't fail
+    fprintf(profile_file, "%016llx %s:%d %s\n", hash, PyUnicode_AsUTF8(co->co_filename),
+            co->co_firstlineno, PyUnicode_AsUTF8(co->co_name));
+    // flush so that short running or killed processes still write out their profile
+    fflush(profile_file);
+}
+
+static JitReportEntry* jit_report_lookup(unsigned long long hash) {
+    if (report_table_size == 0)
+        return NULL;
+    long mask = report_table_size - 1;
+    for (long i = hash & mask; report_table[i]; i = (i + 1) & mask) {
+        if (report_table[i]->hash == hash)
+            return report_table[i];
+    }
+    return NULL;
+}
+
+// returns -1 on out of memory
+static int jit_report_table_insert(JitReportEntry* entry) {
+    if ((report_table_num_entries + 1) * 2 > report_table_size) {
+        long new_size = report_table_size ? report_table_size * 2 : 1024;
+        JitReportEntry** new_table = calloc(new_size, sizeof(JitReportEntry*));
+        if (!new_table)
+            return -1;
+        for (long i=0; i<report_table_size; ++i) {
+            JitReportEntry* e = report_table[i];
+            if (!e)
+                continue;
+            long j = e->hash & (new_size - 1);
+            while (new_table[j])
+                j = (j + 1) & (new_size - 1);
+            new_table[j] = e;
+        }
+        free(report_table);
+        report_table = new_table;
+        report_table_size = new_size;
+    }
+
+    long mask = report_table_size - 1;
+    long i = entry->hash & mask;
+    while (report_table[i])
+        i = (i + 1) & mask;
+    report_table[i] = entry;
+    ++report_table_num_entries;
+    return 0;
+}
+
+static JitReportEntry* jit_report_add(PyCodeObject* co) {
+    unsigned long long hash = jit_profile_hash_code(co);
+    JitReportEntry* existing = hash ? jit_report_lookup(hash) : NULL;
+    if (existing) {
+        existing->compiled = 0;
+        return existing;
+    }
+
+    JitReportEntry** new_entries = realloc(report_entries, (report_num_entries + 1) * sizeof(JitReportEntry*));
+    if (!new_entries)
+        return NULL;
+    report_entries = new_entries;
+
+    JitReportEntry* entry = calloc(1, sizeof(JitReportEntry));
+    if (!entry)
+        return NULL;
+    const char* name = PyUnicode_AsUTF8(co->co_name);
+    const char* filename = PyUnicode_AsUTF8(co->co_filename);
+    if (!name || !filename)
+        PyErr_Clear();
+    entry->name = strdup(name ? name : "?");
+    entry->filename = strdup(filename ? filename : "?");
+    entry->firstlineno = co->co_firstlineno;
+    entry->bytecode_size = PyBytes_GET_SIZE(co->co_code);
+    // without the table entry recompiles just get a new entry
+    if (hash) {
+        entry->hash = hash;
+        if (jit_report_table_insert(entry) < 0)
+            entry->hash = 0;
+    }
+    report_entries[report_num_entries++] = entry;
+    return entry;
+}
+
+// writes 'str' as JSON string
+static void jit_report_write_str(FILE* f, const char* str) {
+    fputc('"', f);
+    for (const unsigned char* c = (const unsigned char*)str; *c; ++c) {
+        if (*c == '"' || *c == '\\')
+            fprintf(f, "\\%c", *c);
+        else if (*c < 0x20)
+            fprintf(f, "\\u%04x", *c);
+        else
+            fputc(*c, f);
+    }
+    fputc('"', f);
+}
+
+static void jit_report_write(const char* path) {
+    FILE* f = fopen(path, "w");
+    if (!f) {
+        fprintf(stderr, "jit: could not write report file %s\n", path);
+        return;
+    }
+    fprintf(f, "[\n");
+    for (long i = 0; i < report_num_entries; ++i) {
+        JitReportEntry* entry = report_entries[i];
+        fprintf(f, "  {\"name\": ");
+        jit_report_write_str(f, entry->name);
+        fprintf(f, ", \"filename\": ");
+        jit_report_write_str(f, entry->filename);
+        fprintf(f, ", \"firstlineno\": %d, \"compiled\": %s, \"bytecode_size\": %ld, \"code_size\": %ld, "
+                   "\"compile_time_us\": %ld, \"entries\": %lu, \"osr_entries\": %lu, \"deopts\": %lu}%s\n",
+                entry->firstlineno, entry->compiled ? "true" : "false", entry->bytecode_size, entry->code_size,
+                entry->compile_time_us, entry->num_entries, entry->num_osr_entries, entry->num_deopts,
+                i + 1 < report_num_entries ? "," : "");
+    }
+    fprintf(f, "]\n");
+    fclose(f);
+}
+
+// Returns a list with one dict per function we tried to compile, used by pyston.jit.compile_report().
+PyObject* __attribute__((visibility("hidden"))) jit_get_compile_report(void) {
+    PyObject* list = PyList_New(0);
+    if (!list)
+        return NULL;
+    for (long i = 0; i < report_num_entries; ++i) {
+        JitReportEntry* entry = report_entries[i];
+        PyObject* d = Py_BuildValue("{s:s,s:s,s:i,s:O,s:l,s:l,s:l,s:k,s:k,s:k}",
+                                    "name", entry->name,
+                                    "filename", entry->filename,
+                                    "firstlineno", entry->firstlineno,
+                                    "compiled", entry->compiled ? Py_True : Py_False,
+                                    "bytecode_size", entry->bytecode_size,
+                                    "code_size", entry->code_size,
+                                    "compile_time_us", entry->compile_time_us,
+                                    "entries", entry->num_entries,
+                                    "osr_entries", entry->num_osr_entries,
+                                    "deopts", entry->num_deopts);
+        if (!d || PyList_Append(list, d) < 0) {
+            Py_XDECREF(d);
+            Py_DECREF(list);
+            return NULL;
+        }
+        Py_DECREF(d);
+    }
+    return list;
+}
+
+enum {
+    JITDUMP_MAGIC = 0x4A695444,
+    JITDUMP_VERSION = 1,
+    JITDUMP_CODE_LOAD = 0,
+    JITDUMP_CODE_DEBUG_INFO = 2,
+};
+
+struct JitDumpHeader {
+    uint32_t magic, version, total_size, elf_mach, pad1, pid;
+    uint64_t timestamp, flags;
+};
+
+struct JitDumpRecordHeader {
+    uint32_t id, total_size;
+    uint64_t timestamp;
+};
+
+struct JitDumpCodeLoad {
+    struct JitDumpRecordHeader header;
+    uint32_t pid, tid;
+    uint64_t vma, code_addr, code_size, code_index;
+    // followed by the zero terminated function name and the machine code
+};
+
+struct JitDumpDebugInfo {
+    struct JitDumpRecordHeader header;
+    uint64_t code_addr, nr_entry;
+    // followed by nr_entry JitDumpDebugEntry + zero terminated file name
+};
+
+struct JitDumpDebugEntry {
+    uint64_t code_addr;
+    int32_t line, discrim;
+};
+
+// must use the same clock as 'perf record -k mono'
+static uint64_t jitdump_timestamp(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+static void jitdump_close(void) {
+    if (jitdump_marker) {
+        munmap(jitdump_marker, sysconf(_SC_PAGESIZE));
+        jitdump_marker = NULL;
+    }
+    if (jitdump_file) {
+        fclose(jitdump_file);
+        jitdump_file = NULL;
+    }
+}
+
+// opens 'jit-<pid>.dump' in jitdump_dir, perf requires this file name.
+// Gets called again in forked children because every process needs its own file.
+static void jitdump_open(void) {
+    jitdump_pid = getpid();
+    char path[PATH_MAX];
+    snprintf(path, sizeof(path), "%s/jit-%d.dump", jitdump_dir, jitdump_pid);
+    jitdump_file = fopen(path, "w+");
+    if (!jitdump_file) {
+        fprintf(stderr, "jit: could not create jitdump file %s\n", path);
+        return;
+    }
+    jitdump_marker = mmap(NULL, sysconf(_SC_PAGESIZE), PROT_READ | PROT_EXEC, MAP_PRIVATE, fileno(jitdump_file), 0);
+    if (jitdump_marker == MAP_FAILED) {
+        jitdump_marker = NULL;
+        jitdump_close();
+        fprintf(stderr, "jit: could not mmap jitdump file %s\n", path);
+        return;
+    }
+
+    struct JitDumpHeader header = {
+        .magic = JITDUMP_MAGIC,
+        .version = JITDUMP_VERSION,
+        .total_size = sizeof(header),
+#ifdef __aarch64__
+        .elf_mach = 183 /* EM_AARCH64 */,
+#else
+        .elf_mach = 62 /* EM_X86_64 */,
+#endif
+        .pid = jitdump_pid,
+        .timestamp = jitdump_timestamp(),
+    };
+    fwrite(&header, sizeof(header), 1, jitdump_file);
+    fflush(jitdump_file);
+}
+
+// Writes the debug info and code load records of a newly compiled function.
+// The debug info maps the start of every bytecode instruction to its python source line,
+// the DWARF discriminator field contains the bytecode offset.
+static void jitdump_write_func(PyCodeObject* co, const char* name, void* mem, long size,
+                               int* opcode_offset_begin, int num_opcodes) {
+    if (jitdump_pid != getpid()) {
+        // we got forked, the records of the parent would not match our pid
+        jitdump_close();
+        jitdump_open();
+    }
+    if (!jitdump_file)
+        return;
+
+    const char* filename = PyUnicode_AsUTF8(co->co_filename);
+    if (!filename) {
+        PyErr_Clear();
+        filename = "?";
+    }
+    uint64_t timestamp = jitdump_timestamp();
+
+    struct JitDumpDebugInfo debug_info = {
+        .header = {
+            .id = JITDUMP_CODE_DEBUG_INFO,
+            .total_size = sizeof(debug_info) + num_opcodes * (sizeof(struct JitDumpDebugEntry) + strlen(filename) + 1),
+            .timestamp = timestamp,
+        },
+        .code_addr = (uint64_t)mem,
+        .nr_entry = num_opcodes,
+    };
+    fwrite(&debug_info, sizeof(debug_info), 1, jitdump_file);
+    for (int inst_idx = 0; inst_idx < num_opcodes; ++inst_idx) {
+        int byte_offset = inst_idx * (int)sizeof(_Py_CODEUNIT);
+        struct JitDumpDebugEntry entry = {
+            .code_addr = (uint64_t)&((char*)opcode_offset_begin)[opcode_offset_begin[inst_idx]],
+            .line = PyCode_Addr2Line(co, byte_offset),
+            .discrim = byte_offset,
+        };
+        fwrite(&entry, sizeof(entry), 1, jitdump_file);
+        fwrite(filename, strlen(filename) + 1, 1, jitdump_file);
+    }
+
+    struct JitDumpCodeLoad code_load = {
+        .header = {
+            .id = JITDUMP_CODE_LOAD,
+            .total_size = sizeof(code_load) + strlen(name) + 1 + size,
+            .timestamp = timestamp,
+        },
+        .pid = jitdump_pid,
+        .tid = (uint32_t)PyThread_get_thread_native_id(),
+        .vma = (uint64_t)mem,
+        .code_addr = (uint64_t)mem,
+        .code_size = size,
+        .code_index = jitdump_code_index++,
+    };
+    fwrite(&code_load, sizeof(code_load), 1, jitdump_file);
+    fwrite(name, strlen(name) + 1, 1, jitdump_file);
+    fwrite(mem, size, 1, jitdump_file);
+
+    // flush after every function so the file is usable even if the process never exits cleanly
+    fflush(jitdump_file);
+}
+
+|.globals lbl_
+|.actionlist bf_actions
+
+#if JIT_DEBUG
+__attribute__((optimize("-O0"))) // enable to make "source tools/dis_jit_gdb.py" work
+#endif
+#ifdef PYSTON_LITE
+void* jit_func_lite(PyCodeObject* co, PyThreadState* tstate) {
+#else
+void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
+#endif
+    if (jit_num_retired_code)
+        jit_free_retired_code(tstate);
+
+    if (mem_bytes_used_max <= mem_bytes_used) { // used up all memory
+        if (!mem_evict_cold || jit_mem_evict_cold(tstate) == 0)
+            return NULL; // stop emitting code
+    }
+
+    int success = 0;
+
+    struct timespec compilation_start;
+    if (jit_stats_enabled || jit_report_enabled)
+        clock_gettime(CLOCK_MONOTONIC, &compilation_start);
+
+    // the machine code increments the counters of this entry
+    JitReportEntry* report_entry = jit_report_enabled ? jit_report_add(co) : NULL;
+
+    // setup jit context, will get accessed from all dynasm functions via the name 'Dst'
+    Jit jit;
+    memset(&jit, 0, sizeof(jit));
+    jit.co = co;
+    jit.co_consts = co->co_consts;
+    jit.co_names = co->co_names;
+    jit.current_section = -1;
+
+    jit.opcache = _PyCode_GetOpcache(co);
+
+    if (!builtin_len) {
+        builtin_len = PyDict_GetItemString(tstate->interp->builtins, "len");
+        Py_XINCREF(builtin_len);
+    }
+
+    jit.num_opcodes = PyBytes_Size(co->co_code)/sizeof(_Py_CODEUNIT);
+    jit.first_instr = (_Py_CODEUNIT *)PyBytes_AS_STRING(co->co_code);
+
+    Jit* Dst = &jit;
+    dasm_init(Dst, DASM_MAXSECTION);
+    void* labels[lbl__MAX];
+    dasm_setupglobal(Dst, labels, lbl__MAX);
+
+    dasm_setup(Dst, bf_actions);
+
+    // allocate enough space for emitting a dynamic label for the start of every bytecode
+    dasm_growpc(Dst, Dst->num_opcodes + 1);
+
+    // we emit the opcode implementations first and afterwards the entry point of the function because
+    // we don't know how much stack it will use etc..
+    switch_section(Dst, SECTION_CODE);
+
+    jit.is_jmp_target = calculate_jmp_targets(Dst);
+
+#if ENABLE_DEFINED_TRACKING
+    jit.known_defined = (char*)malloc(co->co_nlocals);
+    const int funcs_args_are_always_defined = check_func_args_never_deleted(Dst);
+#endif
+
+    // did we emit the * label already?
+#if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION == 8
     int end_finally_label = 0;
 #endif
     int exit_yielding_label = 0;
@@ -3804,6 +4970,8 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
                 | branch_eq >1
                 switch_section(Dst, SECTION_COLD);
                 |1:
+                // emit_instr_start may have skipped the f_lasti update
+                emit_update_f_lasti(Dst, inst_idx * INST_IDX_TO_LASTI_FACTOR);
                 emit_mov_imm(Dst, arg1_idx, oparg); // need to copy it in arg1 because of unboundlocal_error
                 | branch ->unboundlocal_error // arg1 must be oparg!
                 switch_section(Dst, SECTION_CODE);
@@ -4039,6 +5207,9 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
             if (opcode == BINARY_SUBSCR && emit_special_binary_subscr(Dst, inst_idx, const_val, ref_status) == 0) {
                 break; // we are finished
             }
+            if (opcode == BINARY_SUBSCR && !const_val && emit_special_binary_subscr_index(Dst, inst_idx, oparg, ref_status) == 0) {
+                break; // we are finished
+            }
             if (opcode == COMPARE_OP && emit_special_compare_op(Dst, oparg, ref_status) == 0) {
                 break; // we are finished
             }
@@ -4048,6 +5219,9 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
             if (emit_special_concat_inplace(Dst, inst_idx, opcode, oparg, ref_status[1], ref_status[0], load_store_left_idx, const_val) == 0) {
                 break; // we are finished
             }
+            if (emit_special_binary_op_unboxed(Dst, inst_idx, opcode, oparg, ref_status[1], ref_status[0], const_val) == 0) {
+                break; // we are finished
+            }
             // generic path
             |1:
             void* func = get_aot_func_addr(Dst, opcode, oparg, 0 /*= no op cache */);
@@ -4253,13 +5427,45 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
 
                 if (hint)
                     free(hint);
+            } else if (opcode == CALL_FUNCTION && oparg == 1 && jit_use_ics && builtin_len && is_len_call(Dst, inst_idx)) {
+                // inline len(list) and len(tuple)
+                wrote_inline_cache = 1;
+                ++jit_stat_len_inlined;
+
+                // like for CALL_METHOD we have to guard on tracing because we skip the call events
+#if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 9
+                JIT_ASSERT(sizeof(tstate->use_tracing) == 4, "");
+                emit_cmp32_mem_imm(Dst, tstate_idx, offsetof(PyThreadState, use_tracing), 0);
+#else
+                emit_use_tracing_check(Dst);
+#endif
+                | branch_ne >1
+
+                emit_cmp64_mem_imm(Dst, vsp_idx, -16, (uint64_t)builtin_len); // callable
+                | branch_ne >1
+
+                emit_load64_mem(Dst, arg1_idx, vsp_idx, -8);
+                emit_cmp64_mem_imm(Dst, arg1_idx, offsetof(PyObject, ob_type), (uint64_t)&PyList_Type);
+                | branch_eq >4
+                | type_check arg1_idx, &PyTuple_Type, >1
+                |4:
+                emit_load64_mem(Dst, arg1_idx, arg1_idx, offsetof(PyVarObject, ob_size));
+                emit_call_ext_func(Dst, PyLong_FromSsize_t);
+
+                int num_decrefs = IS_IMMORTAL(builtin_len) ? 1 : 2;
+                for (int i = 0; i < num_decrefs; i++) {
+                    emit_load64_mem(Dst, arg1_idx, vsp_idx, -(i + 1) * 8);
+                    emit_decref(Dst, arg1_idx, 1 /* preserve res */);
+                }
+                emit_adjust_vs(Dst, -2);
+                emit_if_res_0_error(Dst);
             }
 
             if (wrote_inline_cache)
                 switch_section(Dst, SECTION_COLD);
 
             |1:
-            if (wrote_inline_cache && jit_stats_enabled) {
+            if (wrote_inline_cache && opcode == CALL_METHOD && jit_stats_enabled) {
                 emit_inc_qword_ptr(Dst, &jit_stat_call_method_miss, 1 /*=can use tmp_reg*/);
             }
             | mov arg1, tstate
@@ -5345,10 +6551,16 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
 #endif
 
     |->deopt_return_new_line:
+    if (report_entry) {
+        emit_inc_qword_ptr(Dst, &report_entry->num_deopts, 1 /*=can use tmp_reg*/);
+    }
     emit_mov_imm(Dst, real_res_idx, (1 << 2) /* this means first trace check for this line */ | 3 /*= deopt */);
     | branch ->return
 
     |->deopt_return:
+    if (report_entry) {
+        emit_inc_qword_ptr(Dst, &report_entry->num_deopts, 1 /*=can use tmp_reg*/);
+    }
     emit_mov_imm(Dst, real_res_idx, 3 /*= deopt */);
     | branch ->return
 
@@ -5444,6 +6656,11 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
         emit_store64_mem_imm(Dst, 0 /* =value */, sp_reg_idx, (DEFERRED_STACK_SLOT_START + i) * 8);
     }
 
+    if (mem_evict_cold) {
+        // keep counting calls and resumes so that we know which functions are cold
+        emit_inc_qword_ptr(Dst, &Dst->opcache->oc_opcache_flag, 1 /*=can use tmp_reg*/);
+    }
+
     // in the most common case where f_lasti is < 0 it just fallsthrough to the first opcode
     // in the other cases it will jump to the opcode f_lasti + 2.
     emit_load32_mem(Dst, arg1_idx, f_idx, offsetof(PyFrameObject, f_lasti));
@@ -5455,6 +6672,10 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
     switch_section(Dst, SECTION_CODE);
 
     |1:
+    if (report_entry) {
+        // this is not the start of a call but OSR or a generator resume
+        emit_inc_qword_ptr(Dst, &report_entry->num_osr_entries, 1 /*=can use tmp_reg*/);
+    }
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION <= 9
     emit_add_or_sub_imm(Dst, arg1_idx, arg1_idx, 2); // we have to increment the value by one instruction.
 #else
@@ -5493,6 +6714,9 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
     emit_jmp_to_inst_idx(Dst, arg1_idx);
 
     switch_section(Dst, prev_section);
+    if (report_entry) {
+        emit_inc_qword_ptr(Dst, &report_entry->num_entries, 1 /*=can use tmp_reg*/);
+    }
     // code assumes that the opcodes follows here...
 
     ////////////////////////////////
@@ -5540,67 +6764,9 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
     // something maybe you're supposed to do?
     size = (size + 15) / 16 * 16;
 
-    // Allocate jitted code regions in 256KB chunks:
-    if (size > mem_chunk_bytes_remaining) {
-        mem_chunk_bytes_remaining = size > (1<<18) ? size : (1<<18);
-
-#ifdef __amd64__
-        int map_flags = 0;
-#if __linux__
-        // allocate memory which address fits inside a 32bit pointer (makes sure we can use 32bit rip relative addressing which results in smaller instructions)
-        map_flags |= MAP_32BIT;
-#elif __APPLE__
-        map_flags |= MAP_JIT;
-#endif
-        void* new_chunk = mmap(0, mem_chunk_bytes_remaining,
-                               PROT_READ | PROT_WRITE | PROT_EXEC,
-                               MAP_PRIVATE | MAP_ANONYMOUS | map_flags, -1, 0);
-        int failed = new_chunk == MAP_FAILED;
-#elif __aarch64__
-        int map_flags = 0;
-#if __linux__
-        // MAP_FIXED_NOREPLACE is available from linux 4.17, but older glibc don't define it.
-        // Older kernel will ignore this flag and will try to allocate the address supplied as hint
-        // but if not possible will just return a different address.
-#ifndef MAP_FIXED_NOREPLACE
-#define MAP_FIXED_NOREPLACE 0x100000
-#endif
-        map_flags |= MAP_FIXED_NOREPLACE;
-#elif __APPLE__
-        map_flags |= MAP_JIT;
-#endif
-        // we try to allocate a memory block close to our AOT functions, because on ARM64 the relative call insruction 'bl'
-        // can only address +-128MB from current IP. And this allows us to use bl for most calls.
-        void* new_chunk = MAP_FAILED;
-        // try allocate memory 25MB after this AOT func.
-        char* start_addr = (char*)(((uint64_t)LAYOUT_TARGET + 25*1024*1024 + 4095) / 4096 * 4096);
-        for (int i=0; i<8 && new_chunk == MAP_FAILED; ++i, start_addr += 5*1024*1024) {
-            // If the returned adddress does not fix in 32bit we abort the JIT compilation.
-            new_chunk = mmap(start_addr + mem_bytes_allocated, mem_chunk_bytes_remaining,
-                             PROT_READ | PROT_WRITE | PROT_EXEC,
-                             MAP_PRIVATE | MAP_ANONYMOUS | map_flags, -1, 0);
-        }
-        int failed = new_chunk == MAP_FAILED || !can_use_relative_call(new_chunk);
-#else
-#error "unknown arch"
-#endif
-        if (failed) {
-#if JIT_DEBUG
-            JIT_ASSERT(0, "mmap() returned error %d", errno);
-#endif
-            if (new_chunk != MAP_FAILED)
-                munmap(new_chunk, mem_chunk_bytes_remaining);
-            mem_chunk_bytes_remaining = 0;
-            goto failed;
-        }
-        mem_chunk = new_chunk;
-        mem_bytes_allocated += (mem_chunk_bytes_remaining + 4095) / 4096 * 4096;
-    }
-
-    void* mem = mem_chunk;
-    mem_chunk += size;
-    mem_chunk_bytes_remaining -= size;
-    mem_bytes_used += size;
+    void* mem = jit_mem_alloc(co, size);
+    if (!mem)
+        goto failed;
 
     JIT_MEM_RW();
 
@@ -5609,6 +6775,8 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
 #if JIT_DEBUG
         JIT_ASSERT(0, "dynasm_encode() returned error %x", dasm_encode_err);
 #endif
+        JIT_MEM_RX();
+        jit_mem_free(mem);
         goto failed;
     }
 
@@ -5624,7 +6792,7 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
 
     JIT_MEM_RX();
 
-    if (perf_map_file) {
+    if (perf_map_file || jitdump_dir) {
         PyObject *type, *value, *traceback;
         PyErr_Fetch(&type, &value, &traceback);
 
@@ -5638,21 +6806,30 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
         // The code object just has the function name + file name, so use that
         // plus the line number for now.  Maybe it's too much info.
         // Add an index at the end in the case of a name clash.
-        PyObject* function_name = PyUnicode_FromFormat("%U:%d:%U",
-                PyTuple_GET_ITEM(partitioned, 2), co->co_firstlineno, co->co_name);
-        PyObject* function_name_bytes = PyUnicode_AsASCIIString(function_name);
-        char* function_name_cstr = PyBytes_AS_STRING(function_name_bytes);
-
-        ++perf_map_num_funcs;
-        perf_map_funcs = realloc(perf_map_funcs, perf_map_num_funcs*sizeof(struct PerfMapEntry));
-        perf_map_funcs[perf_map_num_funcs-1].func_name = strdup(function_name_cstr);
-        perf_map_funcs[perf_map_num_funcs-1].func_size = size;
-        perf_map_funcs[perf_map_num_funcs-1].func_addr = mem;
-
-        Py_DECREF(function_name);
-        Py_DECREF(function_name_bytes);
+        PyObject* function_name = partitioned ? PyUnicode_FromFormat("%U:%d:%U",
+                PyTuple_GET_ITEM(partitioned, 2), co->co_firstlineno, co->co_name) : NULL;
+        // perf and the jitdump format expect UTF-8 names
+        const char* function_name_cstr = function_name ? PyUnicode_AsUTF8AndSize(function_name, NULL) : NULL;
+
+        if (!function_name_cstr) {
+            // e.g. a filename with lone surrogates: skip the record instead of failing the compilation
+            PyErr_Clear();
+        } else {
+            if (perf_map_file) {
+                ++perf_map_num_funcs;
+                perf_map_funcs = realloc(perf_map_funcs, perf_map_num_funcs*sizeof(struct PerfMapEntry));
+                perf_map_funcs[perf_map_num_funcs-1].func_name = strdup(function_name_cstr);
+                perf_map_funcs[perf_map_num_funcs-1].func_size = size;
+                perf_map_funcs[perf_map_num_funcs-1].func_addr = mem;
+            }
+            if (jitdump_dir) {
+                jitdump_write_func(co, function_name_cstr, mem, size,
+                                   (int*)labels[lbl_opcode_offset_begin], Dst->num_opcodes);
+            }
+        }
 
-        Py_DECREF(partitioned);
+        Py_XDECREF(function_name);
+        Py_XDECREF(partitioned);
         PyErr_Restore(type, value, traceback);
     }
 
@@ -5710,6 +6887,13 @@ void* jit_func(PyCodeObject* co, PyThreadState* tstate) {
     ++jit_num_funcs;
     success = 1;
 
+    if (report_entry) {
+        report_entry->compiled = 1;
+        report_entry->code_size = size;
+    }
+
+    jit_profile_record(co);
+
 cleanup:
     dasm_free(Dst);
     free(Dst->is_jmp_target);
@@ -5731,10 +6915,13 @@ cleanup:
         hint = new_hint;
     }
 
-    if (jit_stats_enabled) {
+    if (jit_stats_enabled || report_entry) {
         struct timespec compilation_end;
         clock_gettime(CLOCK_MONOTONIC, &compilation_end);
-        total_compilation_time_in_us += 1000000 * (compilation_end.tv_sec - compilation_start.tv_sec) + (compilation_end.tv_nsec - compilation_start.tv_nsec) / 1000;
+        long compilation_time_in_us = 1000000 * (compilation_end.tv_sec - compilation_start.tv_sec) + (compilation_end.tv_nsec - compilation_start.tv_nsec) / 1000;
+        total_compilation_time_in_us += compilation_time_in_us;
+        if (report_entry)
+            report_entry->compile_time_us += compilation_time_in_us;
     }
 
     return success ? labels[lbl_entry] : NULL;
@@ -5755,6 +6942,16 @@ static void show_jit_stats() {
     fprintf(stderr, "jit: successfully compiled %d functions, failed to compile %d functions\n", jit_num_funcs, jit_num_failed);
     fprintf(stderr, "jit: took %ld ms to compile all functions\n", total_compilation_time_in_us/1000);
     fprintf(stderr, "jit: %ld bytes used (%.1f%% of allocated)\n", mem_bytes_used, 100.0 * mem_bytes_used / mem_bytes_allocated);
+    fprintf(stderr, "jit: freed code of %d functions: %ld bytes freed %ld bytes reused\n", jit_num_funcs_freed, mem_bytes_freed, mem_bytes_reused);
+    if (mem_evict_cold)
+        fprintf(stderr, "jit: evicted code of %d cold functions\n", jit_num_funcs_evicted);
+    if (mem_share_forked_code)
+        fprintf(stderr, "jit: %ld bytes of code inherited from the parent process\n", mem_bytes_inherited);
+    if (profile_file)
+        fprintf(stderr, "jit: profile file lists %ld functions, %ld of them got executed\n", profile_num_loaded, jit_num_profile_hot);
+    fprintf(stderr, "jit: compiled %lu functions because of a hot loop, entered %lu loops via OSR\n", jit_stat_osr_compiles, jit_stat_osr_entries);
+    fprintf(stderr, "jit: %lu of %lu generator resumes ran machine code (=%lu%%)\n", jit_stat_gen_resumes_native, jit_stat_gen_resumes,
+            jit_stat_gen_resumes ? jit_stat_gen_resumes_native*100 / jit_stat_gen_resumes : 0);
 
 #define PRINT_STAT(name, opcode) fprintf(stderr, "jit: inlined %lu (of total %lu) %s caches: %lu hits %lu misses (=%lu%%)\n", \
 jit_stat_##name##_inline, jit_stat_##name##_total, #opcode, jit_stat_##name##_hit, jit_stat_##name##_miss, \
@@ -5769,9 +6966,144 @@ jit_stat_##name##_inline, jit_stat_##name##_total, #opcode, jit_stat_##name##_hi
     fprintf(stderr, "jit: num SetItemLong: %lu inlined: %lu\n", jit_stat_setitemlong_inlined, jit_stat_setitemlong_inlined);
     fprintf(stderr, "jit: num inplace binary op: %lu hits: %lu misses: %lu\n", jit_stat_binary_op_inplace, jit_stat_binary_op_inplace_hit, jit_stat_binary_op_inplace_miss);
     fprintf(stderr, "jit: num inplace concat: %lu hits: %lu misses: %lu\n", jit_stat_concat_inplace, jit_stat_concat_inplace_hit, jit_stat_concat_inplace_miss);
+    fprintf(stderr, "jit: num unboxed binary op: %lu hits: %lu misses: %lu\n", jit_stat_binary_op_unboxed, jit_stat_binary_op_unboxed_hit, jit_stat_binary_op_unboxed_miss);
+    fprintf(stderr, "jit: num inlined GetItem with int index: %lu inlined len(): %lu\n", jit_stat_getitem_index_inlined, jit_stat_len_inlined);
 
     fprintf(stderr, "jit: num polymorphic LOAD_ATTR sites: %lu with %lu entries\n", jit_stat_load_attr_poly, jit_stat_load_attr_poly_entries);
     fprintf(stderr, "jit: num polymorphic LOAD_METHOD sites: %lu with %lu entries\n", jit_stat_load_method_poly, jit_stat_load_method_poly_entries);
+    fprintf(stderr, "jit: num megamorphic LOAD_ATTR sites: %lu LOAD_METHOD sites: %lu\n", jit_stat_load_attr_megamorphic, jit_stat_load_method_megamorphic);
+}
+
+// Returns a dict with all JIT counters, used by pyston.jit.stats().
+// The inline cache hit/miss counters are only collected for functions which got
+// compiled while stats collection was enabled.
+PyObject* __attribute__((visibility("hidden"))) jit_get_stats(void) {
+    PyObject* d = PyDict_New();
+    if (!d)
+        return NULL;
+
+#define ADD_STAT(name, value) do { \
+        PyObject* v = PyLong_FromLong(value); \
+        if (!v || PyDict_SetItemString(d, name, v) < 0) { \
+            Py_XDECREF(v); \
+            Py_DECREF(d); \
+            return NULL; \
+        } \
+        Py_DECREF(v); \
+    } while (0)
+#define ADD_IC_STAT(name) do { \
+        ADD_STAT(#name "_hit", jit_stat_##name##_hit); \
+        ADD_STAT(#name "_miss", jit_stat_##name##_miss); \
+        ADD_STAT(#name "_inline", jit_stat_##name##_inline); \
+        ADD_STAT(#name "_total", jit_stat_##name##_total); \
+    } while (0)
+
+    ADD_STAT("num_funcs", jit_num_funcs);
+    ADD_STAT("num_failed", jit_num_failed);
+    ADD_STAT("num_funcs_freed", jit_num_funcs_freed);
+    ADD_STAT("num_funcs_evicted", jit_num_funcs_evicted);
+    ADD_STAT("compilation_time_us", total_compilation_time_in_us);
+    ADD_STAT("mem_bytes_allocated", mem_bytes_allocated);
+    ADD_STAT("mem_bytes_used", mem_bytes_used);
+    ADD_STAT("mem_bytes_freed", mem_bytes_freed);
+    ADD_STAT("mem_bytes_reused", mem_bytes_reused);
+    ADD_STAT("mem_bytes_inherited", mem_bytes_inherited);
+    ADD_STAT("profile_num_loaded", profile_num_loaded);
+    ADD_STAT("profile_num_hot", jit_num_profile_hot);
+    ADD_STAT("osr_compiles", jit_stat_osr_compiles);
+    ADD_STAT("osr_entries", jit_stat_osr_entries);
+    ADD_STAT("gen_resumes", jit_stat_gen_resumes);
+    ADD_STAT("gen_resumes_native", jit_stat_gen_resumes_native);
+
+    ADD_IC_STAT(load_attr);
+    ADD_IC_STAT(load_method);
+    ADD_IC_STAT(load_global);
+    ADD_IC_STAT(call_method);
+    ADD_IC_STAT(store_attr);
+
+    ADD_STAT("getitemlong", jit_stat_getitemlong);
+    ADD_STAT("getitemlong_inlined", jit_stat_getitemlong_inlined);
+    ADD_STAT("setitemlong_inlined", jit_stat_setitemlong_inlined);
+    ADD_STAT("binary_op_inplace", jit_stat_binary_op_inplace);
+    ADD_STAT("binary_op_inplace_hit", jit_stat_binary_op_inplace_hit);
+    ADD_STAT("binary_op_inplace_miss", jit_stat_binary_op_inplace_miss);
+    ADD_STAT("concat_inplace", jit_stat_concat_inplace);
+    ADD_STAT("concat_inplace_hit", jit_stat_concat_inplace_hit);
+    ADD_STAT("concat_inplace_miss", jit_stat_concat_inplace_miss);
+    ADD_STAT("binary_op_unboxed", jit_stat_binary_op_unboxed);
+    ADD_STAT("binary_op_unboxed_hit", jit_stat_binary_op_unboxed_hit);
+    ADD_STAT("binary_op_unboxed_miss", jit_stat_binary_op_unboxed_miss);
+    ADD_STAT("getitem_index_inlined", jit_stat_getitem_index_inlined);
+    ADD_STAT("len_inlined", jit_stat_len_inlined);
+    ADD_STAT("load_attr_poly", jit_stat_load_attr_poly);
+    ADD_STAT("load_attr_poly_entries", jit_stat_load_attr_poly_entries);
+    ADD_STAT("load_method_poly", jit_stat_load_method_poly);
+    ADD_STAT("load_method_poly_entries", jit_stat_load_method_poly_entries);
+    ADD_STAT("load_attr_megamorphic", jit_stat_load_attr_megamorphic);
+    ADD_STAT("load_method_megamorphic", jit_stat_load_method_megamorphic);
+#undef ADD_IC_STAT
+#undef ADD_STAT
+
+    return d;
+}
+
+// Adds the JIT specific settings to the dict 'd', used by pyston.jit.get_config().
+int __attribute__((visibility("hidden"))) jit_get_config(PyObject* d) {
+    PyObject* v;
+#define ADD_CONFIG(name, value) do { \
+        v = PyLong_FromLong(value); \
+        if (!v || PyDict_SetItemString(d, name, v) < 0) { \
+            Py_XDECREF(v); \
+            return -1; \
+        } \
+        Py_DECREF(v); \
+    } while (0)
+    ADD_CONFIG("max_mem", mem_bytes_used_max);
+    ADD_CONFIG("use_aot", jit_use_aot);
+    ADD_CONFIG("use_ics", jit_use_ics);
+    ADD_CONFIG("show_stats", jit_stats_enabled);
+    ADD_CONFIG("report", jit_report_enabled);
+    ADD_CONFIG("share_forked_code", mem_share_forked_code);
+    ADD_CONFIG("evict_cold", mem_evict_cold);
+#undef ADD_CONFIG
+    return 0;
+}
+
+// Changes a JIT specific setting, used by pyston.jit.set_config().
+// Returns 1 if the setting got changed, 0 if 'name' is not a JIT setting and -1 on error.
+// Settings only affect functions which get compiled afterwards.
+int __attribute__((visibility("hidden"))) jit_set_config(const char* name, PyObject* value) {
+    long* long_setting = NULL;
+    int* int_setting = NULL;
+    if (strcmp(name, "max_mem") == 0)
+        long_setting = &mem_bytes_used_max;
+    else if (strcmp(name, "use_aot") == 0)
+        int_setting = &jit_use_aot;
+    else if (strcmp(name, "use_ics") == 0)
+        int_setting = &jit_use_ics;
+    else if (strcmp(name, "show_stats") == 0)
+        int_setting = &jit_stats_enabled;
+    else if (strcmp(name, "report") == 0)
+        int_setting = &jit_report_enabled;
+    else if (strcmp(name, "share_forked_code") == 0)
+        int_setting = &mem_share_forked_code;
+    else if (strcmp(name, "evict_cold") == 0)
+        int_setting = &mem_evict_cold;
+    else
+        return 0;
+
+    long v = PyLong_AsLong(value);
+    if (v == -1 && PyErr_Occurred())
+        return -1;
+    if (v < 0) {
+        PyErr_Format(PyExc_ValueError, "%s must not be negative", name);
+        return -1;
+    }
+    if (long_setting)
+        *long_setting = v;
+    else
+        *int_setting = (int)v;
+    return 1;
 }
 
 #ifdef PYSTON_LITE
@@ -5794,7 +7126,14 @@ void jit_start() {
 
         perf_map_opcode_map = fopen("/tmp/perf_map/opcode_map.txt", "w");
     }
-    char* val = getenv("JIT_MAX_MEM");
+    char* val = getenv("JIT_PERF_JITDUMP");
+    if (val && *val) {
+        // the value is the directory the file gets created in, '1' means /tmp
+        jitdump_dir = strdup(strcmp(val, "1") == 0 ? "/tmp" : val);
+        jitdump_open();
+    }
+
+    val = getenv("JIT_MAX_MEM");
     if (val)
         mem_bytes_used_max = atol(val);
 
@@ -5812,6 +7151,24 @@ void jit_start() {
     if (val)
         jit_use_ics = atoi(val);
 
+    val = getenv("JIT_SHARE_FORKED_CODE");
+    if (val)
+        mem_share_forked_code = atoi(val);
+
+    val = getenv("JIT_EVICT_COLD");
+    if (val)
+        mem_evict_cold = atoi(val);
+
+    val = getenv("JIT_PROFILE_FILE");
+    if (val && *val)
+        jit_profile_open(val);
+
+    val = getenv("JIT_REPORT_FILE");
+    if (val && *val) {
+        report_file_path = strdup(val);
+        jit_report_enabled = 1;
+    }
+
 #ifdef PYSTON_LITE
     // This is to get the value of lookdict_split, which is a static function:
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION == 7
@@ -5877,6 +7234,19 @@ void jit_finish() {
 
     if (perf_map_opcode_map)
         fclose(perf_map_opcode_map);
+
+    jitdump_close();
+
+    if (profile_file) {
+        fclose(profile_file);
+        profile_file = NULL;
+    }
+
+    if (report_file_path) {
+        jit_report_write(report_file_path);
+        free(report_file_path);
+        report_file_path = NULL;
+    }
 }
 
 #if JIT_DEBUG
@@ -2,10 +2,16 @@
 
 import copy
 import ctypes
+import hashlib
+import io
 import itertools
+import json
 import multiprocessing.pool
 import os
+import re
+import shutil
 import sys
+import time
 
 cmps = ["PyCmp_LT", "PyCmp_LE", "PyCmp_EQ", "PyCmp_NE",
         "PyCmp_GT", "PyCmp_GE", "PyCmp_IN", "PyCmp_NOT_IN",
@@ -20,6 +26,13 @@ funcs_need_res_wrap = [
 
 VERBOSITY = 0
 
+# if set we store the traced bitcode of every specialization in this directory
+# and only retrace the specializations whose inputs changed, see TraceCache
+CACHE_DIR = None
+# files which every trace depends on (e.g. the interpreter bitcode)
+CACHE_KEY_FILES = []
+PIC = False
+
 
 class NullObjectGuard(object):
     def getGuard(self, variable_name):
@@ -369,6 +382,14 @@ class NormalHandler(Handler):
         print(f"{profile_func_sig}", "{", file=profile_f)
         func_call_args = ', '.join(self._args_names())
 
+        # JIT_AOT_TYPE_PROFILE: record the types of every call instead of patching the call site
+        profiled_args = [f"(PyObject*){name}" for (type, name) in self._args() if type.endswith("*")]
+        print("  if (unlikely(aot_type_profile_enabled)) {", file=profile_f)
+        print(f"    PyObject* profile_args[] = {{ {', '.join(profiled_args)} }};", file=profile_f)
+        print(f'    aot_type_profile_record("{unspec_name}", {len(profiled_args)}, profile_args);', file=profile_f)
+        print(f"    return {unspec_name}({func_call_args});", file=profile_f)
+        print("  }", file=profile_f)
+
         for spec, name in traced:
             checks = spec.getGuard([f"o{i}" for i in range(self.nargs)])
             print(f"  if ({checks})", "{", file=profile_f)
@@ -556,7 +577,35 @@ class ExampleClass{i}:
         pass
     """, globals())
 
-def loadCases():
+def loadTypeProfile(path, coverage):
+    """
+    Parses a file written by running pyston with JIT_AOT_TYPE_PROFILE=<path>.
+    It only counts the generic call sites executed by JIT compiled code, the
+    interpreter and the JIT's inline fast paths don't go through the *Profile
+    functions.
+    Returns a dict: unspecialized function name -> list of tuples of type names.
+    Per function only the most frequent type combinations which together make up
+    'coverage' of all calls are returned.
+    """
+    counts = {}
+    with open(path) as f:
+        for line in f:
+            count, func, *type_names = line.split()
+            counts.setdefault(func, []).append((int(count), tuple(type_names)))
+
+    hot = {}
+    for func, l in counts.items():
+        l.sort(reverse=True)
+        total = sum(count for count, _ in l)
+        covered = 0
+        for count, type_names in l:
+            if covered >= total * coverage:
+                break
+            hot.setdefault(func, []).append(type_names)
+            covered += count
+    return hot
+
+def loadCases(type_profile=None):
     funcs1 = ["PyNumber_Positive",
               "PyNumber_Negative",
               "PyNumber_Invert",
@@ -622,6 +671,18 @@ def loadCases():
         return f"Py{s}_Type"
     type_classes = {k:ObjectClass(k, TypeGuard("&" + getCTypeName(k)), v) for (k, v) in types.items()}
 
+    # types we only specialize on if the type profile says they are hot
+    profile_only_types = {"Bytes": (b"bytes", b""),
+                          "ByteArray": (bytearray(b"bytes"),),
+                          "Complex": (1+2j,),
+                          "FrozenSet": (frozenset({"a", "b"}), frozenset()),
+                          }
+    # tp_name -> ObjectClass of all the types whose type object is part of the interpreter binary
+    # which means the AOT code can guard on them
+    profile_type_classes = {}
+    for (k, v) in list(types.items()) + list(profile_only_types.items()):
+        profile_type_classes[type(v[0]).__name__] = type_classes.get(k) or ObjectClass(k, TypeGuard("&" + getCTypeName(k)), v)
+
     # look at types.py
     callables = {"CFunction": [(globals, ()), # zero args
                                (len, (([1, 2, 3], )), ((1, 2), ), ("test string", )), # one arg
@@ -805,13 +866,36 @@ def loadCases():
         return [Signature(classes) for classes in itertools.product(*args_classes)]
     placeholder_class = ObjectClass("", Unspecialized, [(42, "test"), 0])
 
+    not_specializable = set()
     for funcs, nargs, nspecialized in [(funcs1, 1, 1), (funcs2, 2, 2), (funcs3_2specialized, 3, 2)]:
         classes = [type_classes.values()] * nspecialized + [[placeholder_class]] * (nargs - nspecialized)
 
         signatures = makeSignatures(*classes)
 
         for func in funcs:
-            cases.append(NormalHandler(FunctionCases(func, signatures)))
+            if type_profile is None:
+                cases.append(NormalHandler(FunctionCases(func, signatures)))
+                continue
+
+            # only generate the type combinations the profiled workload used
+            func_signatures = []
+            for type_names in type_profile.get(func, []):
+                if len(type_names) < nspecialized:
+                    continue
+                unknown = [name for name in type_names[:nspecialized] if name not in profile_type_classes]
+                if unknown:
+                    not_specializable.update(unknown)
+                    continue
+                func_classes = [profile_type_classes[name] for name in type_names[:nspecialized]]
+                func_classes += [placeholder_class] * (nargs - nspecialized)
+                func_signatures.append(Signature(func_classes))
+            # the JIT references the *Profile function of every case so we can't drop a
+            # function which did not show up in the profile, use the default specializations
+            cases.append(NormalHandler(FunctionCases(func, func_signatures or signatures)))
+
+    if not_specializable:
+        # we can only guard on type objects which are part of the interpreter binary
+        print("type profile: can't specialize on types outside of the interpreter:", ", ".join(sorted(not_specializable)))
 
     # We currently don't do any specialization on the key argument for GetItem / SetItem / DelItem / IN / NOT_IN
     # so collapse all those traces into a single one
@@ -926,6 +1010,89 @@ def loadLibs():
     call_helper = call_helper_wrapper
 
 
+def _example_key(obj):
+    # repr() without memory addresses so the key is stable between runs
+    if isinstance(obj, (tuple, list)):
+        return "(%s)" % ", ".join(_example_key(x) for x in obj)
+    if isinstance(obj, (set, frozenset)):
+        # the iteration order depends on the hash seed
+        return "%s{%s}" % (type(obj).__name__, ", ".join(sorted(_example_key(x) for x in obj)))
+    if isinstance(obj, dict):
+        return "{%s}" % ", ".join(sorted("%s: %s" % (_example_key(k), _example_key(v)) for k, v in obj.items()))
+    if isinstance(obj, ctypes._SimpleCData):
+        return "%s(%r)" % (type(obj).__name__, obj.value)
+    return "%s:%s" % (type(obj).__qualname__, re.sub(r" at 0x[0-9a-fA-F]+", "", repr(obj)))
+
+class TraceCache(object):
+    """
+    Stores the traced bitcode (aot_module.<name>.bc) of every specialization
+    keyed by a hash of everything which influences the trace:
+    the CACHE_KEY_FILES, this script, the pretrace C code of the handler, the
+    training arguments and the tracing overwrites.
+    Also remembers how long every trace took so we can start the slowest first.
+    """
+
+    def __init__(self, cache_dir, key_files):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        h = hashlib.sha256()
+        h.update(b"pic" if PIC else b"nopic")
+        # the tracing and specialization logic in here
+        with open(__file__, "rb") as f:
+            h.update(f.read())
+        for fn in sorted(key_files):
+            h.update(fn.encode())
+            with open(fn, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        self.base_key = h.hexdigest()
+
+        self.durations_fn = os.path.join(cache_dir, "durations.json")
+        try:
+            with open(self.durations_fn) as f:
+                self.durations = json.load(f)
+        except (OSError, ValueError):
+            self.durations = {}
+
+    def getKey(self, name, signature, handler, pretrace_code, train_success):
+        h = hashlib.sha256()
+        for part in (self.base_key, name, type(handler).__name__, pretrace_code,
+                     repr(sorted(handler.do_not_trace + signature.do_not_trace)),
+                     repr(sorted(handler.always_trace + signature.always_trace)),
+                     _example_key(train_success)):
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".bc")
+
+    def restore(self, key, name):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, f"aot_module.{name}.bc")
+        return True
+
+    def store(self, key, name, duration):
+        self.durations[name] = duration
+        fn = f"aot_module.{name}.bc"
+        if os.path.exists(fn):
+            # copy + rename so an interrupted run can't leave a truncated file behind
+            tmp_path = self._path(key) + ".tmp"
+            shutil.copyfile(fn, tmp_path)
+            os.rename(tmp_path, self._path(key))
+
+    def estimateDuration(self, name, train_success):
+        # unknown traces are assumed to be expensive so they get started early
+        return self.durations.get(name, 1000.0 + len(train_success))
+
+    def saveDurations(self):
+        with open(self.durations_fn + ".tmp", "w") as f:
+            json.dump(self.durations, f, indent=1, sort_keys=True)
+        os.rename(self.durations_fn + ".tmp", self.durations_fn)
+
 def specialize_func(handler, header_f, profile_f, async_tracing, only=None):
     unspecialized_name = handler.case.unspecialized_name
     print(f"Generating special versions of {unspecialized_name}")
@@ -957,7 +1124,9 @@ def specialize_func(handler, header_f, profile_f, async_tracing, only=None):
             # create new jit target because we want to make sure we did not train on any error
             # TODO: could skip this if no errors happened
             target = handler.createJitTarget(target_addr, len(train_success))
-            async_tracing.append((name, signature, handler, target, copy.deepcopy(train_success)))
+            # getExamples() returned fresh copies and every work item gets traced only once
+            # so there is no need to copy the arguments again
+            async_tracing.append((name, signature, handler, target, train_success))
             traced.append((signature, name))
         else:
             num_skipped += 1
@@ -974,10 +1143,19 @@ def do_trace(work):
     if VERBOSITY >= 1:
         print("tracing", name)
 
-    for args in copy.deepcopy(train_success):
+    start = time.perf_counter()
+    for args in train_success:
         if VERBOSITY >= 1:
             print("tracing", name, "with args:", args)
         handler.trace(target, args, signature)
+    return time.perf_counter() - start
+
+# work items of trace_all_funcs(), forked tracing processes inherit this list
+# which means we only have to send an index instead of pickling the arguments
+_tracing_work = []
+
+def do_trace_idx(idx):
+    return idx, do_trace(_tracing_work[idx])
 
 def trace_all_funcs(only=None):
     total_num_gen = 0
@@ -1008,12 +1186,47 @@ def trace_all_funcs(only=None):
         total_num_gen += num_gen
         total_num_skipped += num_skipped
 
+    cache = TraceCache(CACHE_DIR, CACHE_KEY_FILES) if CACHE_DIR else None
+    keys = {}
+    if cache:
+        pretrace_code = {}
+        for handler in cases:
+            f = io.StringIO()
+            handler.writePretraceFunctions(f)
+            pretrace_code[handler] = f.getvalue()
+
+        todo = []
+        for work in async_tracing:
+            (name, signature, handler, target, train_success) = work
+            key = cache.getKey(name, signature, handler, pretrace_code[handler], train_success)
+            if not cache.restore(key, name):
+                keys[name] = key
+                todo.append(work)
+        print(f"{len(async_tracing) - len(todo)} traces are up to date, {len(todo)} need to get traced")
+        async_tracing = todo
+
+        # start the longest traces first so a slow one doesn't run alone at the end
+        async_tracing.sort(key=lambda work: -cache.estimateDuration(work[0], work[4]))
+
+    global _tracing_work
+    _tracing_work = async_tracing
+    def store_results(results):
+        for idx, duration in results:
+            name = async_tracing[idx][0]
+            if cache:
+                cache.store(keys[name], name, duration)
+
     if VERBOSITY:
-        list(map(do_trace, async_tracing))
+        store_results(map(do_trace_idx, range(len(async_tracing))))
     else:
         print("Starting multiprocess tracing...")
+        # terminates the workers if a trace fails
         with multiprocessing.pool.Pool() as tracing_pool:
-            tracing_pool.map(do_trace, async_tracing, chunksize=1)
+            store_results(tracing_pool.imap_unordered(do_trace_idx, range(len(async_tracing)), chunksize=1))
+            tracing_pool.close()
+            tracing_pool.join()
+    if cache:
+        cache.saveDurations()
 
     print(
         f'generated in total {total_num_gen} special versions skipped {total_num_skipped}')
@@ -1104,15 +1317,30 @@ if __name__ == "__main__":
     parser.add_argument("--only", action="store", default=None)
     parser.add_argument("-o", action="store", default=None)
     parser.add_argument("--pic", action="store_true", default=False)
+    parser.add_argument("--type-profile", action="store", default=None,
+                        help="only generate the specializations used in this JIT_AOT_TYPE_PROFILE output "
+                             "(which only counts the generic call sites executed by JIT compiled code)")
+    parser.add_argument("--type-profile-coverage", action="store", type=float, default=0.99,
+                        help="fraction of the profiled calls per function which should hit a specialization")
+    parser.add_argument("--cache-dir", action="store", default=None,
+                        help="reuse the traces of specializations whose inputs did not change")
+    parser.add_argument("--cache-key-files", action="store", nargs="*", default=[],
+                        help="files which invalidate all cached traces when they change")
 
     args = parser.parse_args()
     assert args.action in ("pretrace", "trace", "all")
 
+    if args.type_profile:
+        cases = loadCases(loadTypeProfile(args.type_profile, args.type_profile_coverage))
+
     if args.action in ("pretrace", "all"):
         assert args.o
         create_pre_traced_funcs(args.o)
 
     VERBOSITY = args.verbosity
+    CACHE_DIR = args.cache_dir
+    CACHE_KEY_FILES = args.cache_key_files
+    PIC = args.pic
 
     if args.action in ("trace", "all"):
         # init JIT
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+class Vec:
+    def __init__(self, x):
+        self.x = x
+
+    def __add__(self, other):
+        return Vec(self.x + other.x)
+
+def work(n):
+    t = 0
+    v = Vec(0)
+    for i in range(n):
+        t = t + i
+        v = v + Vec(i)
+    return t, v
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        work(int(sys.argv[1]))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profile = os.path.join(tmpdir, "aot_type_profile.txt")
+        # only JIT compiled code calls the profiled AOT functions: pin a low threshold
+        # so that the loop gets compiled via OSR early (make test also sets JIT_MIN_RUNS)
+        env = dict(os.environ, JIT_AOT_TYPE_PROFILE=profile, JIT_MIN_RUNS="100", JIT_OSR_MIN_RUNS="100")
+        subprocess.run([sys.executable, __file__, "3000"], env=env, check=True)
+        if not os.path.exists(profile):
+            # not running on a build with AOT specializations
+            sys.exit(0)
+
+        counts = {}
+        with open(profile) as f:
+            for line in f:
+                count, func, *type_names = line.split()
+                counts[(func, tuple(type_names))] = int(count)
+
+        # 'v + Vec(i)' goes through the generic PyNumber_Add, 't + i' uses the JIT's inline int path.
+        # Heap types get recorded with their module so aot_gen.py can tell them apart.
+        assert counts.get(("PyNumber_Add", ("__main__.Vec", "__main__.Vec")), 0) >= 2000, counts
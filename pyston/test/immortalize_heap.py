@@ -0,0 +1,45 @@
+import gc
+import os
+import sys
+import types
+
+if not hasattr(gc, "immortalize_heap"):
+    # not built with PYSTON_SPEEDUPS
+    sys.exit(0)
+
+class C:
+    attr = ["class attribute"]
+
+def f():
+    return ("function constant", 1.5)
+
+mod = types.ModuleType("immortalize_heap_test_mod")
+mod.value = {"nested": [object()]}
+sys.modules[mod.__name__] = mod
+
+if __name__ == "__main__":
+    num_objects, num_bytes = gc.immortalize_heap()
+    assert num_objects > 0 and num_bytes > num_objects, (num_objects, num_bytes)
+    assert gc.get_freeze_count() > 0
+
+    def is_immortal(o):
+        return sys.getrefcount(o) > 1 << 59
+
+    this_module = sys.modules[__name__]
+    assert is_immortal(this_module)
+    assert is_immortal(C) and is_immortal(C.attr)
+    assert is_immortal(f) and is_immortal(f()) and is_immortal(f()[0])
+    assert is_immortal(mod.value["nested"][0])
+
+    # a second call only counts the new objects
+    mod.new_value = [object()]
+    num_objects, num_bytes = gc.immortalize_heap()
+    assert 2 <= num_objects < 100, num_objects
+    assert is_immortal(mod.new_value[0])
+
+    if hasattr(os, "fork"):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if is_immortal(C) else 1)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0, status
@@ -0,0 +1,93 @@
+import marshal
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# runs in the child: imports 'mod_a' and prints whether the module directory got listed
+CHILD = """
+import posix, sys
+listed = []
+real_listdir = posix.listdir
+def listdir(path):
+    listed.append(path)
+    return real_listdir(path)
+posix.listdir = listdir
+sys.path.insert(0, sys.argv[1])
+import {module}
+print({module}.value, sys.argv[1] in listed)
+"""
+
+def run(env, moddir, module):
+    out = subprocess.run([sys.executable, "-c", CHILD.format(module=module), moddir], env=env,
+                         stdout=subprocess.PIPE, check=True).stdout.decode().split()
+    return int(out[0]), out[1] == "True"
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moddir = os.path.join(tmpdir, "mods")
+        os.mkdir(moddir)
+        with open(os.path.join(moddir, "mod_a.py"), "w") as f:
+            f.write("value = 1\n")
+        index = os.path.join(tmpdir, "import_index")
+        env = dict(os.environ, PYSTON_IMPORT_INDEX=index)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+        def age(path):
+            # listings of directories modified in the last seconds are not trusted
+            old = time.time() - 10
+            os.utime(path, (old, old))
+
+        def indexed_dirs():
+            with open(index, "rb") as f:
+                version, dirs = marshal.loads(f.read())
+            return dirs
+
+        # the first run writes the bytecode cache so the directory is too new to be stored
+        age(moddir)
+        assert run(env, moddir, "mod_a") == (1, True)
+        assert moddir not in indexed_dirs()
+
+        age(moddir)
+        assert run(env, moddir, "mod_a") == (1, True)
+        dirs = indexed_dirs()
+        assert moddir in dirs, dirs
+        assert "mod_a.py" in dirs[moddir][2]
+
+        # second run finds the module without listing the directory
+        assert run(env, moddir, "mod_a") == (1, False)
+
+        # adding a module changes the mtime and makes the entry stale
+        with open(os.path.join(moddir, "mod_b.py"), "w") as f:
+            f.write("value = 2\n")
+        assert run(env, moddir, "mod_b") == (2, True)
+        age(moddir)
+        assert run(env, moddir, "mod_b") == (2, True)
+        assert run(env, moddir, "mod_b") == (2, False)
+
+        # directories which are gone get dropped
+        otherdir = os.path.join(tmpdir, "other")
+        os.mkdir(otherdir)
+        with open(os.path.join(otherdir, "mod_c.py"), "w") as f:
+            f.write("value = 3\n")
+        os.mkdir(os.path.join(otherdir, "__pycache__"))
+        age(otherdir)
+        assert run(env, otherdir, "mod_c") == (3, True)
+        assert otherdir in indexed_dirs()
+        shutil.rmtree(otherdir)
+        assert run(env, moddir, "mod_a") == (1, False)
+        # nothing new got listed, so the index is not written
+        assert otherdir in indexed_dirs()
+        with open(os.path.join(moddir, "mod_d.py"), "w") as f:
+            f.write("value = 4\n")
+        assert run(env, moddir, "mod_d") == (4, True)
+        assert otherdir not in indexed_dirs()
+
+        # a corrupt index is ignored and replaced
+        age(moddir)
+        with open(index, "wb") as f:
+            f.write(b"garbage")
+        assert run(env, moddir, "mod_a") == (1, True)
+        assert run(env, moddir, "mod_a") == (1, False)
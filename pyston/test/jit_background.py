@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import time
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def f(x):
+    return x + 1
+
+def g(x):
+    return x - 1
+
+def cross_threshold(func):
+    for i in range(jit.get_config()["min_runs"] // 10 + 2):
+        func(i)
+
+def wait_until_compiled(func, timeout=30):
+    # the compiler thread needs the GIL, sleeping releases it
+    deadline = time.monotonic() + timeout
+    while not jit.is_compiled(func) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return jit.is_compiled(func)
+
+# queues many functions and exits right away: the compiler thread gets stopped at exit
+EXIT_WHILE_BUSY = """
+from pyston import jit
+jit.set_config(min_runs=1000, background=True)
+for i in range(200):
+    ns = {}
+    exec("def f(x):\\n    return x + %d\\n" % i, ns)
+    for j in range(200):
+        ns["f"](j)
+"""
+
+if __name__ == "__main__":
+    # pin the threshold: make test also runs us with JIT_MIN_RUNS=0 and 9999999999
+    config = jit.get_config()
+    jit.set_config(min_runs=1000, background=True)
+    assert jit.get_config()["background"]
+
+    cross_threshold(f)
+    assert wait_until_compiled(f)
+    assert f(1) == 2
+
+    stats = jit.stats()["background"]
+    assert stats["num_compiled"] >= 1, stats
+    assert stats["queue_len_max"] >= 1, stats
+    assert stats["latency_us_max"] > 0, stats
+
+    # functions which are still queued when the process forks get compiled in the child too.
+    # The compiler thread only gets the GIL once we wait for it, so 'g' is usually still queued
+    # at the fork. If it already got compiled the child inherits the machine code instead.
+    if hasattr(os, "fork"):
+        cross_threshold(g)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if wait_until_compiled(g) else 1)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0, status
+
+    subprocess.run([sys.executable, "-c", EXIT_WHILE_BUSY], check=True, timeout=60)
+
+    jit.set_config(**config)
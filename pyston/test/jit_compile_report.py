@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import tempfile
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def f(x):
+    return x + 1
+
+def g(x):
+    return x * 2
+
+if __name__ == "__main__":
+    assert jit.compile(f)
+    assert not [e for e in jit.compile_report() if e["name"] == "f"]
+
+    jit.set_config(report=1)
+    assert jit.compile(g)
+    for i in range(100):
+        g(i)
+
+    entries = [e for e in jit.compile_report() if e["name"] == "g"]
+    assert len(entries) == 1, entries
+    e = entries[0]
+    assert e["filename"] == __file__, e
+    assert e["firstlineno"] == g.__code__.co_firstlineno, e
+    assert e["compiled"], e
+    assert e["bytecode_size"] == len(g.__code__.co_code), e
+    assert e["code_size"] > 0, e
+    assert e["compile_time_us"] >= 0, e
+    assert e["entries"] >= 100, e
+    assert e["osr_entries"] == 0, e
+
+    # recompiling the same function reuses its entry
+    source = "def h(x):\n    return x - 1\n"
+    for i in range(3):
+        ns = {}
+        exec(source, ns)
+        assert jit.compile(ns["h"])
+        ns["h"](i)
+    entries = [e for e in jit.compile_report() if e["name"] == "h"]
+    assert len(entries) == 1, entries
+    assert entries[0]["entries"] == 3, entries
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "report.json")
+        jit.dump_compile_report(path)
+        with open(path) as fp:
+            assert [e for e in json.load(fp) if e["name"] == "g"]
@@ -0,0 +1,77 @@
+import gc
+import os
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def make_func(i):
+    ns = {}
+    exec("def cold_%d(x):\n    return x + %d\n" % (i, i), ns)
+    return ns["cold_%d" % i]
+
+def hot(x):
+    return x * 2
+
+def outer():
+    # runs compiled while the eviction happens so it has to be kept
+    assert jit.compile(hot)
+    return jit.is_compiled(outer)
+
+if __name__ == "__main__":
+    config = jit.get_config()
+    jit.set_config(evict_cold=1)
+    assert jit.get_config()["evict_cold"] == 1
+
+    assert jit.compile(outer)
+    cold_funcs = [make_func(i) for i in range(20)]
+    for f in cold_funcs:
+        assert jit.compile(f)
+
+    # blacklisted code must neither get evicted nor un-blacklisted, even if the function died
+    dead = make_func(100)
+    assert jit.compile(dead)
+    jit.blacklist(dead)
+    del dead
+    gc.collect() # the function and its globals dict form a cycle
+    blacklisted = make_func(101)
+    assert jit.compile(blacklisted)
+    jit.blacklist(blacklisted)
+
+    stats = jit.stats()
+    # no room left for 'hot'
+    jit.set_config(max_mem=stats["mem_bytes_used"])
+    assert outer()
+    assert jit.is_compiled(hot)
+    assert hot(2) == 4
+
+    new_stats = jit.stats()
+    assert new_stats["num_funcs_evicted"] > stats["num_funcs_evicted"], new_stats
+    assert new_stats["mem_bytes_used"] <= stats["mem_bytes_used"], new_stats
+    evicted = [f for f in cold_funcs if not jit.is_compiled(f)]
+    assert evicted
+    # evicted functions continue to work in the interpreter and can get compiled again
+    assert evicted[0](1) == int(evicted[0].__name__.split("_")[1]) + 1
+    assert jit.compile(evicted[0])
+    assert not jit.compile(blacklisted)
+    assert blacklisted(1) == 102
+
+    # a forked child sharing the code of the parent must not evict it, that would not free anything
+    if hasattr(os, "fork"):
+        jit.set_config(share_forked_code=1)
+        pid = os.fork()
+        if pid == 0:
+            inherited = jit.stats()["mem_bytes_used"]
+            jit.set_config(max_mem=inherited)
+            new_func = make_func(200)
+            jit.compile(new_func)
+            stats = jit.stats()
+            ok = stats["mem_bytes_inherited"] == inherited and jit.is_compiled(hot)
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0, status
+
+    jit.set_config(**config)
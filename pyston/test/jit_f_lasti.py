@@ -0,0 +1,32 @@
+# The JIT skips the f_lasti update for some opcodes.
+# Make sure line numbers in tracebacks and of inspected frames stay correct.
+import sys
+
+def lineno():
+    return sys._getframe(1).f_lineno
+
+def f(n, raise_error):
+    if not raise_error:
+        x = 1
+    l = []
+    for i in range(n):
+        y = i; l.append(lineno()); z = x + y
+    return l
+
+def g(n):
+    return [lineno() for i in range(n)]
+
+if __name__ == "__main__":
+    first_line = f.__code__.co_firstlineno
+    for i in range(3000):
+        assert f(2, False) == [first_line + 5] * 2
+        assert g(1) == [g.__code__.co_firstlineno + 1]
+
+    try:
+        f(2, True)
+        assert 0, "should have raised"
+    except UnboundLocalError:
+        tb = sys.exc_info()[2]
+        while tb.tb_next:
+            tb = tb.tb_next
+        assert tb.tb_lineno == first_line + 5, tb.tb_lineno
@@ -0,0 +1,61 @@
+import asyncio
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def gen(n):
+    for i in range(n):
+        yield i
+
+async def step(x):
+    await asyncio.sleep(0)
+    return x + 1
+
+async def coro(n):
+    total = 0
+    for i in range(n):
+        total += await step(i)
+    return total
+
+async def many_awaits():
+    # no loop, so only the resumes make it hot
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    return 1
+
+if __name__ == "__main__":
+    # pin the threshold: make test also runs us with JIT_MIN_RUNS=9999999999
+    config = jit.get_config()
+    jit.set_config(min_runs=1000)
+
+    assert jit.compile(gen)
+    g = gen(100)
+    next(g)
+    stats = jit.stats()
+    assert sum(g) == sum(range(1, 100))
+    new_stats = jit.stats()
+    # 99 values plus the final resume which raises StopIteration
+    assert new_stats["gen_resumes_native"] - stats["gen_resumes_native"] == 100, new_stats
+    assert new_stats["gen_resumes"] - stats["gen_resumes"] == 100, new_stats
+
+    assert jit.compile(coro) and jit.compile(step)
+    stats = jit.stats()
+    assert asyncio.run(coro(100)) == sum(range(1, 101))
+    new_stats = jit.stats()
+    assert new_stats["gen_resumes_native"] - stats["gen_resumes_native"] >= 200, new_stats
+
+    async def run_many_awaits():
+        # every call adds 10 and every resume 1, so this crosses min_runs well before the end
+        for i in range(1000):
+            await many_awaits()
+            if jit.is_compiled(many_awaits):
+                return True
+        return False
+    assert asyncio.run(run_many_awaits())
+
+    jit.set_config(**config)
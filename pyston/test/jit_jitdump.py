@@ -0,0 +1,51 @@
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+
+def hot(x):
+    return x + 1
+
+def hot_été(x):
+    return x + 2
+
+def read_code_load_names(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, header_size = struct.unpack_from("III", data)
+    assert magic == 0x4A695444 and version == 1, (magic, version)
+
+    names = []
+    pos = header_size
+    while pos < len(data):
+        record_id, record_size = struct.unpack_from("II", data, pos)
+        if record_id == 0: # JIT_CODE_LOAD
+            name_start = pos + 56
+            names.append(data[name_start:data.index(b"\0", name_start)].decode())
+        pos += record_size
+    assert pos == len(data)
+    return names
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for i in range(3000):
+            hot(i)
+            hot_été(i)
+        sys.exit(0)
+
+    try:
+        from pyston import jit
+    except ImportError:
+        # not running on a JIT enabled build
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # pin the threshold: make test also runs us with JIT_MIN_RUNS=9999999999
+        env = dict(os.environ, JIT_PERF_JITDUMP=tmpdir, JIT_MIN_RUNS="1000")
+        p = subprocess.Popen([sys.executable, __file__, "child"], env=env)
+        assert p.wait() == 0
+        names = read_code_load_names(os.path.join(tmpdir, "jit-%d.dump" % p.pid))
+        assert [n for n in names if n.endswith(":hot")], names
+        # names are UTF-8
+        assert [n for n in names if n.endswith(":hot_été")], names
@@ -0,0 +1,94 @@
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+classes = [type("C%d" % i, (), {"__init__": lambda self: setattr(self, "x", 1)}) for i in range(20)]
+
+def get_x(o):
+    return o.x
+
+def get_y(o):
+    return o.y
+
+def get_m(o):
+    return o.m
+
+def make_objs(attr):
+    # many instances per type, each with its own non split dict
+    objs = []
+    for c in classes:
+        for i in range(5):
+            o = c()
+            o.__dict__ = {attr: 1}
+            objs.append(o)
+    return objs
+
+def site(func):
+    sites = jit.ic_sites(func)
+    assert len(sites) == 1, sites
+    return sites[0]
+
+if __name__ == "__main__":
+    # pin the threshold: make test also runs us with JIT_MIN_RUNS=0 and 9999999999
+    config = jit.get_config()
+    jit.set_config(min_runs=1000)
+
+    # start out monomorphic and get JIT compiled
+    o = classes[0]()
+    for i in range(3000):
+        assert get_x(o) == 1
+    assert jit.is_compiled(get_x)
+    assert site(get_x)["kind"] == "monomorphic", site(get_x)
+
+    # a few more types make it polymorphic even though it's already compiled
+    objs = [c() for c in classes[:3]]
+    for i in range(100):
+        for o in objs:
+            assert get_x(o) == 1
+    assert site(get_x)["kind"] == "polymorphic", site(get_x)
+
+    # too many types for the polymorphic cache: switches to the global megamorphic cache
+    objs = [c() for c in classes]
+    for i in range(100):
+        for o in objs:
+            assert get_x(o) == 1
+    s = site(get_x)
+    assert s["kind"] == "megamorphic", s
+    misses = s["misses"]
+    assert misses < 100 * len(objs) // 2, s
+
+    # once all types are in the global cache there are no more misses
+    for o in objs:
+        assert get_x(o) == 1
+    assert site(get_x)["misses"] == misses, site(get_x)
+    assert jit.stats()["megamorphic_cache_hit"] > 0
+
+    # instance attributes in non split dicts are cached per type, not per instance
+    objs = make_objs("y")
+    for i in range(100):
+        for o in objs:
+            assert get_y(o) == 1
+    s = site(get_y)
+    assert s["kind"] == "megamorphic", s
+    misses = s["misses"]
+    for o in objs:
+        assert get_y(o) == 1
+    assert site(get_y)["misses"] == misses, site(get_y)
+
+    # type attributes can't be cached for instances with a non split dict:
+    # the site stops missing (and refilling the global cache) instead of thrashing
+    for c in classes:
+        c.m = 1
+    objs = make_objs("z")
+    for i in range(100):
+        for o in objs:
+            assert get_m(o) == 1
+    s = site(get_m)
+    assert s["misses"] < 200, s
+
+    jit.set_config(**config)
+
@@ -0,0 +1,34 @@
+import os
+import re
+import subprocess
+import sys
+
+# JIT compiles many short lived functions.
+# With a JIT memory limit which only fits a few functions we will only keep
+# compiling if the machine code of dead functions gets reused.
+def compile_many_funcs(n):
+    for i in range(n):
+        g = {}
+        exec("""def f(x):
+                    return x + 1""", g)
+        for j in range(3000):
+            g["f"](j)
+        del g
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        compile_many_funcs(int(sys.argv[1]))
+        sys.exit(0)
+
+    # pin the threshold: make test also runs us with JIT_MIN_RUNS=9999999999
+    env = dict(os.environ, JIT_MAX_MEM="20000", JIT_SHOW_STATS="1", JIT_MIN_RUNS="1000")
+    out = subprocess.run([sys.executable, __file__, "500"], env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+
+    m = re.search(r"successfully compiled (\d+) functions", out)
+    if m is None:
+        # not running on a JIT enabled build
+        sys.exit(0)
+    assert int(m.group(1)) >= 500, out
+
+    m = re.search(r"freed code of (\d+) functions", out)
+    assert m and int(m.group(1)) > 0, out
@@ -0,0 +1,71 @@
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def f(x):
+    return x + 1
+
+def g(x):
+    return x * 2
+
+def h(x):
+    return x - 1
+
+def blacklist_self():
+    jit.blacklist(blacklist_self)
+    return jit.stats()["num_funcs_freed"]
+
+if __name__ == "__main__":
+    assert not jit.is_compiled(f)
+    assert jit.compile(f)
+    assert jit.is_compiled(f)
+    assert jit.is_compiled(f.__code__)
+    assert f(1) == 2
+
+    jit.blacklist(g)
+    for i in range(10000):
+        assert g(i) == i * 2
+    assert not jit.is_compiled(g)
+    assert not jit.compile(g)
+
+    # blacklisting frees the machine code, right away if it's not executing
+    freed = jit.stats()["num_funcs_freed"]
+    jit.blacklist(f)
+    assert not jit.is_compiled(f)
+    assert f(1) == 2
+    assert jit.stats()["num_funcs_freed"] == freed + 1
+
+    # otherwise once the frame returned
+    assert jit.compile(blacklist_self)
+    freed = jit.stats()["num_funcs_freed"]
+    assert blacklist_self() == freed
+    assert not jit.is_compiled(blacklist_self)
+    assert jit.compile(h)
+    assert jit.stats()["num_funcs_freed"] == freed + 1
+
+    stats = jit.stats()
+    assert stats["num_funcs"] >= 1, stats
+    assert stats["mem_bytes_used"] > 0, stats
+
+    config = jit.get_config()
+    jit.set_config(min_runs=100)
+    assert jit.get_config()["min_runs"] == 100
+    assert jit.get_config()["opcache_min_runs"] <= 50
+    jit.set_config(**config)
+    assert jit.get_config() == config
+
+    try:
+        jit.set_config(not_a_setting=1)
+        assert 0, "should have raised"
+    except TypeError:
+        pass
+
+    try:
+        jit.compile(1)
+        assert 0, "should have raised"
+    except TypeError:
+        pass
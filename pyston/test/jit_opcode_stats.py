@@ -0,0 +1,85 @@
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+class A:
+    def __init__(self, x):
+        self.x = x
+
+class B:
+    def __init__(self, x):
+        self.x = x
+
+def get_x(o):
+    return o.x
+
+def add(a, b):
+    return a + b
+
+def offset_of(func, opname):
+    import dis
+    return [i.offset for i in dis.get_instructions(func) if i.opname == opname][0]
+
+if __name__ == "__main__":
+    # pin the threshold: make test also runs us with JIT_MIN_RUNS=9999999999
+    config = jit.get_config()
+    jit.set_config(min_runs=1000)
+
+    # warm up so that the functions are JIT compiled: they have to get counted anyway
+    for i in range(10000):
+        get_x(A(i))
+        add(i, i)
+    assert jit.is_compiled(get_x)
+
+    jit.reset_opcode_stats()
+    jit.enable_opcode_stats(types=True)
+    for i in range(100):
+        get_x(A(i))
+    for i in range(100):
+        get_x(A(i) if i % 2 else B(i))
+    for i in range(50):
+        add(i, i)
+        add(1.0, i)
+    jit.disable_opcode_stats()
+
+    stats = jit.opcode_stats()
+    la = stats[get_x.__code__][offset_of(get_x, "LOAD_ATTR")]
+    assert la["opname"] == "LOAD_ATTR"
+    assert la["count"] == 200, la
+    assert la["hits"] + la["misses"] + la["unoptimized"] + la["no_opcache"] + la["uncached"] == 200, la
+    assert la["types"] == {(A,): 150, (B,): 50}, la
+
+    ba = stats[add.__code__][offset_of(add, "BINARY_ADD")]
+    assert ba["count"] == 100, ba
+    assert ba["types"] == {(int, int): 50, (float, int): 50}, ba
+    assert "hits" not in ba
+
+    # nothing gets counted while disabled
+    get_x(A(1))
+    assert jit.opcode_stats()[get_x.__code__][offset_of(get_x, "LOAD_ATTR")]["count"] == 200
+
+    jit.reset_opcode_stats()
+    assert get_x.__code__ not in jit.opcode_stats()
+    assert jit.is_compiled(get_x)
+
+    # resetting while enabled: dropping the code objects can run Python code which records new stats
+    import weakref
+    ns = {}
+    exec("def temp(a):\n    return a + 1\n", ns)
+    temp = ns.pop("temp")
+    jit.enable_opcode_stats()
+    temp(1)
+    ref = weakref.ref(temp.__code__, lambda ref: add(1, 2))
+    del temp, ns
+    # the stats hold the last reference to the code object
+    assert ref() is not None
+    jit.reset_opcode_stats()
+    jit.disable_opcode_stats()
+    assert ref() is None
+    assert jit.opcode_stats()[add.__code__][offset_of(add, "BINARY_ADD")]["count"] == 1
+
+    jit.set_config(**config)
@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def loop(n):
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+if __name__ == "__main__":
+    config = jit.get_config()
+    assert config["osr_min_runs"] == config["min_runs"], config
+
+    # pin min_runs: with JIT_MIN_RUNS=0 (which make test also uses) the function would
+    # get compiled on entry and never needs OSR
+    jit.set_config(min_runs=100000, osr_min_runs=500)
+    assert jit.get_config()["osr_min_runs"] == 500
+    assert jit.get_config()["opcache_min_runs"] <= 250
+
+    # a function which only gets called once gets compiled in the middle of its loop
+    stats = jit.stats()
+    assert loop(10000) == sum(range(10000))
+    assert jit.is_compiled(loop)
+    new_stats = jit.stats()
+    assert new_stats["osr_compiles"] == stats["osr_compiles"] + 1, new_stats
+    assert new_stats["osr_entries"] == stats["osr_entries"] + 1, new_stats
+
+    jit.set_config(**config)
+    assert jit.get_config() == config
+
+    # same for a loop in a module body
+    env = dict(os.environ, JIT_MIN_RUNS="100000", JIT_OSR_MIN_RUNS="500", JIT_SHOW_STATS="1")
+    out = subprocess.run([sys.executable, "-c", "t = 0\nfor i in range(10000):\n    t += i\nassert t == 49995000\n"],
+                         env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+    m = re.search(r"compiled (\d+) functions because of a hot loop, entered (\d+) loops via OSR", out)
+    assert m and int(m.group(1)) >= 1 and int(m.group(2)) >= 1, out
@@ -0,0 +1,71 @@
+import os
+import sys
+import traceback
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def warm(x):
+    return x + 1
+
+def cold(x):
+    return x - 1
+
+def later(x):
+    return x * 2
+
+def listed(x):
+    return x // 2
+
+def make_warm(func):
+    for i in range(jit.get_config()["opcache_min_runs"] // 10 + 1):
+        func(i)
+    assert not jit.is_compiled(func)
+    assert jit.run_count(func) >= jit.get_config()["opcache_min_runs"]
+
+def run_in_child(check):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = check()
+        except BaseException:
+            traceback.print_exc()
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    return status == 0
+
+def prefork_warmup():
+    jit.enable_prefork_warmup()
+    make_warm(warm)
+    cold(0)
+    # the child inherits the machine code compiled by the parent
+    assert run_in_child(lambda: jit.is_compiled(warm) and not jit.is_compiled(cold))
+    assert jit.is_compiled(warm)
+
+    # functions which got warm since the last fork get compiled by the next one
+    make_warm(later)
+    assert run_in_child(lambda: jit.is_compiled(later))
+
+    # an iterator gets turned into a list once and used for every fork
+    jit.enable_prefork_warmup(iter([listed]))
+    assert run_in_child(lambda: jit.is_compiled(listed))
+    return True
+
+if __name__ == "__main__" and hasattr(os, "fork"):
+    # pin the thresholds: make test also runs us with JIT_MIN_RUNS=0 and 9999999999
+    config = jit.get_config()
+    jit.set_config(min_runs=1000, opcache_min_runs=100)
+
+    # the at-fork hooks can't be unregistered, so install them in a child process
+    assert run_in_child(prefork_warmup)
+    assert not jit.is_compiled(warm)
+
+    # explicitly listed functions get compiled independent of their run count
+    assert jit.warmup([cold]) == 1
+    assert jit.is_compiled(cold)
+
+    jit.set_config(**config)
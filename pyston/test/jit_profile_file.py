@@ -0,0 +1,40 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+def hot(x):
+    return x + 1
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for i in range(int(sys.argv[1])):
+            hot(i)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profile = os.path.join(tmpdir, "jit_profile.txt")
+        # pin the threshold: make test also runs us with JIT_MIN_RUNS=0 and 9999999999
+        env = dict(os.environ, JIT_PROFILE_FILE=profile, JIT_SHOW_STATS="1", JIT_MIN_RUNS="1000")
+        def run(num_calls):
+            return subprocess.run([sys.executable, __file__, str(num_calls)], env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+
+        # first run: 'hot' gets compiled the normal way and recorded in the profile
+        out = run(3000)
+        if "successfully compiled" not in out:
+            # not running on a JIT enabled build
+            sys.exit(0)
+        with open(profile) as f:
+            assert " hot" in f.read()
+
+        # second run: only a few calls are needed because the profile marks it as hot
+        out = run(10)
+        m = re.search(r"profile file lists (\d+) functions, (\d+) of them got executed", out)
+        assert m and int(m.group(1)) >= 1 and int(m.group(2)) >= 1, out
+        m = re.search(r"successfully compiled (\d+) functions", out)
+        assert int(m.group(1)) >= 1, out
+
+        # the profile does not grow if the same functions get compiled again
+        with open(profile) as f:
+            assert f.read().count(" hot") == 1
@@ -0,0 +1,58 @@
+import gc
+import os
+import sys
+
+try:
+    from pyston import jit
+except ImportError:
+    # not running on a JIT enabled build
+    sys.exit(0)
+
+def parent_func(x):
+    return x + 1
+
+def make_func():
+    # not referenced from the co_consts of this module so the code object can die
+    ns = {}
+    exec("def temp_func(x):\n    return x * 2\n", ns)
+    return ns["temp_func"]
+
+def child_func(x):
+    return x - 1
+
+if __name__ == "__main__" and hasattr(os, "fork"):
+    jit.set_config(share_forked_code=1)
+    assert jit.get_config()["share_forked_code"] == 1
+    assert jit.compile(parent_func)
+    temp_func = make_func()
+    assert jit.compile(temp_func)
+    other_temp_func = make_func()
+    assert jit.compile(other_temp_func)
+    assert jit.stats()["mem_bytes_inherited"] == 0
+
+    pid = os.fork()
+    if pid == 0:
+        ok = jit.compile(child_func) and child_func(1) == 0 and parent_func(1) == 2
+        # the child emitted its code into a fresh chunk, all code compiled before the fork counts as inherited
+        ok = ok and jit.stats()["mem_bytes_inherited"] > 0
+        # freeing inherited code must not touch the shared memory
+        inherited = jit.stats()["mem_bytes_inherited"]
+        del temp_func
+        gc.collect() # the function and its globals dict form a cycle
+        ok = ok and jit.stats()["mem_bytes_inherited"] < inherited and parent_func(1) == 2
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0, status
+    assert jit.stats()["mem_bytes_inherited"] == 0
+
+    # the first JIT memory event in the child is a free: the freed code must only get subtracted once
+    pid = os.fork()
+    if pid == 0:
+        del other_temp_func
+        gc.collect()
+        stats = jit.stats()
+        # the child did not compile anything itself so all used memory is inherited
+        ok = stats["mem_bytes_inherited"] == stats["mem_bytes_used"] > 0
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0, status
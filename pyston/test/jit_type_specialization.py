@@ -0,0 +1,57 @@
+# Exercises the guarded fast paths the JIT emits based on the types the interpreter observed:
+# unboxed int/float arithmetic, list/tuple indexing with an int variable and inlined len().
+# Every function first runs with the profiled types and afterwards with types which fail the guards.
+
+def arith(a, b):
+    return (a + b) * (a - b) + a * 2
+
+def index_sum(l):
+    s = 0
+    for i in range(len(l)):
+        s += l[i]
+    return s
+
+def index(l, i):
+    return l[i]
+
+def length(x):
+    return len(x)
+
+class List(list):
+    def __len__(self):
+        return 42
+
+if __name__ == "__main__":
+    for i in range(5000):
+        assert arith(i, 3) == (i + 3) * (i - 3) + i * 2
+        assert arith(i + 0.5, 1.5) == (i + 2.0) * (i - 1.0) + (i + 0.5) * 2
+        assert index_sum([1, 2, 3]) == 6
+        assert index_sum((1, 2, 3)) == 6
+        assert index([4, 5, 6], i % 3) == [4, 5, 6][i % 3]
+        assert length([1] * (i % 5)) == i % 5
+        assert length((1, 2)) == 2
+
+    # multi digit ints, mixed types and subclasses have to take the generic path
+    assert arith(2**40, 1) == (2**40 + 1) * (2**40 - 1) + 2**41
+    assert arith(-2**31, -2**31) == -2**32
+    assert arith(1, 0.5) == 1.5 * 0.5 + 2
+    assert arith(1.5, 2) == 3.5 * -0.5 + 3.0
+    assert index_sum([1.5, 2.5]) == 4.0
+    assert index([1, 2, 3], -1) == 3
+    assert index((1, 2, 3), True) == 2
+    assert index({5: "x"}, 5) == "x"
+    try:
+        index([1, 2, 3], 3)
+        assert 0, "should have raised"
+    except IndexError:
+        pass
+    try:
+        index([1, 2, 3], 2**40)
+        assert 0, "should have raised"
+    except IndexError:
+        pass
+    assert length("abc") == 3
+    assert length(List()) == 42
+
+    len = lambda x: -1
+    assert length([1, 2]) == -1
@@ -0,0 +1,84 @@
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+
+FILES = {
+    "lazy_mod.py": "import sys\nsys.executed.append(__name__)\nvalue = 1\n",
+    "lazy_broken.py": "import sys\nsys.executed.append(__name__)\n1 / 0\n",
+    "lazy_pkg/__init__.py": "import sys\nsys.executed.append(__name__)\npkg_value = 2\n",
+    "lazy_pkg/sub.py": "import sys\nsys.executed.append(__name__)\nsub_value = 3\n",
+    "eager_mod.py": "import sys\nsys.executed.append(__name__)\n",
+}
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, source in FILES.items():
+            path = os.path.join(tmpdir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(source)
+        sys.path.insert(0, tmpdir)
+        sys.executed = []
+        importlib.util.set_lazy_imports(["lazy_mod", "lazy_broken", "lazy_pkg"])
+
+        import lazy_mod, eager_mod
+        assert sys.executed == ["eager_mod"], sys.executed
+        # the attributes set by the import system don't execute the module
+        assert lazy_mod.__name__ == "lazy_mod" and lazy_mod.__spec__.name == "lazy_mod"
+        import lazy_mod
+        assert sys.executed == ["eager_mod"], sys.executed
+        assert lazy_mod.value == 1
+        assert sys.executed == ["eager_mod", "lazy_mod"], sys.executed
+        assert "__getattr__" not in vars(lazy_mod)
+
+        # a 'from' import executes the module
+        del sys.executed[:]
+        import lazy_pkg
+        assert sys.executed == []
+        from lazy_pkg import pkg_value
+        assert pkg_value == 2 and sys.executed == ["lazy_pkg"], sys.executed
+
+        # submodules are covered by the package entry, the package itself runs first
+        del sys.executed[:]
+        del sys.modules["lazy_pkg"]
+        import lazy_pkg.sub
+        assert sys.executed == ["lazy_pkg"], sys.executed
+        assert lazy_pkg.sub.sub_value == 3
+        assert sys.executed == ["lazy_pkg", "lazy_pkg.sub"], sys.executed
+
+        # errors show up on the first attribute access and the import can be retried
+        import lazy_broken
+        try:
+            lazy_broken.anything
+        except ZeroDivisionError:
+            pass
+        else:
+            assert False, "expected ZeroDivisionError"
+        assert "lazy_broken" not in sys.modules
+
+        # reloading a module which was never executed runs its body once
+        del sys.executed[:]
+        del sys.modules["lazy_mod"]
+        import lazy_mod
+        importlib.reload(lazy_mod)
+        assert lazy_mod.value == 1 and sys.executed == ["lazy_mod"], sys.executed
+
+        importlib.util.set_lazy_imports(None)
+        del sys.modules["lazy_mod"]
+        import lazy_mod
+        assert sys.executed == ["lazy_mod", "lazy_mod"], sys.executed
+
+        # command line option, -X importtime reports the deferred executions
+        code = "import sys; sys.executed = []; import lazy_mod; print(sys.executed); lazy_mod.value"
+        env = dict(os.environ, PYTHONPATH=tmpdir)
+        out = subprocess.run([sys.executable, "-X", "importtime", "-X", "lazy_imports=lazy_mod", "-c", code],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        assert out.stdout.decode().strip() == "[]", out.stdout
+        assert "| lazy_mod (deferred)" in out.stderr.decode(), out.stderr
+
+        env["PYSTON_LAZY_IMPORTS"] = "lazy_mod"
+        out = subprocess.run([sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, check=True)
+        assert out.stdout.decode().strip() == "[]", out.stdout
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from pyston import profiler
+
+def hot(n):
+    t = 0
+    for i in range(n):
+        t += i
+    return t
+
+def cold():
+    return 1
+
+def spin(stop):
+    while not stop.is_set():
+        hot(1000)
+
+if __name__ == "__main__":
+    profiler.start(interval=0.001)
+    assert profiler.is_running()
+    for i in range(200):
+        hot(10000)
+        cold()
+    profiler.stop()
+    assert not profiler.is_running()
+
+    n = profiler.num_samples()
+    assert n > 10, n
+    lines = profiler.collapsed_stacks()
+    assert sum(int(l.rsplit(" ", 1)[1]) for l in lines) == n
+    hot_line = hot.__code__.co_firstlineno + 3
+    hot_samples = sum(int(l.rsplit(" ", 1)[1]) for l in lines
+                      if (" (%s:%d)" % (__file__, hot_line)) in l.rsplit(" ", 1)[0].split(";")[-1]
+                      or ("hot (%s:%d)" % (__file__, hot_line + 1)) in l)
+    assert hot_samples > n // 2, lines
+    assert all(l.startswith("<module> (") for l in lines), lines
+    assert not any("_handler" in l for l in lines), lines
+
+    # samples stop being collected after stop()
+    hot(100000)
+    assert profiler.num_samples() == n
+
+    for l in profiler.collapsed_stacks(by_offset=True):
+        assert "hot (%s:%d+" % (__file__, hot.__code__.co_firstlineno) in l or "<module>" in l, l
+
+    profiler.reset()
+    assert profiler.num_samples() == 0
+
+    # other threads show up if all_threads is set
+    stop = threading.Event()
+    t = threading.Thread(target=spin, args=(stop,))
+    t.start()
+    profiler.start(interval=0.001, all_threads=True)
+    for i in range(100):
+        hot(10000)
+    profiler.stop()
+    stop.set()
+    t.join()
+    assert any(l.split(";")[-2:-1] == ["spin (%s:%d)" % (__file__, spin.__code__.co_firstlineno + 2)] for l in profiler.collapsed_stacks()), profiler.collapsed_stacks()
+
+    # command line interface
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script = os.path.join(tmpdir, "script.py")
+        out = os.path.join(tmpdir, "out.txt")
+        with open(script, "w") as f:
+            f.write("import sys\nt = 0\nfor i in range(int(sys.argv[1])):\n    t += i\n")
+        subprocess.run([sys.executable, "-m", "pyston.profiler", "-o", out, script, "3000000"], check=True, stderr=subprocess.DEVNULL)
+        with open(out) as f:
+            lines = f.read().splitlines()
+        assert lines and all(l.startswith("<module> (%s:" % script) for l in lines), lines
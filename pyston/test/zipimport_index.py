@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+import zipimport
+
+# runs in the child: imports 'zmod' from the archive and prints whether the
+# central directory got parsed
+CHILD = """
+import sys, zipimport
+parsed = []
+real_read_directory = zipimport._read_directory
+def read_directory(archive):
+    parsed.append(archive)
+    return real_read_directory(archive)
+zipimport._read_directory = read_directory
+sys.path.insert(0, sys.argv[1])
+import zmod, zpkg.sub
+print(zmod.value, zpkg.sub.value, bool(parsed))
+"""
+
+def write_archive(path, value):
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("zmod.py", "value = %d\n" % value)
+        z.writestr("zpkg/", "")
+        z.writestr("zpkg/__init__.py", "")
+        z.writestr("zpkg/sub.py", "value = %d\n" % (value + 1))
+
+def run(env, archive):
+    out = subprocess.run([sys.executable, "-c", CHILD, archive], env=env,
+                         stdout=subprocess.PIPE, check=True).stdout.decode().split()
+    return int(out[0]), int(out[1]), out[2] == "True"
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.join(tmpdir, "app.zip")
+        index = archive + ".index"
+        write_archive(archive, 1)
+
+        # the index is opt-in
+        assert run(dict(os.environ), archive) == (1, 2, True)
+        assert not os.path.exists(index)
+
+        env = dict(os.environ, PYSTON_ZIPIMPORT_INDEX="1")
+        assert run(env, archive) == (1, 2, True)
+        assert os.path.exists(index)
+        assert run(env, archive) == (1, 2, False)
+
+        # the index contains the same toc entries as the archive
+        files = zipimport._read_index(archive, os.stat(archive))
+        assert files == zipimport._read_directory(archive), files
+
+        # a changed archive gets parsed again
+        write_archive(archive, 10)
+        st = os.stat(archive)
+        os.utime(archive, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+        assert run(env, archive) == (10, 11, True)
+        assert run(env, archive) == (10, 11, False)
+
+        # a broken index is ignored
+        with open(index, "wb") as f:
+            f.write(b"broken")
+        assert run(env, archive) == (10, 11, True)
+
+        # the archive stays open for reading the files until its directory changes
+        importer = zipimport.zipimporter(archive)
+        assert importer.get_data("zmod.py") == b"value = 10\n"
+        files, fd = zipimport._zip_fd_cache[archive]
+        assert importer.get_data("zpkg/sub.py") == b"value = 11\n"
+        assert zipimport._zip_fd_cache[archive] == (files, fd)
+        zipimport._zip_directory_cache.clear()
+        importer = zipimport.zipimporter(archive)
+        assert archive not in zipimport._zip_fd_cache
+        assert importer.get_data("zmod.py") == b"value = 10\n"
@@ -0,0 +1,342 @@
+"""
+Offline benchmark regression check between two interpreters.
+
+Runs the macrobenchmarks (if the pyston/macrobenchmarks submodule is checked out)
+and Tools/iobench, Tools/stringbench and Tools/importbench alternately against a
+baseline and a changed interpreter, appends the results to a local history file
+and reports which of warmup time, mean latency, p99 latency and max RSS got
+significantly worse.
+
+A metric counts as regressed if the whole bootstrapped confidence interval of its
+relative change is above --threshold. The exit code is 1 if there is any
+regression so this can be used to gate a build.
+
+Usage:
+    python3 regression.py BASELINE_PYTHON CHANGED_PYTHON [--runs N] [--benchmarks a,b]
+
+Only the python standard library is used, in contrast to analyze.py.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+join = os.path.join
+def rel(path):
+    return join(os.path.dirname(os.path.abspath(__file__)), path)
+
+MACROBENCHMARKS_DIR = rel("../../macrobenchmarks/benchmarks")
+TOOLS_DIR = rel("../../../Tools")
+HISTORY_FILE = rel("history.jsonl")
+
+# name -> number of iterations, same as used by the Makefile
+MACROBENCHMARKS = {
+    "flaskblogging": 80000,
+    "pylint": 200,
+    "djangocms": 10000,
+    "mypy": 100,
+    "pycparser": 50,
+    "pytorch_alexnet_inference": 1000,
+    "gunicorn": 10000,
+    "aiohttp": 10000,
+    "json": 1000,
+    "thrift": 10000,
+    "kinto": 30000,
+}
+
+# name -> arguments. These don't report per iteration timings so we can only
+# measure how long the whole process took.
+TOOL_BENCHMARKS = {
+    "iobench": ["iobench/iobench.py", "--read", "--binary"],
+    "stringbench": ["stringbench/stringbench.py", "--skip-re"],
+    "importbench": ["importbench/importbench.py"],
+}
+
+# all metrics are 'lower is better'
+METRICS = ("warmup", "mean", "p99", "maxrss")
+UNITS = {"warmup": "s", "mean": "ms", "p99": "ms", "maxrss": "MB"}
+
+class FailedException(Exception):
+    pass
+
+def quantile(values, q):
+    # linear interpolation, same as np.quantile
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+# Same as analyze.determineWarmup(), returns the index of the first iteration after warmup.
+def determineWarmup(timings, window):
+    final_lookback = int(len(timings) * 0.25)
+    final_latency = (timings[-1] - timings[-1 - final_lookback]) / final_lookback
+    for i in range(len(timings) - window):
+        if (timings[i + window] - timings[i]) / window < 1.05 * final_latency:
+            return i + window // 2
+    return len(timings) - 1
+
+def calculateWindow(timings):
+    return max(1, int(len(timings) / 100))
+
+def runProcess(args, cwd):
+    """
+    Returns the wall time in seconds and the max RSS in MB of the process.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        # importbench measures imports with bytecode caching
+        env = dict(os.environ)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        p = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        # use wait4() so that we get the max RSS of this process only
+        _, status, rusage = os.wait4(p.pid, 0)
+        elapsed = time.perf_counter() - start
+        # we reaped the process ourselves, don't let Popen wait for it again
+        p.returncode = status
+        if status != 0:
+            stderr.seek(0)
+            raise FailedException(stderr.read().decode(errors="replace")[-2000:])
+    return elapsed, rusage.ru_maxrss * 0.001
+
+def runMacrobenchmark(python, name, scale, tmpdir):
+    script = join(MACROBENCHMARKS_DIR, "bm_%s" % name, "run_benchmark.py")
+    outfile = join(tmpdir, "%s.json" % name)
+    n = max(10, int(MACROBENCHMARKS[name] * scale))
+    _, maxrss = runProcess([python, script, "--legacy", str(n), outfile], tmpdir)
+    with open(outfile) as f:
+        data = f.read()
+    if data == "failed\n":
+        raise FailedException(data)
+    timings = json.loads(data)
+
+    window = calculateWindow(timings)
+    warmup_done_idx = determineWarmup(timings, window)
+    if warmup_done_idx > max(2, window):
+        warmup = timings[warmup_done_idx] - timings[0]
+        timings = timings[warmup_done_idx:]
+    else:
+        warmup = 0.0
+    latencies = [b - a for a, b in zip(timings, timings[1:])]
+    return {
+        "warmup": warmup,
+        "mean": 1000.0 * statistics.mean(latencies),
+        "p99": 1000.0 * quantile(latencies, 0.99),
+        "maxrss": maxrss,
+    }
+
+def runToolBenchmark(python, name, tmpdir):
+    args = list(TOOL_BENCHMARKS[name])
+    args[0] = join(TOOLS_DIR, args[0])
+    # iobench creates its input files in the current directory
+    elapsed, maxrss = runProcess([python] + args, tmpdir)
+    return {"mean": 1000.0 * elapsed, "maxrss": maxrss}
+
+def availableBenchmarks():
+    names = list(TOOL_BENCHMARKS)
+    if os.path.isdir(MACROBENCHMARKS_DIR):
+        names += [name for name in MACROBENCHMARKS if os.path.isdir(join(MACROBENCHMARKS_DIR, "bm_%s" % name))]
+    return names
+
+def getVersion(python):
+    return subprocess.check_output([python, "-c", "import sys; print(sys.version)"]).decode().strip()
+
+def bootstrapChange(base, changed, confidence, rounds=2000):
+    """
+    Returns the relative change of the mean from base to changed and
+    its confidence interval (by resampling the runs).
+    """
+    mean = statistics.mean
+    if mean(base) == 0:
+        return None
+    rng = random.Random(0)
+    estimate = mean(changed) / mean(base) - 1
+    samples = []
+    for _ in range(rounds):
+        base_mean = mean(rng.choices(base, k=len(base)))
+        if base_mean == 0:
+            continue
+        samples.append(mean(rng.choices(changed, k=len(changed))) / base_mean - 1)
+    samples.sort()
+    lo = samples[int((1 - confidence) / 2 * len(samples))]
+    hi = samples[int((1 + confidence) / 2 * len(samples)) - 1]
+    return estimate, lo, hi
+
+def loadHistory(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def appendHistory(path, record):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def latestRuns(history, label, bench, runs, scale):
+    """
+    Returns the results of the latest history entry of 'label' which ran 'bench'
+    with the same --runs and --scale, or None.
+    """
+    for record in reversed(history):
+        if record["label"] != label or record.get("runs") != runs or record.get("scale") != scale:
+            continue
+        if len(record["results"].get(bench, [])) >= runs:
+            return record["results"][bench]
+    return None
+
+def compare(bench, base_runs, changed_runs, confidence, threshold):
+    """
+    Prints the comparison table and returns the list of regressed metrics.
+    """
+    regressions = []
+    print(bench)
+    print("  %-8s %12s %12s %9s   %-22s" % ("metric", "baseline", "changed", "change", "%d%% CI" % (confidence * 100)))
+    for metric in METRICS:
+        base = [r[metric] for r in base_runs if metric in r]
+        changed = [r[metric] for r in changed_runs if metric in r]
+        if not base or not changed:
+            continue
+        r = bootstrapChange(base, changed, confidence)
+        unit = UNITS[metric]
+        base_str = "%.1f%s" % (statistics.mean(base), unit)
+        changed_str = "%.1f%s" % (statistics.mean(changed), unit)
+        if r is None:
+            print("  %-8s %12s %12s" % (metric, base_str, changed_str))
+            continue
+        estimate, lo, hi = r
+        if lo > threshold:
+            verdict = "REGRESSION"
+            regressions.append(metric)
+        elif hi < -threshold:
+            verdict = "improvement"
+        else:
+            verdict = ""
+        ci = "[%+.1f%%, %+.1f%%]" % (100.0 * lo, 100.0 * hi)
+        print("  %-8s %12s %12s %+8.1f%%   %-22s %s" % (metric, base_str, changed_str, 100.0 * estimate, ci, verdict))
+    print()
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Check for benchmark regressions between two interpreters")
+    parser.add_argument("baseline", help="baseline python executable")
+    parser.add_argument("changed", help="python executable to check")
+    parser.add_argument("--benchmarks", default=None,
+                        help="comma separated list of benchmarks, default: all available (%s)" % ",".join(availableBenchmarks()))
+    parser.add_argument("--runs", type=int, default=5, help="number of processes per benchmark and interpreter")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale the number of macrobenchmark iterations")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--threshold", type=float, default=0.02,
+                        help="relative change which has to be exceeded by the whole confidence interval")
+    parser.add_argument("--history", default=HISTORY_FILE, help="file the results get appended to")
+    parser.add_argument("--baseline-label", default=None, help="name of the baseline in the history, default: its path")
+    parser.add_argument("--changed-label", default=None, help="name of the changed interpreter in the history, default: its path")
+    parser.add_argument("--reuse-baseline", action="store_true",
+                        help="take the baseline results from the latest history entry with the same label, --runs and --scale instead of rerunning it")
+    parser.add_argument("--tune", action="store_true", help="use tune.py to reduce the noise of the system while running")
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks.split(",") if args.benchmarks else availableBenchmarks()
+    for bench in benchmarks:
+        if bench not in TOOL_BENCHMARKS and bench not in MACROBENCHMARKS:
+            parser.error("unknown benchmark: %s" % bench)
+
+    pythons = {
+        "baseline": os.path.abspath(args.baseline) if os.sep in args.baseline else args.baseline,
+        "changed": os.path.abspath(args.changed) if os.sep in args.changed else args.changed,
+    }
+    labels = {
+        "baseline": args.baseline_label or pythons["baseline"],
+        "changed": args.changed_label or pythons["changed"],
+    }
+    versions = {}
+    for which, python in pythons.items():
+        versions[which] = getVersion(python)
+        print("%s: %s (%s)" % (which, labels[which], versions[which].split("\n")[0]))
+    print()
+
+    history = loadHistory(args.history)
+    results = {"baseline": {}, "changed": {}}
+    failed = {"baseline": set(), "changed": set()}
+    reused = set()
+
+    if args.tune:
+        sys.path.append(rel(".."))
+        import tune
+        tune.tune()
+    try:
+        for bench in benchmarks:
+            to_run = ["baseline", "changed"]
+            if args.reuse_baseline:
+                prev = latestRuns(history, labels["baseline"], bench, args.runs, args.scale)
+                if prev is not None:
+                    results["baseline"][bench] = prev
+                    reused.add(bench)
+                    to_run.remove("baseline")
+
+            # alternate between the interpreters so that slow drifts of the
+            # machine performance affect both the same way
+            for i in range(args.runs):
+                for which in to_run:
+                    if bench in failed[which]:
+                        continue
+                    print("\r%s: run %d/%d %s    " % (bench, i + 1, args.runs, which), end="", file=sys.stderr)
+                    sys.stderr.flush()
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        try:
+                            if bench in TOOL_BENCHMARKS:
+                                r = runToolBenchmark(pythons[which], bench, tmpdir)
+                            else:
+                                r = runMacrobenchmark(pythons[which], bench, args.scale, tmpdir)
+                        except FailedException as e:
+                            print("\n%s failed on %s:\n%s" % (bench, which, e), file=sys.stderr)
+                            failed[which].add(bench)
+                            continue
+                    results[which].setdefault(bench, []).append(r)
+            print("\r" + " " * 60 + "\r", end="", file=sys.stderr)
+    finally:
+        if args.tune:
+            tune.untune()
+
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    for which in ("baseline", "changed"):
+        runs = {bench: r for bench, r in results[which].items() if which == "changed" or bench not in reused}
+        if not runs:
+            continue
+        appendHistory(args.history, {
+            "time": now,
+            "label": labels[which],
+            "python": pythons[which],
+            "version": versions[which],
+            "runs": args.runs,
+            "scale": args.scale,
+            "results": runs,
+        })
+
+    regressions = []
+    for bench in benchmarks:
+        if bench in failed["changed"] and bench not in failed["baseline"]:
+            print("%s\n  failed on the changed interpreter\n" % bench)
+            regressions.append((bench, "failed"))
+            continue
+        if bench not in results["baseline"] or bench not in results["changed"]:
+            print("%s\n  failed\n" % bench)
+            continue
+        for metric in compare(bench, results["baseline"][bench], results["changed"][bench], args.confidence, args.threshold):
+            regressions.append((bench, metric))
+
+    if regressions:
+        print("Regressions: %s" % ", ".join("%s:%s" % r for r in regressions))
+        return 1
+    print("No significant regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())